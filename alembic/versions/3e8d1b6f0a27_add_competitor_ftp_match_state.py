@@ -0,0 +1,33 @@
+"""add competitor ftp match state (incremental matching watermark)
+
+Revision ID: 3e8d1b6f0a27
+Revises: 1f2c9c8e3e1b
+Create Date: 2026-10-18 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3e8d1b6f0a27"
+down_revision: Union[str, None] = "1f2c9c8e3e1b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "competitor_ftp_match_state",
+        sa.Column("source", sa.String(length=128), nullable=False),
+        sa.Column("last_record_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("matched_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("source"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("competitor_ftp_match_state")
@@ -0,0 +1,29 @@
+"""add size and content hash to competitor ftp files
+
+Revision ID: 4b7e2d9c1a56
+Revises: 8d3c5a7e1f40
+Create Date: 2026-10-18 14:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "4b7e2d9c1a56"
+down_revision: Union[str, None] = "8d3c5a7e1f40"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("competitor_ftp_file", sa.Column("size", sa.BigInteger(), nullable=True))
+    op.add_column(
+        "competitor_ftp_file", sa.Column("content_hash", sa.String(length=64), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("competitor_ftp_file", "content_hash")
+    op.drop_column("competitor_ftp_file", "size")
@@ -0,0 +1,43 @@
+"""add competitor name feature cache
+
+Revision ID: 6a1f4c2e9b83
+Revises: 3e8d1b6f0a27
+Create Date: 2026-10-18 11:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "6a1f4c2e9b83"
+down_revision: Union[str, None] = "3e8d1b6f0a27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "competitor_name_feature",
+        sa.Column("name_hash", sa.String(length=40), nullable=False),
+        sa.Column("brand", sa.String(length=100), nullable=True),
+        sa.Column("models", sa.Text(), nullable=True),
+        sa.Column("quality", sa.String(length=50), nullable=True),
+        sa.Column("display_type", sa.String(length=50), nullable=True),
+        sa.Column("in_frame", sa.Boolean(), nullable=True),
+        sa.Column("variant", sa.String(length=50), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name_hash"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("competitor_name_feature")
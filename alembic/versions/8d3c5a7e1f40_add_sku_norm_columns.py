@@ -0,0 +1,104 @@
+"""add normalized sku columns
+
+Revision ID: 8d3c5a7e1f40
+Revises: 6a1f4c2e9b83
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.sku import sku_norm_or_none
+
+# revision identifiers, used by Alembic.
+revision: str = "8d3c5a7e1f40"
+down_revision: Union[str, None] = "6a1f4c2e9b83"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK = 10_000
+
+# (таблица, исходная колонка, нормализованная колонка, длина)
+SKU_COLUMNS = (
+    ("product", "sku", "sku_norm", 64),
+    ("competitor_ftp_record", "sku", "sku_norm", 255),
+    ("productmatchoverride", "competitor_sku", "competitor_sku_norm", 128),
+)
+
+
+_ASCII_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _backfill_postgresql_ascii(table: str, source: str, target: str) -> None:
+    # Быстрый путь только для артикулов из печатных ASCII-символов: для них SQL
+    # совпадает с app.core.sku.normalize_sku при любой collation (из пробельных
+    # есть только пробел, регистр меняется translate, а не lower()). Остальные
+    # строки (кириллица, NBSP, тире) досчитывает _backfill_python.
+    op.execute(
+        f"""
+        UPDATE {table}
+        SET {target} = NULLIF(
+            replace(translate({source}, '{_ASCII_UPPER}', '{_ASCII_UPPER.lower()}'), ' ', ''),
+            ''
+        )
+        WHERE {source} ~ '^[ -~]*$'
+        """
+    )
+
+
+def _backfill_python(table: str, source: str, target: str) -> None:
+    # нормализует через sku_norm_or_none все строки, ещё не получившие значение
+    bind = op.get_bind()
+    tbl = sa.table(table, sa.column("id"), sa.column(source), sa.column(target))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(tbl.c.id, tbl.c[source])
+            .where(tbl.c.id > last_id, tbl.c[source].is_not(None), tbl.c[target].is_(None))
+            .order_by(tbl.c.id)
+            .limit(BACKFILL_CHUNK)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        bind.execute(
+            tbl.update()
+            .where(tbl.c.id == sa.bindparam("row_id"))
+            .values({target: sa.bindparam("value")}),
+            [{"row_id": row.id, "value": sku_norm_or_none(row[1])} for row in rows],
+        )
+
+
+def upgrade() -> None:
+    for table, _, target, length in SKU_COLUMNS:
+        op.add_column(table, sa.Column(target, sa.String(length=length), nullable=True))
+
+    is_postgresql = op.get_bind().dialect.name == "postgresql"
+    for table, source, target, _ in SKU_COLUMNS:
+        if is_postgresql:
+            _backfill_postgresql_ascii(table, source, target)
+        _backfill_python(table, source, target)
+
+    op.create_index(op.f("ix_product_sku_norm"), "product", ["sku_norm"], unique=False)
+    op.create_index(
+        op.f("ix_competitor_ftp_record_sku_norm"),
+        "competitor_ftp_record",
+        ["sku_norm"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_product_match_override_source_sku_norm",
+        "productmatchoverride",
+        ["competitor_source", "competitor_sku_norm"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_product_match_override_source_sku_norm", table_name="productmatchoverride")
+    op.drop_index(op.f("ix_competitor_ftp_record_sku_norm"), table_name="competitor_ftp_record")
+    op.drop_index(op.f("ix_product_sku_norm"), table_name="product")
+    for table, _, target, _ in reversed(SKU_COLUMNS):
+        op.drop_column(table, target)
@@ -0,0 +1,35 @@
+"""archive competitor ftp raw rows per file
+
+Revision ID: 9e1f3b6d2c84
+Revises: 4b7e2d9c1a56
+Create Date: 2026-10-18 16:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "9e1f3b6d2c84"
+down_revision: Union[str, None] = "4b7e2d9c1a56"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("competitor_ftp_file", sa.Column("raw_archive", sa.LargeBinary(), nullable=True))
+    op.add_column("competitor_ftp_record", sa.Column("row_index", sa.Integer(), nullable=True))
+    op.alter_column(
+        "competitor_ftp_record", "raw_row_id", existing_type=sa.Integer(), nullable=True
+    )
+
+
+def downgrade() -> None:
+    # у записей архивированных файлов нет сырой строки, на которую можно сослаться
+    op.execute("DELETE FROM competitor_ftp_record WHERE raw_row_id IS NULL")
+    op.alter_column(
+        "competitor_ftp_record", "raw_row_id", existing_type=sa.Integer(), nullable=False
+    )
+    op.drop_column("competitor_ftp_record", "row_index")
+    op.drop_column("competitor_ftp_file", "raw_archive")
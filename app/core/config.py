@@ -39,8 +39,19 @@ class Settings(BaseSettings):
     competitor_ftp_password: Optional[str] = None
     competitor_ftp_tls: bool = False
     competitor_ftp_timeout_sec: float = 30.0
-    competitor_ftp_sources: Optional[str] = None  # name:directory:pattern with {date}, comma-separated
+    # name:directory:pattern with {date}, comma-separated
+    competitor_ftp_sources: Optional[str] = None
     competitor_ftp_max_files_per_source: int = 2
+    competitor_ftp_xlsx_reader: str = "openpyxl"  # openpyxl | xml | calamine
+    competitor_ftp_download_workers: int = 1  # FTP connections listing/downloading in parallel
+    competitor_ftp_spool_downloads: bool = True  # download into temp files instead of memory
+    competitor_ftp_spool_dir: Optional[str] = None  # temp dir for spooled downloads
+    competitor_ftp_download_retries: int = 3  # resumed (REST) retries of a dropped transfer
+    competitor_ftp_cache_dir: Optional[str] = None  # local download cache; unset = off
+    competitor_ftp_cache_max_mb: int = 2048
+    competitor_ftp_cache_max_age_days: int = 30
+    competitor_ftp_delta_ingest: bool = False  # diff re-uploads by (sku, link) instead of rewriting
+    competitor_ftp_raw_archive: bool = False  # raw rows as a gzip blob; invalid rows stay in table
     captcha_provider: str = "2captcha"
     captcha_api_key: Optional[str] = None
 
@@ -68,6 +79,13 @@ class Settings(BaseSettings):
     # TopControl categories filter (comma-separated ids)
     topcontrol_category_whitelist: Optional[str] = None
     match_subject_whitelist: Optional[str] = None
+    competitor_match_write_chunk_size: int = 1000
+    competitor_match_feature_cache_enabled: bool = True
+    competitor_match_workers: int = 1
+    competitor_match_read_chunk_size: int = 5000
+    competitor_match_fuzzy_enabled: bool = False
+    competitor_match_fuzzy_threshold: float = 0.4
+    competitor_match_sql_sku_stage: bool = True
 
     # Yandex Direct / demand
     yandex_direct_api_token: Optional[str] = None
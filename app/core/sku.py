@@ -0,0 +1,35 @@
+"""Нормализация артикулов для сопоставления по SKU."""
+from __future__ import annotations
+
+import re
+from typing import Callable, Optional
+
+_WHITESPACE_RE = re.compile(r"[\s\t\n\r]+")
+
+
+def normalize_sku(value: Optional[str]) -> str:
+    """Приводит артикул к виду для сравнения: нижний регистр, без пробелов, тире -> дефис."""
+    if not value:
+        return ""
+    s = str(value).strip().lower()
+    s = s.replace("–", "-").replace("—", "-")
+    return _WHITESPACE_RE.sub("", s)
+
+
+def sku_norm_or_none(value: Optional[str]) -> Optional[str]:
+    """Значение для колонки sku_norm: пустой артикул хранится как NULL."""
+    return normalize_sku(value) or None
+
+
+def sku_norm_default(source_column: str) -> Callable:
+    """
+    Контекстный default для колонки sku_norm при Core-вставках (insert(table), bulk).
+
+    ORM-объекты заполняют sku_norm через @validates, этот default срабатывает,
+    когда значение не передано явно.
+    """
+
+    def _default(context) -> Optional[str]:
+        return sku_norm_or_none(context.get_current_parameters().get(source_column))
+
+    return _default
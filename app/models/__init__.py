@@ -3,9 +3,11 @@ from app.models.competitor import Competitor
 from app.models.competitor_price import CompetitorPrice
 from app.models.competitor_ftp import (
     CompetitorFtpFile,
+    CompetitorFtpMatchState,
     CompetitorFtpRawRow,
     CompetitorFtpRecord,
 )
+from app.models.competitor_name_feature import CompetitorNameFeature
 from app.models.price_recommendation import PriceRecommendation
 from app.models.pricing_strategy_version import PricingStrategyVersion
 from app.models.product_match import ProductMatch
@@ -23,8 +25,10 @@ __all__ = [
     "Competitor",
     "CompetitorPrice",
     "CompetitorFtpFile",
+    "CompetitorFtpMatchState",
     "CompetitorFtpRawRow",
     "CompetitorFtpRecord",
+    "CompetitorNameFeature",
     "ProductMatch",
     "ProductMatchOverride",
     "PriceRecommendation",
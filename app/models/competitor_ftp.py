@@ -4,19 +4,22 @@ from datetime import date, datetime
 from typing import Optional
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Date,
     DateTime,
     ForeignKey,
     Integer,
+    LargeBinary,
     Numeric,
     String,
     Text,
     UniqueConstraint,
     func,
 )
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 
+from app.core.sku import sku_norm_default, sku_norm_or_none
 from app.models.base import Base
 
 
@@ -28,6 +31,8 @@ class CompetitorFtpFile(Base):
     file_path: Mapped[str] = mapped_column(String(1024), nullable=False)
     file_date: Mapped[date] = mapped_column(Date, nullable=False)
     mtime: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    size: Mapped[Optional[int]] = mapped_column(BigInteger)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64))  # sha256 hex
     ingested_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
     )
@@ -35,6 +40,8 @@ class CompetitorFtpFile(Base):
     rows_valid: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     rows_invalid: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     date_mismatch: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    # gzip JSON lines всех строк, если сырые строки архивируются, а не хранятся построчно
+    raw_archive: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True)
 
     rows = relationship(
         "CompetitorFtpRawRow",
@@ -82,9 +89,9 @@ class CompetitorFtpRawRow(Base):
 class CompetitorFtpRecord(Base):
     __tablename__ = "competitor_ftp_record"
 
-    raw_row_id: Mapped[int] = mapped_column(
+    # NULL, если сырые строки файла лежат в CompetitorFtpFile.raw_archive
+    raw_row_id: Mapped[Optional[int]] = mapped_column(
         ForeignKey("competitor_ftp_raw_row.id", ondelete="CASCADE"),
-        nullable=False,
         unique=True,
     )
     file_id: Mapped[int] = mapped_column(
@@ -92,10 +99,14 @@ class CompetitorFtpRecord(Base):
         nullable=False,
         index=True,
     )
+    row_index: Mapped[Optional[int]] = mapped_column(Integer)
     source: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
     file_date: Mapped[date] = mapped_column(Date, nullable=False, index=True)
     group_name: Mapped[Optional[str]] = mapped_column(String(255))
     sku: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
+    sku_norm: Mapped[Optional[str]] = mapped_column(
+        String(255), index=True, default=sku_norm_default("sku")
+    )
     name: Mapped[Optional[str]] = mapped_column(String(1024))
     price_opt: Mapped[Optional[float]] = mapped_column(Numeric(12, 2))
     price_roz: Mapped[Optional[float]] = mapped_column(Numeric(12, 2))
@@ -109,3 +120,17 @@ class CompetitorFtpRecord(Base):
     raw_row = relationship("CompetitorFtpRawRow", back_populates="record")
     file = relationship("CompetitorFtpFile", back_populates="records")
 
+    @validates("sku")
+    def _sync_sku_norm(self, key: str, value: str) -> str:
+        self.sku_norm = sku_norm_or_none(value)
+        return value
+
+
+class CompetitorFtpMatchState(Base):
+    """Водяной знак матчинга: последний обработанный competitor_ftp_record.id по источнику."""
+
+    __tablename__ = "competitor_ftp_match_state"
+
+    source: Mapped[str] = mapped_column(String(128), nullable=False, unique=True)
+    last_record_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    matched_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
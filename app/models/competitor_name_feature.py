@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Boolean, DateTime, String, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class CompetitorNameFeature(Base):
+    """Кэш разобранных признаков названия (бренд, модели, качество, тип дисплея, рамка)."""
+
+    __tablename__ = "competitor_name_feature"
+
+    name_hash: Mapped[str] = mapped_column(String(40), nullable=False, unique=True)
+    brand: Mapped[Optional[str]] = mapped_column(String(100))
+    models: Mapped[Optional[str]] = mapped_column(Text)
+    quality: Mapped[Optional[str]] = mapped_column(String(50))
+    display_type: Mapped[Optional[str]] = mapped_column(String(50))
+    in_frame: Mapped[Optional[bool]] = mapped_column(Boolean)
+    variant: Mapped[Optional[str]] = mapped_column(String(50))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
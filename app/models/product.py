@@ -1,13 +1,18 @@
 from typing import List, Optional
 
 from sqlalchemy import String
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 
+from app.core.sku import sku_norm_default, sku_norm_or_none
 from app.models.base import Base
 
 
 class Product(Base):
     sku: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    # нормализованный артикул (app.core.sku) для сопоставления по SKU в SQL
+    sku_norm: Mapped[Optional[str]] = mapped_column(
+        String(64), index=True, default=sku_norm_default("sku")
+    )
     name: Mapped[str] = mapped_column(String(255))
     brand: Mapped[Optional[str]] = mapped_column(String(100))
     category: Mapped[Optional[str]] = mapped_column(String(100))
@@ -28,3 +33,8 @@ class Product(Base):
     matches: Mapped[List["ProductMatch"]] = relationship(
         "ProductMatch", back_populates="product", cascade="all, delete-orphan"
     )
+
+    @validates("sku")
+    def _sync_sku_norm(self, key: str, value: str) -> str:
+        self.sku_norm = sku_norm_or_none(value)
+        return value
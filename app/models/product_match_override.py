@@ -3,20 +3,26 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import DateTime, ForeignKey, String, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import DateTime, ForeignKey, Index, String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 
+from app.core.sku import sku_norm_default, sku_norm_or_none
 from app.models.base import Base
 
 
 class ProductMatchOverride(Base):
     competitor_source: Mapped[str] = mapped_column(String(128), nullable=False)
     competitor_sku: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    competitor_sku_norm: Mapped[Optional[str]] = mapped_column(
+        String(128), nullable=True, default=sku_norm_default("competitor_sku")
+    )
     brand: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     model: Mapped[Optional[str]] = mapped_column(String(150), nullable=True)
     variant: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
     product_id: Mapped[Optional[int]] = mapped_column(ForeignKey("product.id"), nullable=True)
-    phone_model_id: Mapped[Optional[int]] = mapped_column(ForeignKey("phone_models.id"), nullable=True)
+    phone_model_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("phone_models.id"), nullable=True
+    )
     quality: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
     note: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
@@ -31,5 +37,12 @@ class ProductMatchOverride(Base):
             "competitor_sku",
             name="uq_product_match_override_source_sku",
         ),
+        Index(
+            "ix_product_match_override_source_sku_norm", "competitor_source", "competitor_sku_norm"
+        ),
     )
 
+    @validates("competitor_sku")
+    def _sync_competitor_sku_norm(self, key: str, value: Optional[str]) -> Optional[str]:
+        self.competitor_sku_norm = sku_norm_or_none(value)
+        return value
@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import re
-from dataclasses import dataclass
-from datetime import date, timedelta
-from typing import Dict, List, Optional, Sequence, Tuple
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, fields
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from sqlalchemy import Select, and_, select
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, exists, false, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, aliased
 
 from app.models import (
     Competitor,
+    CompetitorFtpMatchState,
     CompetitorFtpRecord,
+    CompetitorNameFeature,
     CompetitorPrice,
     Product,
     ProductMatch,
@@ -19,50 +24,189 @@ from app.models import (
     ProductMatchOverride,
 )
 
+if TYPE_CHECKING:
+    from app.services.name_similarity import TrigramSimilarity
+
 logger = logging.getLogger("app.matching.competitor_ftp")
 
 
+class _StageTimer:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler: "StageProfiler", name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.add(self.name, time.perf_counter() - self.started)
+
+
+class StageProfiler:
+    """
+    Накопительные замеры стадий прогона: суммарное время и число входов.
+
+    Выключенный профайлер отдаёт пустой контекст, так что замеры в горячем цикле
+    ничего не стоят, пока профилирование не запрошено.
+    """
+
+    _noop = nullcontext()
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return self._noop
+        return _StageTimer(self, name)
+
+    def add(self, name: str, seconds: float, count: int = 1) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def as_dict(self) -> dict:
+        return {
+            name: {"seconds": round(seconds, 4), "count": self.counts[name]}
+            for name, seconds in self.seconds.items()
+        }
+
+
 @dataclass
 class MatchStats:
     processed: int = 0
     matched: int = 0
     prices_created: int = 0
+    prices_updated: int = 0
     matches_created: int = 0
     unmatched: int = 0
     ambiguous: int = 0
     skipped_no_price: int = 0
+    feature_cache_hits: int = 0
+    feature_cache_misses: int = 0
+    phone_models_created: int = 0
+    fuzzy_matched: int = 0
+    sql_matched: int = 0
+    chunks: int = 0
 
     def as_dict(self) -> dict:
         return {
             "processed": self.processed,
             "matched": self.matched,
             "prices_created": self.prices_created,
+            "prices_updated": self.prices_updated,
             "matches_created": self.matches_created,
             "unmatched": self.unmatched,
             "ambiguous": self.ambiguous,
             "skipped_no_price": self.skipped_no_price,
+            "feature_cache_hits": self.feature_cache_hits,
+            "feature_cache_misses": self.feature_cache_misses,
+            "phone_models_created": self.phone_models_created,
+            "fuzzy_matched": self.fuzzy_matched,
+            "sql_matched": self.sql_matched,
+            "chunks": self.chunks,
         }
 
 
-def _normalize_sku(value: Optional[str]) -> str:
-    if not value:
-        return ""
-    s = str(value).strip().lower()
-    s = s.replace("–", "-").replace("—", "-")
-    s = re.sub(r"[\s\t\n\r]+", "", s)
-    return s
+def merge_match_results(results: Sequence[dict], max_samples: int = 20) -> dict:
+    """Сводит результаты match_competitor_ftp_records по шардам в один ответ."""
+    done = [result for result in results if not result.get("skipped")]
+    if not done:
+        return {"skipped": True, "reason": "no_records"}
+    merged = MatchStats()
+    for result in done:
+        for item in fields(MatchStats):
+            setattr(merged, item.name, getattr(merged, item.name) + result.get(item.name, 0))
+    modes = {result.get("mode") for result in done}
+    merged_result = {
+        "skipped": False,
+        "mode": modes.pop() if len(modes) == 1 else "mixed",
+        **merged.as_dict(),
+        "unmatched_samples": [s for r in done for s in r.get("unmatched_samples", [])][
+            :max_samples
+        ],
+        "ambiguous_samples": [s for r in done for s in r.get("ambiguous_samples", [])][
+            :max_samples
+        ],
+    }
+    profiles = [result["profile"] for result in done if "profile" in result]
+    if profiles:
+        # время стадий суммируется: это процессорное время шардов, а не wall time прогона;
+        # шарды идут параллельно, поэтому общее время прогона — максимум по шардам
+        profiler = StageProfiler()
+        for profile in profiles:
+            for name, item in profile.items():
+                if name != "total_seconds":
+                    profiler.add(name, item["seconds"], item["count"])
+        merged_result["profile"] = {
+            "total_seconds": max(profile.get("total_seconds", 0.0) for profile in profiles),
+            **profiler.as_dict(),
+        }
+    return merged_result
 
 
-def _load_products_by_sku(session: Session, subject_whitelist: Optional[set[str]] = None) -> Dict[str, List[Product]]:
-    products: Dict[str, List[Product]] = {}
-    for product in session.execute(select(Product)).scalars():
-        if subject_whitelist and product.subject not in subject_whitelist:
-            continue
-        key = _normalize_sku(product.sku)
-        if not key:
-            continue
-        products.setdefault(key, []).append(product)
-    return products
+@dataclass(frozen=True)
+class ProductRef:
+    """
+    Снимок полей товара, нужных матчеру.
+
+    В отличие от ORM-объекта не истекает после commit, поэтому переживает
+    покомпонентную фиксацию чанков и не держит товары в identity map сессии.
+    """
+
+    id: int
+    sku_norm: Optional[str]
+    name: Optional[str]
+    quality: Optional[str]
+    display_type: Optional[str]
+    in_frame: Optional[str]
+
+
+PRODUCT_REF_COLUMNS = (
+    Product.id,
+    Product.sku_norm,
+    Product.name,
+    Product.quality,
+    Product.display_type,
+    Product.in_frame,
+)
+
+
+def _product_ref(row) -> ProductRef:
+    return ProductRef(
+        id=row.id,
+        sku_norm=row.sku_norm,
+        name=row.name,
+        quality=row.quality,
+        display_type=row.display_type,
+        in_frame=row.in_frame,
+    )
+
+
+def _load_product_refs(
+    session: Session, subject_whitelist: Optional[set[str]] = None
+) -> List[ProductRef]:
+    query = select(*PRODUCT_REF_COLUMNS).order_by(Product.id)
+    if subject_whitelist:
+        query = query.where(Product.subject.in_(list(subject_whitelist)))
+    return [_product_ref(row) for row in session.execute(query)]
+
+
+def _load_products_by_sku(
+    session: Session,
+    subject_whitelist: Optional[set[str]] = None,
+    products: Optional[Sequence[ProductRef]] = None,
+) -> Dict[str, List[ProductRef]]:
+    if products is None:
+        products = _load_product_refs(session, subject_whitelist)
+    by_sku: Dict[str, List[ProductRef]] = {}
+    for product in products:
+        if product.sku_norm:
+            by_sku.setdefault(product.sku_norm, []).append(product)
+    return by_sku
 
 
 BRAND_SYNONYMS = {
@@ -161,6 +305,11 @@ QUALITY_MAP = {
 
 APPLE_MODEL_SKIP_TOKENS = {"iphone", "ipad", "ipod"}
 APPLE_A_CODE_RE = re.compile(r"a\d{4,5}", re.IGNORECASE)
+NAME_TOKEN_RE = re.compile(r"[a-z0-9а-яё]+")
+# первый ASCII-токен из VARIANT_TOKENS: то же, что _extract_variant по re.findall("[A-Za-z0-9]+")
+VARIANT_RE = re.compile(
+    r"(?<![a-z0-9])(" + "|".join(sorted(VARIANT_TOKENS, key=len, reverse=True)) + r")(?![a-z0-9])"
+)
 
 
 def _normalize_model(value: str) -> str:
@@ -174,16 +323,19 @@ def _extract_brand_model(name: Optional[str]) -> Tuple[Optional[str], List[str]]
     lower = name.lower()
     if "дисплей" not in lower:
         return None, []
-    tokens = re.findall(r"[A-Za-z0-9а-яё]+", lower)
+    return _brand_models_from_tokens(NAME_TOKEN_RE.findall(lower))
+
+
+def _brand_models_from_tokens(tokens: List[str]) -> Tuple[Optional[str], List[str]]:
     # попытка найти бренд после "для"
     brand = None
     start_idx = None
-    for idx, tok in enumerate(tokens):
-        if tok == "для" and idx + 1 < len(tokens):
+    if "для" in tokens:
+        idx = tokens.index("для")
+        if idx + 1 < len(tokens):
             brand_token = tokens[idx + 1]
             brand = BRAND_SYNONYMS.get(brand_token, brand_token)
             start_idx = idx + 2
-            break
     # fallback: взять первый встретившийся бренд/синоним, даже без "для"
     if brand is None:
         for idx, tok in enumerate(tokens):
@@ -197,36 +349,41 @@ def _extract_brand_model(name: Optional[str]) -> Tuple[Optional[str], List[str]]
 
     models: List[str] = []
     current: List[str] = []
-
-    def flush_current() -> None:
-        nonlocal current
-        if current:
-            norm = _normalize_model(" ".join(current))
-            if norm:
-                models.append(norm)
-            current = []
-
+    is_apple = brand == "apple"
     for tok in tokens[start_idx:]:
         # новый кандидат модели при повторном упоминании бренда
         if BRAND_SYNONYMS.get(tok) == brand:
-            flush_current()
+            if current:
+                _append_model(models, current)
+                current = []
+            continue
+        if is_apple and (tok in APPLE_MODEL_SKIP_TOKENS or APPLE_A_CODE_RE.fullmatch(tok)):
             continue
-        if brand == "apple":
-            if tok in APPLE_MODEL_SKIP_TOKENS:
-                continue
-            if APPLE_A_CODE_RE.fullmatch(tok):
-                continue
         if not tok or tok in STOP_TOKENS:
             break
         current.append(tok)
-    flush_current()
+    if current:
+        _append_model(models, current)
     return brand, models
 
 
+def _append_model(models: List[str], tokens: List[str]) -> None:
+    # токены уже в нижнем регистре: _normalize_model сводится к отбрасыванию кириллицы
+    if all(tok.isascii() for tok in tokens):
+        norm = "".join(tokens)
+    else:
+        norm = _normalize_model(" ".join(tokens))
+    if norm:
+        models.append(norm)
+
+
 def _extract_quality(name: Optional[str]) -> Optional[str]:
     if not name:
         return None
-    lower = name.lower()
+    return _quality_from_lower(name.lower())
+
+
+def _quality_from_lower(lower: str) -> Optional[str]:
     for token, quality in QUALITY_MAP.items():
         if token in lower:
             return quality
@@ -251,10 +408,14 @@ def _normalize_quality_value(value: Optional[str]) -> Optional[str]:
 def _extract_display_type(name: Optional[str]) -> Optional[str]:
     if not name:
         return None
-    lower = name.lower()
-    if "hard oled" in lower or "hard oled" in lower.replace("-", " "):
+    return _display_type_from_lower(name.lower())
+
+
+def _display_type_from_lower(lower: str) -> Optional[str]:
+    # "hard-oled" эквивалентно проверке "hard oled" в lower.replace("-", " ")
+    if "hard oled" in lower or "hard-oled" in lower:
         return "hard oled"
-    if "soft oled" in lower or "soft oled" in lower.replace("-", " "):
+    if "soft oled" in lower or "soft-oled" in lower:
         return "soft oled"
     if "oled" in lower:
         return "oled"
@@ -268,7 +429,10 @@ def _extract_display_type(name: Optional[str]) -> Optional[str]:
 def _extract_in_frame(name: Optional[str]) -> Optional[bool]:
     if not name:
         return None
-    lower = name.lower()
+    return _in_frame_from_lower(name.lower())
+
+
+def _in_frame_from_lower(lower: str) -> Optional[bool]:
     if "в рамке" in lower:
         return True
     if "без рамки" in lower or "no frame" in lower:
@@ -289,28 +453,268 @@ def _extract_variant(model_tokens: List[str]) -> Tuple[List[str], Optional[str]]
     return filtered, variant
 
 
-def _load_products_by_brand_model(session: Session, subject_whitelist: Optional[set[str]] = None) -> Dict[str, List[Tuple[str, Product]]]:
-    brand_map: Dict[str, List[Tuple[str, Product]]] = {}
-    for product in session.execute(select(Product)).scalars():
-        if subject_whitelist and product.subject not in subject_whitelist:
-            continue
-        brand, models = _extract_brand_model(product.name)
-        if not brand or not models:
-            continue
+def _dialect_insert(session: Session):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+FEATURE_CACHE_VERSION = 1
+IN_QUERY_CHUNK = 500
+FEATURE_MEMO_LIMIT = 200_000
+# победитель нечёткого ранжирования должен опережать второго кандидата хотя бы на столько
+FUZZY_MIN_MARGIN = 0.05
+
+
+@dataclass(frozen=True)
+class NameFeatures:
+    brand: Optional[str] = None
+    models: Tuple[str, ...] = ()
+    quality: Optional[str] = None
+    display_type: Optional[str] = None
+    in_frame: Optional[bool] = None
+    variant: Optional[str] = None
+
+
+EMPTY_FEATURES = NameFeatures()
+
+
+def _extract_name_features(name: Optional[str]) -> NameFeatures:
+    """
+    Все признаки названия за один lower() и одну токенизацию.
+
+    Эквивалентно последовательным вызовам _extract_brand_model/_extract_quality/
+    _extract_display_type/_extract_in_frame/_extract_variant, которые каждый раз заново
+    приводят регистр (а вариант модели требовал второго re.findall). Это не один проход:
+    качество, тип дисплея и рамка по-прежнему ищутся отдельными проверками подстрок в
+    общей строке, они быстрее общей регулярки-альтернации. Повторные названия не
+    разбираются вовсе — их отдаёт NameFeatureCache.
+    """
+    if not name:
+        return EMPTY_FEATURES
+    lower = name.lower()
+    brand: Optional[str] = None
+    models: List[str] = []
+    variant = None
+    if "дисплей" in lower:
+        tokens = NAME_TOKEN_RE.findall(lower)
+        brand, models = _brand_models_from_tokens(tokens)
+        if brand and models:
+            match = VARIANT_RE.search(lower)
+            variant = match.group(1) if match else None
+    return NameFeatures(
+        brand=brand,
+        models=tuple(models),
+        quality=_quality_from_lower(lower),
+        display_type=_display_type_from_lower(lower),
+        in_frame=_in_frame_from_lower(lower),
+        variant=variant,
+    )
+
+
+def _name_hash(name: str) -> str:
+    return hashlib.sha1(f"{FEATURE_CACHE_VERSION}:{name}".encode("utf-8")).hexdigest()
+
+
+class NameFeatureCache:
+    """
+    Мемоизация признаков названий с персистентным слоем в competitor_name_feature.
+
+    Ключ — sha1 от версии парсера и названия: при изменении правил разбора достаточно
+    поднять FEATURE_CACHE_VERSION. Без persistent кэш работает только в памяти процесса.
+    """
+
+    def __init__(self, session: Session, persistent: bool = True) -> None:
+        self.session = session
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._features: Dict[str, NameFeatures] = {}
+        self._pending: Dict[str, NameFeatures] = {}
+
+    def prefetch(self, names: Iterable[Optional[str]]) -> None:
+        if not self.persistent:
+            return
+        by_hash: Dict[str, str] = {}
+        for name in names:
+            if name and name not in self._features:
+                by_hash[_name_hash(name)] = name
+        hashes = list(by_hash)
+        for start in range(0, len(hashes), IN_QUERY_CHUNK):
+            chunk = hashes[start : start + IN_QUERY_CHUNK]
+            rows = self.session.execute(
+                select(CompetitorNameFeature).where(CompetitorNameFeature.name_hash.in_(chunk))
+            ).scalars()
+            for row in rows:
+                self._features[by_hash[row.name_hash]] = NameFeatures(
+                    brand=row.brand,
+                    models=tuple(row.models.split()) if row.models else (),
+                    quality=row.quality,
+                    display_type=row.display_type,
+                    in_frame=row.in_frame,
+                    variant=row.variant,
+                )
+
+    def get(self, name: Optional[str]) -> NameFeatures:
+        if not name:
+            return EMPTY_FEATURES
+        features = self._features.get(name)
+        if features is not None:
+            self.hits += 1
+            return features
+        self.misses += 1
+        features = _extract_name_features(name)
+        self._features[name] = features
+        if self.persistent:
+            self._pending[_name_hash(name)] = features
+        return features
+
+    def persist(self) -> None:
+        if not self._pending:
+            return
+        rows = [
+            {
+                "name_hash": name_hash,
+                "brand": features.brand,
+                "models": " ".join(features.models) or None,
+                "quality": features.quality,
+                "display_type": features.display_type,
+                "in_frame": features.in_frame,
+                "variant": features.variant,
+            }
+            # по возрастанию name_hash: параллельные шарды берут блокировки в одном порядке
+            for name_hash, features in sorted(self._pending.items())
+        ]
+        table = CompetitorNameFeature.__table__
+        dialect_insert = _dialect_insert(self.session)
+        for start in range(0, len(rows), IN_QUERY_CHUNK):
+            chunk = rows[start : start + IN_QUERY_CHUNK]
+            if dialect_insert is not None:
+                stmt = dialect_insert(table).on_conflict_do_nothing(
+                    index_elements=[table.c.name_hash]
+                )
+                self.session.execute(stmt, chunk)
+            else:
+                self.session.execute(insert(table), chunk)
+        self._pending = {}
+
+    def trim(self, max_entries: int = FEATURE_MEMO_LIMIT) -> None:
+        """Сбрасывает память кэша при переполнении; несохранённые признаки не теряются."""
+        if len(self._features) <= max_entries:
+            return
+        self.persist()
+        self._features = {}
+
+
+class BrandModelIndex:
+    """
+    Индекс моделей товаров по бренду для fallback-матчинга по названию.
+
+    Кандидат подходит, если его модель совпадает с моделью из названия конкурента
+    или одна из них является подстрокой другой. Вместо перебора всех моделей бренда
+    используем два индекса: точные строки моделей (для поиска моделей-подстрок запроса)
+    и k-граммы (для поиска моделей, содержащих запрос). Порядок кандидатов совпадает
+    с порядком добавления, как при линейном проходе.
+    """
+
+    NGRAM_SIZE = 3
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, List[Tuple[str, ProductRef]]] = {}
+        self._exact: Dict[str, Dict[str, List[int]]] = {}
+        self._exact_lengths: Dict[str, set[int]] = {}
+        self._grams: Dict[str, Dict[str, set[int]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    @classmethod
+    def _grams_of(cls, value: str, size: int) -> set[str]:
+        return {value[i : i + size] for i in range(len(value) - size + 1)}
+
+    def add(self, brand: str, model: str, product: ProductRef) -> None:
+        entries = self._entries.setdefault(brand, [])
+        pos = len(entries)
+        entries.append((model, product))
+        self._exact.setdefault(brand, {}).setdefault(model, []).append(pos)
+        self._exact_lengths.setdefault(brand, set()).add(len(model))
+        grams = self._grams.setdefault(brand, {})
+        for size in range(1, self.NGRAM_SIZE + 1):
+            for gram in self._grams_of(model, size):
+                grams.setdefault(gram, set()).add(pos)
+
+    def entries(self, brand: str) -> List[Tuple[str, ProductRef]]:
+        return self._entries.get(brand, [])
+
+    def _positions_for(self, brand: str, model: str) -> set[int]:
+        positions: set[int] = set()
+        # модели-кандидаты, которые являются подстрокой запроса (включая равенство)
+        exact = self._exact.get(brand, {})
+        length = len(model)
+        for size in self._exact_lengths.get(brand, ()):
+            if size > length:
+                continue
+            for start in range(length - size + 1):
+                hit = exact.get(model[start : start + size])
+                if hit:
+                    positions.update(hit)
+        # модели-кандидаты, которые содержат запрос: пересечение постингов k-грамм
+        grams = self._grams.get(brand, {})
+        size = min(self.NGRAM_SIZE, length)
+        postings = []
+        for gram in self._grams_of(model, size):
+            posting = grams.get(gram)
+            if not posting:
+                return positions
+            postings.append(posting)
+        postings.sort(key=len)
+        entries = self._entries[brand]
+        for pos in set.intersection(*postings) - positions:
+            if model in entries[pos][0]:
+                positions.add(pos)
+        return positions
+
+    def candidates(self, brand: str, models: Sequence[str]) -> List[ProductRef]:
+        if brand not in self._entries:
+            return []
+        positions: set[int] = set()
         for model in models:
-            brand_map.setdefault(brand, []).append((model, product))
-    return brand_map
+            if model:
+                positions |= self._positions_for(brand, model)
+        entries = self._entries[brand]
+        matched: List[ProductRef] = []
+        seen_ids = set()
+        for pos in sorted(positions):
+            product = entries[pos][1]
+            if product.id not in seen_ids:
+                matched.append(product)
+                seen_ids.add(product.id)
+        return matched
 
 
-def _load_overrides(session: Session, sources: Optional[Sequence[str]]) -> Dict[tuple, ProductMatchOverride]:
-    query = select(ProductMatchOverride)
-    if sources:
-        query = query.where(ProductMatchOverride.competitor_source.in_(list(sources)))
-    overrides: Dict[tuple, ProductMatchOverride] = {}
-    for ov in session.execute(query).scalars():
-        key = (ov.competitor_source, _normalize_sku(ov.competitor_sku) if ov.competitor_sku else None)
-        overrides[key] = ov
-    return overrides
+def _load_products_by_brand_model(
+    session: Session,
+    subject_whitelist: Optional[set[str]] = None,
+    feature_cache: Optional[NameFeatureCache] = None,
+    products: Optional[Sequence[ProductRef]] = None,
+) -> BrandModelIndex:
+    feature_cache = feature_cache or NameFeatureCache(session, persistent=False)
+    if products is None:
+        products = _load_product_refs(session, subject_whitelist)
+    feature_cache.prefetch(product.name for product in products)
+    index = BrandModelIndex()
+    for product in products:
+        features = feature_cache.get(product.name)
+        if not features.brand or not features.models:
+            continue
+        for model in features.models:
+            index.add(features.brand, model, product)
+    return index
 
 
 def _ensure_competitor(session: Session, name: str) -> Competitor:
@@ -325,26 +729,589 @@ def _ensure_competitor(session: Session, name: str) -> Competitor:
     return competitor
 
 
-def _existing_match(session: Session, product_id: int, competitor_id: int) -> Optional[ProductMatch]:
-    stmt: Select[tuple[ProductMatch]] = select(ProductMatch).where(
-        ProductMatch.product_id == product_id,
-        ProductMatch.competitor_id == competitor_id,
+def _load_existing_prices(
+    session: Session,
+    competitor_id: int,
+    product_ids: Sequence[int],
+    since: datetime,
+    until: datetime,
+) -> Dict[tuple[int, datetime], tuple[int, object, bool]]:
+    """Цены конкурента по (product_id, collected_at): id, price и in_stock."""
+    existing: Dict[tuple[int, datetime], tuple[int, object, bool]] = {}
+    for start in range(0, len(product_ids), IN_QUERY_CHUNK):
+        stmt = select(
+            CompetitorPrice.id,
+            CompetitorPrice.product_id,
+            CompetitorPrice.collected_at,
+            CompetitorPrice.price,
+            CompetitorPrice.in_stock,
+        ).where(
+            CompetitorPrice.competitor_id == competitor_id,
+            CompetitorPrice.product_id.in_(product_ids[start : start + IN_QUERY_CHUNK]),
+            CompetitorPrice.collected_at >= since,
+            CompetitorPrice.collected_at <= until,
+        )
+        for price_id, product_id, collected_at, price, in_stock in session.execute(stmt):
+            existing[(product_id, collected_at)] = (price_id, price, in_stock)
+    return existing
+
+
+def _price_max_id(session: Session) -> int:
+    return session.execute(select(func.coalesce(func.max(CompetitorPrice.id), 0))).scalar_one()
+
+
+MATCH_COLUMNS = (
+    "product_id",
+    "competitor_id",
+    "competitor_sku",
+    "confidence",
+    "is_manual",
+    "phone_model_id",
+    "quality",
+)
+
+
+def _load_existing_matches(session: Session, competitor_id: int) -> Dict[int, dict]:
+    table = ProductMatch.__table__
+    stmt = select(*(table.c[name] for name in MATCH_COLUMNS)).where(
+        table.c.competitor_id == competitor_id
     )
-    return session.execute(stmt).scalar_one_or_none()
+    return {row.product_id: dict(row._mapping) for row in session.execute(stmt)}
+
+
+PhoneModelKey = Tuple[str, str, Optional[str]]
+
+
+class PhoneModelCache:
+    """
+    Идентичности phone_models (brand, model_name, variant) -> id, загруженные один раз.
+
+    Неизвестные модели не создаются построчно: get() ставит их в очередь, а flush()
+    вставляет всю очередь одним INSERT ... ON CONFLICT DO NOTHING и дочитывает id.
+    created считает только действительно вставленные строки (RETURNING).
+
+    Уникальность (brand, model_name, variant) не срабатывает при variant IS NULL,
+    поэтому параллельные шарды могут создать дубль модели без варианта; дочитывание
+    по возрастанию id сводит оба шарда к меньшему id, но лишняя строка остаётся.
+    """
 
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self.ids: Dict[PhoneModelKey, int] = {}
+        self.created = 0
+        self._pending: Dict[PhoneModelKey, None] = {}
+        self._known_ids: Optional[set[int]] = None
+        self._by_brand_model: Optional[Dict[tuple[str, str], List[int]]] = None
+        stmt = select(PhoneModel.id, PhoneModel.brand, PhoneModel.model_name, PhoneModel.variant)
+        for row in session.execute(stmt):
+            self.ids.setdefault((row.brand, row.model_name, row.variant), row.id)
 
-def _existing_price(
+    def has_id(self, phone_model_id: int) -> bool:
+        if self._known_ids is None:
+            self._known_ids = set(self.ids.values())
+        return phone_model_id in self._known_ids
+
+    def find(self, brand: str, model_name: str, variant: Optional[str] = None) -> Optional[int]:
+        """
+        Модель по бренду/названию без учёта варианта; если моделей несколько —
+        та, у которой совпадает вариант.
+        """
+        exact = self.ids.get((brand, model_name, variant))
+        if exact is not None:
+            return exact
+        if self._by_brand_model is None:
+            self._by_brand_model = {}
+            for (b, m, _), pm_id in self.ids.items():
+                self._by_brand_model.setdefault((b, m), []).append(pm_id)
+        found = self._by_brand_model.get((brand, model_name), [])
+        return found[0] if len(found) == 1 else None
+
+    def get(self, key: PhoneModelKey) -> Optional[int]:
+        phone_model_id = self.ids.get(key)
+        if phone_model_id is None:
+            self._pending[key] = None
+        return phone_model_id
+
+    def flush(self) -> None:
+        # один порядок ключей во всех шардах: параллельные INSERT ... ON CONFLICT
+        # с пересекающимися ключами иначе берут блокировки вразнобой и ловят deadlock
+        pending = sorted(
+            (key for key in self._pending if key not in self.ids),
+            key=lambda key: (key[0], key[1], key[2] or ""),
+        )
+        self._pending = {}
+        if not pending:
+            return
+        table = PhoneModel.__table__
+        rows = [
+            {"brand": brand, "model_name": name, "variant": variant}
+            for brand, name, variant in pending
+        ]
+        dialect_insert = _dialect_insert(self.session)
+        if dialect_insert is not None:
+            stmt = (
+                dialect_insert(table)
+                .on_conflict_do_nothing(
+                    index_elements=[table.c.brand, table.c.model_name, table.c.variant]
+                )
+                .returning(table.c.id)
+            )
+            # пропущенные при конфликте строки ничего не возвращают
+            self.created += len(self.session.execute(stmt, rows).all())
+        else:
+            self.session.execute(insert(table), rows)
+            self.created += len(rows)
+        wanted = set(pending)
+        stmt = (
+            select(table.c.id, table.c.brand, table.c.model_name, table.c.variant)
+            .where(
+                table.c.brand.in_({key[0] for key in pending}),
+                table.c.model_name.in_({key[1] for key in pending}),
+            )
+            .order_by(table.c.id)
+        )
+        for row in self.session.execute(stmt):
+            key = (row.brand, row.model_name, row.variant)
+            if key in wanted:
+                self.ids.setdefault(key, row.id)
+        self._known_ids = None
+        self._by_brand_model = None
+
+
+@dataclass(frozen=True)
+class ResolvedOverride:
+    """Ручной оверрайд с уже найденными целями: товар, модель телефона, качество."""
+
+    product: Optional[ProductRef]
+    phone_model_id: Optional[int]
+    quality: Optional[str]
+
+
+def _load_overrides(
     session: Session,
-    product_id: int,
-    competitor_id: int,
-    collected_at,
-) -> Optional[CompetitorPrice]:
-    stmt: Select[tuple[CompetitorPrice]] = select(CompetitorPrice).where(
-        CompetitorPrice.product_id == product_id,
-        CompetitorPrice.competitor_id == competitor_id,
-        CompetitorPrice.collected_at == collected_at,
+    sources: Optional[Sequence[str]],
+    phone_models: PhoneModelCache,
+) -> Dict[tuple, ResolvedOverride]:
+    query = select(ProductMatchOverride)
+    if sources:
+        query = query.where(ProductMatchOverride.competitor_source.in_(list(sources)))
+    rows = list(session.execute(query).scalars())
+    product_ids = {ov.product_id for ov in rows if ov.product_id}
+    products: Dict[int, ProductRef] = {}
+    id_list = list(product_ids)
+    for start in range(0, len(id_list), IN_QUERY_CHUNK):
+        chunk = id_list[start : start + IN_QUERY_CHUNK]
+        for row in session.execute(select(*PRODUCT_REF_COLUMNS).where(Product.id.in_(chunk))):
+            products[row.id] = _product_ref(row)
+
+    overrides: Dict[tuple, ResolvedOverride] = {}
+    for ov in rows:
+        phone_model_id = None
+        if ov.phone_model_id and phone_models.has_id(ov.phone_model_id):
+            phone_model_id = ov.phone_model_id
+        if ov.brand and ov.model and phone_model_id is None:
+            phone_model_id = phone_models.find(ov.brand, ov.model, ov.variant)
+        key = (ov.competitor_source, ov.competitor_sku_norm or None)
+        overrides[key] = ResolvedOverride(
+            product=products.get(ov.product_id) if ov.product_id else None,
+            phone_model_id=phone_model_id,
+            quality=ov.quality,
+        )
+    return overrides
+
+
+_PRICE_UPDATE = (
+    update(CompetitorPrice.__table__)
+    .where(CompetitorPrice.__table__.c.id == bindparam("price_id"))
+    .values(price=bindparam("new_price"), in_stock=bindparam("new_in_stock"))
+)
+
+
+class MatchWriter:
+    """
+    Копит строки competitor_price/productmatch и пишет их пачками.
+
+    Цены вставляются обычным multi-row INSERT (дубли отсекаются заранее по ключам,
+    дочитанным для чанка записей); у цен прошлых прогонов price/in_stock
+    обновляются executemany UPDATE по id. Связи пишутся через INSERT ... ON CONFLICT DO UPDATE
+    по (product_id, competitor_id): уже заполненные phone_model_id/quality не
+    перезаписываются, is_manual только взводится. Для диалектов без ON CONFLICT
+    (не PostgreSQL/SQLite) связи пишутся построчно: UPDATE, затем INSERT при промахе.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        chunk_size: int = 1000,
+        phone_models: Optional[PhoneModelCache] = None,
+        profiler: Optional[StageProfiler] = None,
+    ) -> None:
+        self.session = session
+        self.chunk_size = max(1, chunk_size)
+        self.phone_models = phone_models
+        self.profiler = profiler or StageProfiler(enabled=False)
+        self._prices: List[dict] = []
+        self._price_updates: List[dict] = []
+        self._matches: Dict[tuple[int, int], dict] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._prices) + len(self._price_updates) + len(self._matches)
+
+    def add_price(self, row: dict) -> None:
+        self._prices.append(row)
+        self._maybe_flush()
+
+    def update_price(self, price_id: int, price, in_stock: bool) -> None:
+        self._price_updates.append(
+            {"price_id": price_id, "new_price": price, "new_in_stock": in_stock}
+        )
+        self._maybe_flush()
+
+    def add_match(self, row: dict) -> None:
+        # одна строка на ключ в пачке: повторный ON CONFLICT по той же строке запрещён в PG
+        self._matches[(row["product_id"], row["competitor_id"])] = row
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.phone_models is not None:
+            with self.profiler.stage("flush_phone_models"):
+                self.phone_models.flush()
+        if self._prices:
+            table = CompetitorPrice.__table__
+            with self.profiler.stage("flush_prices"):
+                for start in range(0, len(self._prices), self.chunk_size):
+                    self.session.execute(
+                        insert(table), self._prices[start : start + self.chunk_size]
+                    )
+            self._prices = []
+        if self._price_updates:
+            with self.profiler.stage("flush_prices"):
+                self.session.execute(_PRICE_UPDATE, self._price_updates)
+            self._price_updates = []
+        if self._matches:
+            with self.profiler.stage("flush_matches"):
+                rows = [self._match_row(row) for row in self._matches.values()]
+                for start in range(0, len(rows), self.chunk_size):
+                    self._write_matches(rows[start : start + self.chunk_size])
+            self._matches = {}
+
+    def _match_row(self, state: dict) -> dict:
+        # phone_model_key — модель, созданная в этой пачке: id известен только после flush кэша
+        key = state.pop("phone_model_key", None)
+        if key is not None and state["phone_model_id"] is None and self.phone_models is not None:
+            state["phone_model_id"] = self.phone_models.ids.get(key)
+        return {name: state[name] for name in MATCH_COLUMNS}
+
+    def _write_matches(self, rows: List[dict]) -> None:
+        table = ProductMatch.__table__
+        dialect_insert = _dialect_insert(self.session)
+        if dialect_insert is None:
+            for row in rows:
+                result = self.session.execute(
+                    update(table)
+                    .where(
+                        table.c.product_id == row["product_id"],
+                        table.c.competitor_id == row["competitor_id"],
+                    )
+                    # та же семантика, что у ON CONFLICT ниже
+                    .values(
+                        phone_model_id=func.coalesce(table.c.phone_model_id, row["phone_model_id"]),
+                        quality=func.coalesce(table.c.quality, row["quality"]),
+                        is_manual=or_(table.c.is_manual, row["is_manual"]),
+                    )
+                )
+                if result.rowcount == 0:
+                    self.session.execute(insert(table).values(**row))
+            return
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id, table.c.competitor_id],
+            set_={
+                "phone_model_id": func.coalesce(
+                    table.c.phone_model_id, stmt.excluded.phone_model_id
+                ),
+                "quality": func.coalesce(table.c.quality, stmt.excluded.quality),
+                "is_manual": or_(table.c.is_manual, stmt.excluded.is_manual),
+            },
+        )
+        self.session.execute(stmt, rows)
+
+
+def _load_watermarks(session: Session, sources: Optional[Sequence[str]]) -> Dict[str, int]:
+    query = select(CompetitorFtpMatchState)
+    if sources:
+        query = query.where(CompetitorFtpMatchState.source.in_(list(sources)))
+    return {state.source: state.last_record_id for state in session.execute(query).scalars()}
+
+
+def _save_watermarks(session: Session, last_ids: Dict[str, int]) -> None:
+    if not last_ids:
+        return
+    states = {
+        state.source: state
+        for state in session.execute(
+            select(CompetitorFtpMatchState).where(
+                CompetitorFtpMatchState.source.in_(list(last_ids))
+            )
+        ).scalars()
+    }
+    now = datetime.now(timezone.utc)
+    for source, last_id in last_ids.items():
+        state = states.get(source)
+        if state is None:
+            state = CompetitorFtpMatchState(source=source, last_record_id=0)
+            session.add(state)
+        state.last_record_id = max(state.last_record_id or 0, last_id)
+        state.matched_at = now
+
+
+RECORD_COLUMNS = (
+    CompetitorFtpRecord.id,
+    CompetitorFtpRecord.source,
+    CompetitorFtpRecord.sku,
+    CompetitorFtpRecord.sku_norm,
+    CompetitorFtpRecord.name,
+    CompetitorFtpRecord.price_opt,
+    CompetitorFtpRecord.price_roz,
+    CompetitorFtpRecord.in_stock,
+    CompetitorFtpRecord.observed_at,
+)
+
+
+def _record_conditions(
+    session: Session,
+    since_date: date,
+    sources: Optional[Sequence[str]],
+    full: bool,
+) -> list:
+    conditions = [CompetitorFtpRecord.file_date >= since_date]
+    if sources:
+        conditions.append(CompetitorFtpRecord.source.in_(list(sources)))
+    if not full:
+        watermarks = _load_watermarks(session, sources)
+        if watermarks:
+            conditions.append(
+                or_(
+                    CompetitorFtpRecord.source.notin_(list(watermarks)),
+                    *(
+                        and_(CompetitorFtpRecord.source == source, CompetitorFtpRecord.id > last_id)
+                        for source, last_id in watermarks.items()
+                    ),
+                )
+            )
+    return conditions
+
+
+def _sql_sku_eligible(subject_whitelist: Optional[set[str]]):
+    """
+    Условие «запись однозначно матчится по SKU без участия Python».
+
+    Нормализованный артикул есть, в каталоге ровно один товар с таким sku_norm,
+    у источника нет оверрайда на этот артикул и оверрайда-«звёздочки», есть цена.
+    Все части условия не NULL, поэтому его отрицание безопасно отбирает остаток.
+    """
+    record = CompetitorFtpRecord
+    # свой алиас товара: условие встраивается и в запросы, где product уже в FROM
+    product = aliased(Product)
+    product_count = (
+        select(func.count(product.id))
+        .where(product.sku_norm == record.sku_norm)
+        .correlate(record)
+    )
+    if subject_whitelist:
+        product_count = product_count.where(product.subject.in_(list(subject_whitelist)))
+    has_override = (
+        exists()
+        .where(
+            ProductMatchOverride.competitor_source == record.source,
+            or_(
+                ProductMatchOverride.competitor_sku_norm.is_(None),
+                ProductMatchOverride.competitor_sku_norm == record.sku_norm,
+            ),
+        )
+        .correlate(record)
+    )
+    return and_(
+        record.sku_norm.is_not(None),
+        product_count.scalar_subquery() == 1,
+        ~has_override,
+        func.coalesce(record.price_roz, record.price_opt).is_not(None),
     )
-    return session.execute(stmt).scalar_one_or_none()
+
+
+def _run_sql_sku_stage(
+    session: Session,
+    conditions: list,
+    subject_whitelist: Optional[set[str]],
+) -> dict:
+    """
+    Точный матч по SKU целиком в БД: INSERT ... SELECT цен и связей.
+
+    Повторяет то, что Python-цикл делает для записи с единственным SKU-кандидатом:
+    цена пишется один раз на (товар, конкурент, observed_at) — из записи с меньшим id,
+    а у цены прошлого прогона с тем же ключом эта запись обновляет price/in_stock;
+    id таких цен возвращаются в touched_price_ids, чтобы Python-цикл их не трогал;
+    новая связь получает артикул первой записи пары и качество первой записи, где
+    оно распознано; существующей связи без качества оно дописывается.
+
+    Качество определяется в Python (_extract_quality), а не в SQL: lower() в SQLite
+    и в PostgreSQL с C-локалью не переводит кириллицу в нижний регистр.
+    """
+    record = CompetitorFtpRecord
+    eligible = _sql_sku_eligible(subject_whitelist)
+    by_source = session.execute(
+        select(record.source, func.count(record.id), func.max(record.id))
+        .where(*conditions, eligible)
+        .group_by(record.source)
+    ).all()
+    if not by_source:
+        return {
+            "matched": 0,
+            "prices_created": 0,
+            "prices_updated": 0,
+            "matches_created": 0,
+            "touched_price_ids": set(),
+            "last_ids": {},
+        }
+    for source, _, _ in by_source:
+        _ensure_competitor(session, source)
+
+    product_join = Product.sku_norm == record.sku_norm
+    if subject_whitelist:
+        product_join = and_(product_join, Product.subject.in_(list(subject_whitelist)))
+    rows = (
+        select(
+            record.id,
+            record.sku,
+            record.in_stock,
+            record.observed_at,
+            func.coalesce(record.price_roz, record.price_opt).label("price"),
+            record.name,
+            Product.id.label("product_id"),
+            Competitor.id.label("competitor_id"),
+        )
+        .join(Product, product_join)
+        .join(Competitor, Competitor.name == record.source)
+        .where(*conditions, eligible)
+        .subquery("sql_sku_rows")
+    )
+
+    prices = CompetitorPrice.__table__
+    first_price_ids = select(func.min(rows.c.id)).group_by(
+        rows.c.product_id, rows.c.competitor_id, rows.c.observed_at
+    )
+    price_key = and_(
+        prices.c.product_id == rows.c.product_id,
+        prices.c.competitor_id == rows.c.competitor_id,
+        prices.c.collected_at == rows.c.observed_at,
+    )
+    price_exists = exists().where(price_key)
+    # цены прошлых прогонов по тем же ключам: повторная выгрузка файла за тот же
+    # день могла поменять цену при том же time
+    touched_price_ids: set[int] = set()
+    price_updates: List[dict] = []
+    stored = session.execute(
+        select(prices.c.id, prices.c.price, prices.c.in_stock, rows.c.price, rows.c.in_stock)
+        .select_from(rows)
+        .join(prices, price_key)
+        .where(rows.c.id.in_(first_price_ids))
+        .execution_options(yield_per=IN_QUERY_CHUNK)
+    )
+    for price_id, price, in_stock, new_price, new_in_stock in stored:
+        touched_price_ids.add(price_id)
+        if (price, in_stock) != (new_price, new_in_stock):
+            price_updates.append(
+                {"price_id": price_id, "new_price": new_price, "new_in_stock": new_in_stock}
+            )
+    if price_updates:
+        session.execute(_PRICE_UPDATE, price_updates)
+    prices_created = session.execute(
+        insert(prices).from_select(
+            ["product_id", "competitor_id", "price", "in_stock", "collected_at"],
+            select(
+                rows.c.product_id,
+                rows.c.competitor_id,
+                rows.c.price,
+                rows.c.in_stock,
+                rows.c.observed_at,
+            ).where(rows.c.id.in_(first_price_ids), ~price_exists),
+        )
+    ).rowcount
+
+    matches = ProductMatch.__table__
+    pairs = (
+        select(
+            rows.c.product_id,
+            rows.c.competitor_id,
+            func.min(rows.c.id).label("first_id"),
+        )
+        .group_by(rows.c.product_id, rows.c.competitor_id)
+        .subquery("sql_sku_pairs")
+    )
+    first_record = CompetitorFtpRecord.__table__.alias("first_record")
+    match_exists = exists().where(
+        matches.c.product_id == pairs.c.product_id,
+        matches.c.competitor_id == pairs.c.competitor_id,
+    )
+    matches_created = session.execute(
+        insert(matches).from_select(
+            ["product_id", "competitor_id", "competitor_sku", "confidence", "is_manual"],
+            select(
+                pairs.c.product_id,
+                pairs.c.competitor_id,
+                first_record.c.sku,
+                literal(1.0),
+                false(),
+            )
+            .join(first_record, first_record.c.id == pairs.c.first_id)
+            .where(~match_exists),
+        )
+    ).rowcount
+
+    # связям без качества (и только что созданным) дописываем качество первой
+    # записи пары, где оно распознано; названия читаются потоком в порядке id
+    names = session.execute(
+        select(matches.c.id, rows.c.name)
+        .join(
+            matches,
+            and_(
+                matches.c.product_id == rows.c.product_id,
+                matches.c.competitor_id == rows.c.competitor_id,
+            ),
+        )
+        .where(matches.c.quality.is_(None))
+        .order_by(matches.c.id, rows.c.id)
+        .execution_options(yield_per=IN_QUERY_CHUNK)
+    )
+    quality_fills: Dict[int, str] = {}
+    for match_id, name in names:
+        if match_id not in quality_fills:
+            quality = _extract_quality(name)
+            if quality is not None:
+                quality_fills[match_id] = quality
+    if quality_fills:
+        session.execute(
+            update(matches)
+            .where(matches.c.id == bindparam("match_id"))
+            .values(quality=bindparam("fill_quality")),
+            [
+                {"match_id": match_id, "fill_quality": quality}
+                for match_id, quality in quality_fills.items()
+            ],
+        )
+    return {
+        "matched": sum(count for _, count, _ in by_source),
+        "prices_created": prices_created,
+        "prices_updated": len(price_updates),
+        "matches_created": matches_created,
+        "touched_price_ids": touched_price_ids,
+        "last_ids": {source: last_id for source, _, last_id in by_source},
+    }
 
 
 def match_competitor_ftp_records(
@@ -353,211 +1320,439 @@ def match_competitor_ftp_records(
     sources: Optional[Sequence[str]] = None,
     max_samples: int = 20,
     subject_whitelist: Optional[Sequence[str]] = None,
+    write_chunk_size: int = 1000,
+    full: bool = False,
+    persistent_feature_cache: bool = True,
+    read_chunk_size: int = 5000,
+    fuzzy_threshold: Optional[float] = None,
+    profile: bool = False,
+    sql_sku_stage: bool = True,
 ) -> dict:
     """
     Сопоставляет FTP-записи конкурентов с товарами по SKU и пишет цены в competitor_price.
+
+    Цены и связи копятся в MatchWriter и пишутся пачками по write_chunk_size строк.
+    По умолчанию обрабатываются только записи с id выше водяного знака источника
+    (competitor_ftp_match_state); full=True пересматривает всё окно days_back.
+    Признаки названий берутся из NameFeatureCache (persistent_feature_cache=False —
+    только в памяти).
+
+    Записи читаются потоком: чанками по read_chunk_size строк с пагинацией по id
+    (серверный курсор не переживает commit). После каждого чанка пишутся цены и
+    связи, кэш признаков и водяные знаки, транзакция фиксируется — память не зависит
+    от размера окна, а прерванный прогон продолжается с места остановки. Уже
+    записанные цены ищутся в конце чанка только по его товарам и окну observed_at.
+    Цену прошлого прогона с тем же (товар, конкурент, observed_at) первая запись
+    прогона обновляет, если price или in_stock изменились: так до competitor_price
+    доходит повторная выгрузка файла за тот же день с новой ценой при том же time.
+
+    С fuzzy_threshold строки, для которых осталось несколько кандидатов (в том числе
+    дубли SKU), ранжируются пачкой на чанк по TF-IDF близости названий
+    (TrigramSimilarity); победитель с оценкой не ниже fuzzy_threshold получает связь
+    с confidence = оценке. По умолчанию (None) такие строки, как и раньше,
+    считаются неоднозначными и не матчатся.
+
+    sql_sku_stage=True сначала матчит однозначные попадания по SKU целиком в БД
+    (_run_sql_sku_stage); Python-цикл читает только остаток.
+
+    profile=True добавляет в ответ и в лог раздел profile: время и число входов
+    по стадиям (загрузка товаров и оверрайдов, чтение записей, разбор названий,
+    SKU, fallback по бренду/модели, проверки существования, запись, commit).
     """
     stats = MatchStats()
+    profiler = StageProfiler(enabled=profile)
+    started = time.perf_counter()
     since_date = date.today() - timedelta(days=days_back)
+    read_chunk_size = max(1, read_chunk_size)
+    conditions = _record_conditions(session, since_date, sources, full)
 
-    query = select(CompetitorFtpRecord).where(CompetitorFtpRecord.file_date >= since_date)
-    if sources:
-        query = query.where(CompetitorFtpRecord.source.in_(list(sources)))
-
-    records = list(session.execute(query).scalars())
-    if not records:
+    with profiler.stage("count_window"):
+        total, max_id = session.execute(
+            select(
+                func.count(CompetitorFtpRecord.id),
+                func.max(CompetitorFtpRecord.id),
+            ).where(*conditions)
+        ).one()
+    if not total:
         return {"skipped": True, "reason": "no_records"}
+    # записи, пришедшие во время прогона, оставляем следующему запуску
+    conditions.append(CompetitorFtpRecord.id <= max_id)
 
     subject_whitelist_set = set(subject_whitelist) if subject_whitelist else None
-    products_by_sku = _load_products_by_sku(session, subject_whitelist_set)
-    products_by_brand_model = _load_products_by_brand_model(session, subject_whitelist_set)
-    overrides = _load_overrides(session, sources)
-    competitors: Dict[str, Competitor] = {}
+    # цены с id выше созданы этим прогоном; цены прошлых прогонов обновляет первая
+    # запись прогона с их ключом, id обновлённых и сверенных копятся в touched_price_ids
+    price_id_floor = _price_max_id(session)
+    touched_price_ids: set[int] = set()
+    sql_last_ids: Dict[str, int] = {}
+    if sql_sku_stage:
+        with profiler.stage("sql_sku_stage"):
+            sql_result = _run_sql_sku_stage(session, conditions, subject_whitelist_set)
+            session.commit()
+        stats.processed += sql_result["matched"]
+        stats.matched += sql_result["matched"]
+        stats.sql_matched += sql_result["matched"]
+        stats.prices_created += sql_result["prices_created"]
+        stats.prices_updated += sql_result["prices_updated"]
+        stats.matches_created += sql_result["matches_created"]
+        touched_price_ids = sql_result["touched_price_ids"]
+        sql_last_ids = sql_result["last_ids"]
+        # водяной знак SQL-стадии сохраняется в конце: остаток с меньшими id ещё не разобран
+        conditions.append(~_sql_sku_eligible(subject_whitelist_set))
+    feature_cache = NameFeatureCache(session, persistent=persistent_feature_cache)
+    with profiler.stage("load_products"):
+        products = _load_product_refs(session, subject_whitelist_set)
+        products_by_sku = _load_products_by_sku(session, products=products)
+        products_by_brand_model = _load_products_by_brand_model(
+            session, feature_cache=feature_cache, products=products
+        )
+    similarity: Optional[TrigramSimilarity] = None
+    with profiler.stage("fit_similarity"):
+        if fuzzy_threshold is not None:
+            # numpy ставится экстрой fuzzy, без неё матчинг работает и без ранжирования
+            try:
+                from app.services.name_similarity import TrigramSimilarity, pick_best
+            except ImportError as exc:
+                raise RuntimeError(
+                    "fuzzy name ranking requires numpy, install it with pip install .[fuzzy]"
+                ) from exc
+            similarity = TrigramSimilarity().fit((product.id, product.name) for product in products)
+    del products
+    competitor_ids: Dict[str, int] = {}
+    # цены чанка по (competitor_id, product_id, observed_at); какие из них уже есть
+    # в БД, проверяется в конце чанка только для его товаров и окна observed_at
+    chunk_prices: Dict[Tuple[int, int, datetime], dict] = {}
+    existing_matches: Dict[int, Dict[int, dict]] = {}
+    phone_models = PhoneModelCache(session)
+    with profiler.stage("load_overrides"):
+        overrides = _load_overrides(session, sources, phone_models)
+    writer = MatchWriter(
+        session, chunk_size=write_chunk_size, phone_models=phone_models, profiler=profiler
+    )
     unmatched_samples: List[dict] = []
     ambiguous_samples: List[dict] = []
+    last_ids: Dict[str, int] = {}
+    last_seen_id = 0
 
-    for record in records:
-        stats.processed += 1
-        product: Optional[Product] = None
-        phone_model: Optional[PhoneModel] = None
-        quality = _extract_quality(record.name)
-        is_manual = False
-
-        sku_norm = _normalize_sku(record.sku)
-        override = overrides.get((record.source, sku_norm)) or overrides.get((record.source, None))
-        if override:
-            if override.product_id:
-                product = session.get(Product, override.product_id)
-            if override.phone_model_id:
-                phone_model = session.get(PhoneModel, override.phone_model_id)
-            if override.brand and override.model and not phone_model:
-                pm = session.execute(
-                    select(PhoneModel).where(
-                        PhoneModel.brand == override.brand,
-                        PhoneModel.model_name == override.model,
-                    )
-                ).scalar_one_or_none()
-                if pm:
-                    phone_model = pm
-            if override.quality:
-                quality = override.quality
-            is_manual = True
-
-        if product is None and sku_norm:
-            candidates = products_by_sku.get(sku_norm) or []
-            if candidates:
-                if len(candidates) > 1:
-                    stats.ambiguous += 1
-                    if len(ambiguous_samples) < max_samples:
-                        ambiguous_samples.append({"source": record.source, "sku": record.sku, "name": record.name})
-                    continue
-                product = candidates[0]
-
-        if product is None:
-            brand, models = _extract_brand_model(record.name)
-            variant = None
-            if brand and models:
-                product_candidates = products_by_brand_model.get(brand, [])
-                matched_products: List[Product] = []
-                seen_ids = set()
-                quality_token = _extract_quality(record.name)
-                display_type_token = _extract_display_type(record.name)
-                in_frame_token = _extract_in_frame(record.name)
-                for cand_model, cand_product in product_candidates:
-                    if any(
-                        cand_model == model or cand_model in model or model in cand_model
-                        for model in models
-                    ):
-                        if cand_product.id not in seen_ids:
-                            matched_products.append(cand_product)
-                            seen_ids.add(cand_product.id)
-                # try to disambiguate by quality/display type/frame
-                if len(matched_products) > 1:
-                    norm_quality = _normalize_quality_value(quality_token)
-                    if norm_quality:
-                        filtered = [
-                            p
-                            for p in matched_products
-                            if _normalize_quality_value(getattr(p, "quality", None)) == norm_quality
-                        ]
-                        if filtered:
-                            matched_products = filtered
-                if len(matched_products) > 1 and display_type_token:
-                    filtered = [
-                        p
-                        for p in matched_products
-                        if (getattr(p, "display_type", None) or "").lower() == display_type_token.lower()
-                    ]
-                    if filtered:
-                        matched_products = filtered
-                if len(matched_products) > 1 and in_frame_token is not None:
-                    filtered = []
-                    for p in matched_products:
-                        val = getattr(p, "in_frame", None)
-                        if val is None:
-                            continue
-                        val_norm = str(val).lower()
-                        if in_frame_token and val_norm in {"да", "yes", "true", "1"}:
-                            filtered.append(p)
-                        if in_frame_token is False and val_norm in {"нет", "no", "false", "0"}:
-                            filtered.append(p)
-                    if filtered:
-                        matched_products = filtered
-                if len(matched_products) == 1:
-                    product = matched_products[0]
-                elif len(matched_products) > 1:
-                    stats.ambiguous += 1
-                    if len(ambiguous_samples) < max_samples:
-                        ambiguous_samples.append({"source": record.source, "sku": record.sku, "name": record.name})
-                    continue
-                # create/find phone model with variant if possible
-                model_tokens = re.findall(r"[A-Za-z0-9]+", record.name.lower())
-                model_tokens, variant = _extract_variant(model_tokens)
-                phone_model_name = models[0] if models else None
-                if phone_model_name:
-                    phone_model = (
-                        session.execute(
-                            select(PhoneModel).where(
-                                PhoneModel.brand == brand,
-                                PhoneModel.model_name == phone_model_name,
-                                PhoneModel.variant == variant,
-                            )
-                        ).scalar_one_or_none()
-                    )
-                    if phone_model is None:
-                        phone_model = PhoneModel(brand=brand, model_name=phone_model_name, variant=variant)
-                        session.add(phone_model)
-                        session.flush()
-
-        if product is None:
-            stats.unmatched += 1
-            if len(unmatched_samples) < max_samples:
-                unmatched_samples.append({"source": record.source, "sku": record.sku, "name": record.name})
-            continue
-        competitor = competitors.get(record.source)
-        if competitor is None:
-            competitor = _ensure_competitor(session, record.source)
-            competitors[record.source] = competitor
+    def record_match(
+        record,
+        product: ProductRef,
+        quality: Optional[str],
+        is_manual: bool = False,
+        phone_model_id: Optional[int] = None,
+        phone_model_key: Optional[PhoneModelKey] = None,
+        confidence: float = 1.0,
+    ) -> None:
+        with profiler.stage("existence_checks"):
+            competitor_id = competitor_ids.get(record.source)
+            if competitor_id is None:
+                competitor_id = _ensure_competitor(session, record.source).id
+                competitor_ids[record.source] = competitor_id
+                existing_matches[competitor_id] = _load_existing_matches(session, competitor_id)
 
         price = record.price_roz if record.price_roz is not None else record.price_opt
         if price is None:
             stats.skipped_no_price += 1
-            continue
+            return
 
-        existing_price = _existing_price(
-            session,
-            product_id=product.id,
-            competitor_id=competitor.id,
-            collected_at=record.observed_at,
-        )
-        if not existing_price:
-            cp = CompetitorPrice(
-                product_id=product.id,
-                competitor_id=competitor.id,
-                price=price,
-                in_stock=record.in_stock,
-                collected_at=record.observed_at,
-            )
-            session.add(cp)
-            stats.prices_created += 1
+        price_key = (competitor_id, product.id, record.observed_at)
+        if price_key not in chunk_prices:
+            chunk_prices[price_key] = {
+                "product_id": product.id,
+                "competitor_id": competitor_id,
+                "price": price,
+                "in_stock": record.in_stock,
+                "collected_at": record.observed_at,
+            }
 
-        pm = _existing_match(session, product_id=product.id, competitor_id=competitor.id)
+        matches_by_product = existing_matches[competitor_id]
+        pm = matches_by_product.get(product.id)
         if not pm:
-            match = ProductMatch(
-                product_id=product.id,
-                competitor_id=competitor.id,
-                competitor_sku=record.sku,
-                confidence=1.0,
-                is_manual=is_manual,
-                phone_model_id=phone_model.id if phone_model else None,
-                quality=quality,
-            )
-            session.add(match)
+            pm = {
+                "product_id": product.id,
+                "competitor_id": competitor_id,
+                "competitor_sku": record.sku,
+                "confidence": confidence,
+                "is_manual": is_manual,
+                "phone_model_id": phone_model_id,
+                "phone_model_key": phone_model_key if phone_model_id is None else None,
+                "quality": quality,
+            }
+            matches_by_product[product.id] = pm
+            writer.add_match(pm)
             stats.matches_created += 1
         else:
             updated = False
-            if phone_model and not pm.phone_model_id:
-                pm.phone_model_id = phone_model.id
+            has_phone_model = phone_model_id is not None or phone_model_key is not None
+            if has_phone_model and not pm["phone_model_id"] and not pm.get("phone_model_key"):
+                pm["phone_model_id"] = phone_model_id
+                pm["phone_model_key"] = phone_model_key if phone_model_id is None else None
                 updated = True
-            if quality and not pm.quality:
-                pm.quality = quality
+            if quality and not pm["quality"]:
+                pm["quality"] = quality
                 updated = True
-            if is_manual and not pm.is_manual:
-                pm.is_manual = True
+            if is_manual and not pm["is_manual"]:
+                pm["is_manual"] = True
                 updated = True
             if updated:
-                session.add(pm)
+                writer.add_match(pm)
 
         stats.matched += 1
 
-    session.commit()
+    def flush_chunk_prices() -> None:
+        with profiler.stage("existence_checks"):
+            by_competitor: Dict[int, List[Tuple[int, int, datetime]]] = {}
+            for key in chunk_prices:
+                by_competitor.setdefault(key[0], []).append(key)
+            for competitor_id, keys in by_competitor.items():
+                existing = _load_existing_prices(
+                    session,
+                    competitor_id,
+                    sorted({product_id for _, product_id, _ in keys}),
+                    min(observed_at for _, _, observed_at in keys),
+                    max(observed_at for _, _, observed_at in keys),
+                )
+                for key in keys:
+                    row = chunk_prices[key]
+                    stored = existing.get(key[1:])
+                    if stored is None:
+                        writer.add_price(row)
+                        stats.prices_created += 1
+                        continue
+                    price_id, price, in_stock = stored
+                    if price_id > price_id_floor or price_id in touched_price_ids:
+                        continue
+                    touched_price_ids.add(price_id)
+                    if (price, in_stock) != (row["price"], row["in_stock"]):
+                        writer.update_price(price_id, row["price"], row["in_stock"])
+                        stats.prices_updated += 1
+        chunk_prices.clear()
+
+    def mark_ambiguous(record) -> None:
+        stats.ambiguous += 1
+        if len(ambiguous_samples) < max_samples:
+            ambiguous_samples.append(
+                {"source": record.source, "sku": record.sku, "name": record.name}
+            )
+
+    while True:
+        with profiler.stage("read_records"):
+            records = session.execute(
+                select(*RECORD_COLUMNS)
+                .where(*conditions, CompetitorFtpRecord.id > last_seen_id)
+                .order_by(CompetitorFtpRecord.id)
+                .limit(read_chunk_size)
+            ).all()
+        if not records:
+            break
+        last_seen_id = records[-1].id
+        with profiler.stage("name_features"):
+            feature_cache.prefetch(record.name for record in records)
+        # строки для ранжирования:
+        # (record, кандидаты, quality, is_manual, phone_model_id, phone_model_key)
+        deferred: List[tuple] = []
+
+        for record in records:
+            stats.processed += 1
+            if record.id > last_ids.get(record.source, 0):
+                last_ids[record.source] = record.id
+            product: Optional[ProductRef] = None
+            phone_model_id: Optional[int] = None
+            phone_model_key: Optional[PhoneModelKey] = None
+            with profiler.stage("name_features"):
+                features = feature_cache.get(record.name)
+            quality = features.quality
+            is_manual = False
+
+            with profiler.stage("sku_match"):
+                sku_norm = record.sku_norm
+                override = overrides.get((record.source, sku_norm)) or overrides.get(
+                    (record.source, None)
+                )
+                if override:
+                    product = override.product
+                    phone_model_id = override.phone_model_id
+                    if override.quality:
+                        quality = override.quality
+                    is_manual = True
+
+                if product is None and sku_norm:
+                    candidates = products_by_sku.get(sku_norm) or []
+                    if candidates:
+                        if len(candidates) > 1:
+                            if similarity is not None:
+                                deferred.append(
+                                    (record, candidates, quality, is_manual, phone_model_id, None)
+                                )
+                            else:
+                                mark_ambiguous(record)
+                            continue
+                        product = candidates[0]
+
+            if product is None:
+                with profiler.stage("brand_model_fallback"):
+                    brand, models = features.brand, list(features.models)
+                    variant = None
+                    if brand and models:
+                        matched_products = products_by_brand_model.candidates(brand, models)
+                        quality_token = features.quality
+                        display_type_token = features.display_type
+                        in_frame_token = features.in_frame
+                        # try to disambiguate by quality/display type/frame
+                        if len(matched_products) > 1:
+                            norm_quality = _normalize_quality_value(quality_token)
+                            if norm_quality:
+                                filtered = [
+                                    p
+                                    for p in matched_products
+                                    if _normalize_quality_value(getattr(p, "quality", None))
+                                    == norm_quality
+                                ]
+                                if filtered:
+                                    matched_products = filtered
+                        if len(matched_products) > 1 and display_type_token:
+                            filtered = [
+                                p
+                                for p in matched_products
+                                if (getattr(p, "display_type", None) or "").lower()
+                                == display_type_token.lower()
+                            ]
+                            if filtered:
+                                matched_products = filtered
+                        if len(matched_products) > 1 and in_frame_token is not None:
+                            filtered = []
+                            for p in matched_products:
+                                val = getattr(p, "in_frame", None)
+                                if val is None:
+                                    continue
+                                val_norm = str(val).lower()
+                                if in_frame_token and val_norm in {"да", "yes", "true", "1"}:
+                                    filtered.append(p)
+                                no_values = {"нет", "no", "false", "0"}
+                                if in_frame_token is False and val_norm in no_values:
+                                    filtered.append(p)
+                            if filtered:
+                                matched_products = filtered
+                        # create/find phone model with variant if possible
+                        variant = features.variant
+                        phone_model_name = models[0] if models else None
+                        if phone_model_name:
+                            phone_model_key = (brand, phone_model_name, variant)
+                        if len(matched_products) == 1:
+                            product = matched_products[0]
+                        elif len(matched_products) > 1:
+                            if similarity is not None:
+                                deferred.append(
+                                    (
+                                        record,
+                                        matched_products,
+                                        quality,
+                                        is_manual,
+                                        phone_model_id,
+                                        phone_model_key,
+                                    )
+                                )
+                            else:
+                                mark_ambiguous(record)
+                            continue
+                        if phone_model_key:
+                            phone_model_id = phone_models.get(phone_model_key)
+
+            if product is None:
+                stats.unmatched += 1
+                if len(unmatched_samples) < max_samples:
+                    unmatched_samples.append(
+                        {"source": record.source, "sku": record.sku, "name": record.name}
+                    )
+                continue
+            record_match(
+                record,
+                product,
+                quality,
+                is_manual=is_manual,
+                phone_model_id=phone_model_id,
+                phone_model_key=phone_model_key,
+            )
+
+        if deferred:
+            # неоднозначные строки чанка ранжируются одной пачкой по близости названий
+            with profiler.stage("fuzzy_scoring"):
+                scores = similarity.score(
+                    [item[0].name for item in deferred],
+                    [[p.id for p in item[1]] for item in deferred],
+                )
+            for item, row_scores in zip(deferred, scores, strict=True):
+                record, candidates, quality, is_manual, phone_model_id, phone_model_key = item
+                winner = pick_best(row_scores, fuzzy_threshold, FUZZY_MIN_MARGIN)
+                if winner is None:
+                    mark_ambiguous(record)
+                    continue
+                position, score = winner
+                stats.fuzzy_matched += 1
+                record_match(
+                    record,
+                    candidates[position],
+                    quality,
+                    is_manual=is_manual,
+                    # как и для однозначных строк: модель из названия важнее модели из override
+                    phone_model_id=(
+                        phone_models.get(phone_model_key) if phone_model_key else phone_model_id
+                    ),
+                    phone_model_key=phone_model_key,
+                    confidence=round(score, 4),
+                )
+
+        flush_chunk_prices()
+        writer.flush()
+        with profiler.stage("persist_state"):
+            feature_cache.persist()
+            feature_cache.trim()
+            _save_watermarks(session, last_ids)
+        with profiler.stage("commit"):
+            session.commit()
+        stats.chunks += 1
+        logger.info(
+            "competitor ftp matching progress",
+            extra={
+                "chunk": stats.chunks,
+                "processed": stats.processed,
+                "total": total,
+                "matched": stats.matched,
+                "prices_created": stats.prices_created,
+            },
+        )
+
+    if sql_last_ids:
+        for source, last_id in sql_last_ids.items():
+            last_ids[source] = max(last_ids.get(source, 0), last_id)
+        _save_watermarks(session, last_ids)
+        session.commit()
+
+    stats.phone_models_created = phone_models.created
+    stats.feature_cache_hits = feature_cache.hits
+    stats.feature_cache_misses = feature_cache.misses
     result = {
         "skipped": False,
+        "mode": "full" if full else "incremental",
         **stats.as_dict(),
         "unmatched_samples": unmatched_samples,
         "ambiguous_samples": ambiguous_samples,
     }
+    if profile:
+        result["profile"] = {
+            "total_seconds": round(time.perf_counter() - started, 4),
+            **profiler.as_dict(),
+        }
+        logger.info("competitor ftp matching profile", extra={"profile": result["profile"]})
     return result
 
 
-__all__ = ["match_competitor_ftp_records"]
+__all__ = [
+    "BrandModelIndex",
+    "MatchWriter",
+    "NameFeatureCache",
+    "NameFeatures",
+    "PhoneModelCache",
+    "StageProfiler",
+    "match_competitor_ftp_records",
+    "merge_match_results",
+]
@@ -1,24 +1,37 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
 import io
+import json
 import logging
 import os
+import posixpath
 import re
+from collections import defaultdict, deque
 from dataclasses import dataclass
 from datetime import date, datetime, timezone
-from decimal import Decimal
-from ftplib import FTP, FTP_TLS
-from typing import Iterable, List, Optional, Sequence
+from decimal import Decimal, InvalidOperation
+from ftplib import FTP, FTP_TLS, error_perm
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Sequence, Union
 
-from openpyxl import load_workbook
-from sqlalchemy import delete, select
+from sqlalchemy import bindparam, delete, insert, select, text
 from sqlalchemy.orm import Session
 
+from app.core.sku import sku_norm_or_none
 from app.models import (
     CompetitorFtpFile,
     CompetitorFtpRawRow,
     CompetitorFtpRecord,
 )
+from app.services.importers.xlsx_readers import (
+    XLSX_READERS,
+    calamine_available,
+    iter_calamine_rows,
+    iter_openpyxl_rows,
+    iter_xml_rows,
+)
 
 try:
     from zoneinfo import ZoneInfo
@@ -30,6 +43,12 @@ logger = logging.getLogger("app.import.competitor_ftp")
 MSK_TZ = ZoneInfo("Europe/Moscow")
 DATE_PATTERN = r"(?P<date>\d{4}\.\d{2}\.\d{2})"
 REQUIRED_COLUMNS = {"group", "sku", "name", "price_opt", "price_roz", "link", "time"}
+INGEST_CHUNK_SIZE = 2000
+DEFAULT_XLSX_READER = "openpyxl"
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# содержимое книги в памяти или путь к скачанному на диск файлу
+XlsxSource = Union[bytes, str, os.PathLike]
 
 
 class CompetitorFtpImportError(RuntimeError):
@@ -52,6 +71,7 @@ class FtpFileInfo:
     path: str
     file_date: date
     mtime: Optional[datetime]
+    size: Optional[int] = None
 
 
 @dataclass
@@ -115,23 +135,67 @@ def _parse_file_date(filename: str, source: FtpSourceConfig) -> Optional[date]:
         return None
 
 
+def _parse_ftp_timestamp(value: str) -> Optional[datetime]:
+    # time-val MDTM/MLSD: YYYYMMDDHHMMSS[.sss], всегда UTC
+    try:
+        parsed = datetime.strptime(value.split(".")[0], "%Y%m%d%H%M%S")
+        return parsed.replace(tzinfo=timezone.utc)
+    except Exception:
+        return None
+
+
 def _parse_mtime_from_mdtm(response: str) -> Optional[datetime]:
     # MDTM response: "213 20251130001510"
     try:
-        ts = response.split()[-1]
-        parsed = datetime.strptime(ts, "%Y%m%d%H%M%S")
-        return parsed.replace(tzinfo=timezone.utc)
+        return _parse_ftp_timestamp(response.split()[-1])
     except Exception:
         return None
 
 
-def list_matching_files(
-    ftp: FTP,
-    source: FtpSourceConfig,
-) -> List[FtpFileInfo]:
+def _sort_key(info: FtpFileInfo) -> tuple[date, datetime]:
+    return info.file_date, info.mtime or datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _list_with_mlsd(ftp: FTP, source: FtpSourceConfig) -> Optional[List[FtpFileInfo]]:
     """
-    Lists files for the source directory that match the pattern with {date}.
+    Имена, mtime и размеры одним листингом; None, если сервер не знает MLSD.
+
+    Отказом в MLSD считается только постоянная ошибка (5xx) или клиент без
+    mlsd(); обрыв соединения и временные ошибки поднимают
+    CompetitorFtpImportError, как и сбой NLST.
     """
+    try:
+        entries = list(ftp.mlsd(source.directory, facts=["type", "size", "modify"]))
+    except (error_perm, AttributeError):
+        return None
+    except Exception as exc:
+        raise CompetitorFtpImportError(
+            f"failed to list directory {source.directory}: {exc}"
+        ) from exc
+    files: List[FtpFileInfo] = []
+    for name, facts in entries:
+        if facts.get("type", "file").lower() != "file":
+            continue
+        filename = os.path.basename(name)
+        file_date = _parse_file_date(filename, source)
+        if not file_date:
+            continue
+        size = facts.get("size")
+        files.append(
+            FtpFileInfo(
+                source=source.name,
+                directory=source.directory,
+                filename=filename,
+                path=posixpath.join(source.directory, filename),
+                file_date=file_date,
+                mtime=_parse_ftp_timestamp(facts["modify"]) if "modify" in facts else None,
+                size=int(size) if size and size.isdigit() else None,
+            )
+        )
+    return files
+
+
+def _list_with_nlst(ftp: FTP, source: FtpSourceConfig, limit: Optional[int]) -> List[FtpFileInfo]:
     try:
         entries = ftp.nlst(source.directory)
     except Exception as exc:  # pragma: no cover - network-dependent
@@ -142,12 +206,6 @@ def list_matching_files(
         file_date = _parse_file_date(filename, source)
         if not file_date:
             continue
-        mtime: Optional[datetime] = None
-        try:
-            resp = ftp.sendcmd(f"MDTM {path}")
-            mtime = _parse_mtime_from_mdtm(resp)
-        except Exception:
-            pass
         files.append(
             FtpFileInfo(
                 source=source.name,
@@ -155,19 +213,67 @@ def list_matching_files(
                 filename=filename,
                 path=path,
                 file_date=file_date,
-                mtime=mtime,
+                mtime=None,
             )
         )
-    files.sort(key=lambda f: (f.file_date, f.mtime or datetime.min.replace(tzinfo=timezone.utc)), reverse=True)
+    if limit is not None:
+        # mtime различает только файлы одной даты, поэтому отсечка оставляет
+        # все файлы с датой не старше N-й по новизне
+        files.sort(key=lambda f: f.file_date, reverse=True)
+        if len(files) > limit:
+            cutoff = files[limit - 1].file_date if limit > 0 else None
+            files = [f for f in files if cutoff is not None and f.file_date >= cutoff]
+    for info in files:
+        try:
+            info.mtime = _parse_mtime_from_mdtm(ftp.sendcmd(f"MDTM {info.path}"))
+        except Exception:
+            pass
+        try:
+            info.size = ftp.size(info.path)
+        except Exception:
+            pass
     return files
 
 
-def download_file(ftp: FTP, path: str) -> bytes:
-    buffer = io.BytesIO()
+def list_matching_files(
+    ftp: FTP,
+    source: FtpSourceConfig,
+    limit: Optional[int] = None,
+) -> List[FtpFileInfo]:
+    """
+    Файлы каталога источника, подходящие под шаблон с {date}.
+
+    Если сервер поддерживает MLSD, хватает одного листинга; иначе NLST и
+    MDTM/SIZE по файлам. С `limit` возвращаются только `limit` самых новых
+    файлов, и метаданные запрашиваются только для файлов, проходящих отсечку.
+    """
+    files = _list_with_mlsd(ftp, source)
+    if files is None:
+        files = _list_with_nlst(ftp, source, limit)
+    files.sort(key=_sort_key, reverse=True)
+    return files if limit is None else files[: max(0, limit)]
+
+
+def download_into(ftp: FTP, path: str, sink: BinaryIO) -> int:
+    """
+    Скачивает `path` в `sink` и возвращает число байт в нём.
+
+    Если в sink уже есть часть файла (его текущая позиция), загрузка
+    продолжается через REST: повтор после обрыва докачивает только хвост.
+    """
+    offset = sink.tell()
     try:
-        ftp.retrbinary(f"RETR {path}", buffer.write)
+        ftp.retrbinary(f"RETR {path}", sink.write, rest=offset or None)
     except Exception as exc:  # pragma: no cover - network-dependent
-        raise CompetitorFtpImportError(f"failed to download {path}: {exc}") from exc
+        raise CompetitorFtpImportError(
+            f"failed to download {path} at byte {sink.tell()}: {exc}"
+        ) from exc
+    return sink.tell()
+
+
+def download_file(ftp: FTP, path: str) -> bytes:
+    buffer = io.BytesIO()
+    download_into(ftp, path, buffer)
     return buffer.getvalue()
 
 
@@ -241,62 +347,178 @@ def _row_value(row: Sequence[object], header_map: dict[str, int], column: str) -
     return row[idx] if idx < len(row) else None
 
 
-def parse_ftp_xlsx(content: bytes, file_date: date, source: str) -> tuple[List[ParsedRow], bool]:
-    workbook = load_workbook(io.BytesIO(content), data_only=True, read_only=True)
-    sheet = workbook.active
-    rows = list(sheet.rows)
-    if not rows:
-        logger.warning("ftp xlsx is empty", extra={"source": source})
-        return [], False
-    header_map = _extract_header_map((cell.value for cell in rows[0]))
-    parsed: List[ParsedRow] = []
-    date_mismatch = False
-    for row in rows[1:]:
-        values = [cell.value for cell in row]
-        sku = _row_value(values, header_map, "sku")
-        link = _row_value(values, header_map, "link")
-        observed_at = _normalize_datetime(_row_value(values, header_map, "time"))
-        amount = _normalize_int(_row_value(values, header_map, "amount")) if "amount" in header_map else None
-        stock = _normalize_bool(_row_value(values, header_map, "stock")) if "stock" in header_map else None
-
-        error: Optional[str] = None
-        if not sku or not link:
-            error = "missing sku or link"
-        elif observed_at is None:
-            error = "time is not parseable"
-        elif amount is None and stock is None:
-            error = "missing amount/stock"
-
-        if observed_at and observed_at.date() != file_date:
-            date_mismatch = True
-
-        parsed.append(
-            ParsedRow(
-                group_name=_row_value(values, header_map, "group") or None,
-                sku=str(sku).strip() if sku else None,
-                name=_row_value(values, header_map, "name") or None,
-                price_opt=_normalize_decimal(_row_value(values, header_map, "price_opt")),
-                price_roz=_normalize_decimal(_row_value(values, header_map, "price_roz")),
-                link=str(link).strip() if link else None,
-                stock=stock,
-                amount=amount,
-                observed_at=observed_at,
-                error=error,
-            )
+def _parse_row(values: Sequence[object], header_map: dict[str, int]) -> ParsedRow:
+    sku = _row_value(values, header_map, "sku")
+    link = _row_value(values, header_map, "link")
+    observed_at = _normalize_datetime(_row_value(values, header_map, "time"))
+    amount = (
+        _normalize_int(_row_value(values, header_map, "amount")) if "amount" in header_map else None
+    )
+    stock = (
+        _normalize_bool(_row_value(values, header_map, "stock")) if "stock" in header_map else None
+    )
+
+    error: Optional[str] = None
+    if not sku or not link:
+        error = "missing sku or link"
+    elif observed_at is None:
+        error = "time is not parseable"
+    elif amount is None and stock is None:
+        error = "missing amount/stock"
+
+    return ParsedRow(
+        group_name=_row_value(values, header_map, "group") or None,
+        sku=str(sku).strip() if sku else None,
+        name=_row_value(values, header_map, "name") or None,
+        price_opt=_normalize_decimal(_row_value(values, header_map, "price_opt")),
+        price_roz=_normalize_decimal(_row_value(values, header_map, "price_roz")),
+        link=str(link).strip() if link else None,
+        stock=stock,
+        amount=amount,
+        observed_at=observed_at,
+        error=error,
+    )
+
+
+def _sheet_rows(content: XlsxSource, reader: str) -> Iterator[Sequence[object]]:
+    if reader not in XLSX_READERS:
+        raise CompetitorFtpImportError(
+            f"unknown xlsx reader {reader!r}, expected one of: {', '.join(XLSX_READERS)}"
         )
+    if reader == "calamine" and not calamine_available():
+        logger.warning("python-calamine is not installed, falling back to openpyxl")
+        reader = "openpyxl"
+    if reader == "xml":
+        return iter_xml_rows(content)
+    if reader == "calamine":
+        return iter_calamine_rows(content)
+    return iter_openpyxl_rows(content)
+
+
+def _is_blank_row(values: Sequence[object]) -> bool:
+    return all(value is None or value == "" for value in values)
+
+
+def iter_ftp_xlsx(
+    content: XlsxSource, source: str, reader: str = DEFAULT_XLSX_READER
+) -> Iterator[ParsedRow]:
+    """
+    Потоково отдаёт строки FTP-прайса, не загружая лист в память.
+
+    Заголовок читается и проверяется сразу, так что битый файл поднимает
+    CompetitorFtpImportError здесь, до того как вызывающий код тронет БД.
+    Строки данных отдаются по одной по мере чтения выбранным ридером
+    (см. xlsx_readers). Пустые строки в конце листа отбрасываются: openpyxl и
+    xml доходят до размера листа, а calamine — только до последней ячейки со
+    значением. Так все ридеры дают одинаковые ParsedRow; пустые строки между
+    данными остаются невалидными строками, как и раньше.
+    """
+    rows = _sheet_rows(content, reader)
+    try:
+        header = next(rows, None)
+        if header is None:
+            logger.warning("ftp xlsx is empty", extra={"source": source})
+            rows.close()
+            return iter(())
+        header_map = _extract_header_map(header)
+    except Exception:
+        rows.close()
+        raise
+
+    def _rows() -> Iterator[ParsedRow]:
+        # пустые строки придерживаются, пока за ними не встретится строка с данными
+        blank: List[Sequence[object]] = []
+        try:
+            for values in rows:
+                if _is_blank_row(values):
+                    blank.append(values)
+                    continue
+                for pending in blank:
+                    yield _parse_row(pending, header_map)
+                blank.clear()
+                yield _parse_row(values, header_map)
+        finally:
+            rows.close()
+
+    return _rows()
+
+
+def _is_date_mismatch(row: ParsedRow, file_date: date) -> bool:
+    return row.observed_at is not None and row.observed_at.date() != file_date
+
+
+def parse_ftp_xlsx(
+    content: XlsxSource,
+    file_date: date,
+    source: str,
+    reader: str = DEFAULT_XLSX_READER,
+) -> tuple[List[ParsedRow], bool]:
+    parsed = list(iter_ftp_xlsx(content, source, reader=reader))
+    date_mismatch = any(_is_date_mismatch(row, file_date) for row in parsed)
     return parsed, date_mismatch
 
 
-def _ensure_file_record(
-    session: Session,
-    info: FtpFileInfo,
-) -> CompetitorFtpFile:
-    existing = session.execute(
+def content_digest(content: XlsxSource) -> str:
+    if isinstance(content, bytes):
+        return hashlib.sha256(content).hexdigest()
+    digest = hashlib.sha256()
+    with open(content, "rb") as handle:
+        for chunk in iter(lambda: handle.read(DIGEST_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_ingested_file(session: Session, info: FtpFileInfo) -> Optional[CompetitorFtpFile]:
+    return session.execute(
         select(CompetitorFtpFile).where(
             CompetitorFtpFile.source == info.source,
             CompetitorFtpFile.file_date == info.file_date,
         )
     ).scalar_one_or_none()
+
+
+def _same_instant(left: Optional[datetime], right: Optional[datetime]) -> bool:
+    if left is None or right is None:
+        return False
+    # SQLite возвращает timezone-aware колонки naive; время листингов — UTC
+    if left.tzinfo is None:
+        left = left.replace(tzinfo=timezone.utc)
+    if right.tzinfo is None:
+        right = right.replace(tzinfo=timezone.utc)
+    return left == right
+
+
+def is_listing_unchanged(existing: Optional[CompetitorFtpFile], info: FtpFileInfo) -> bool:
+    """
+    True, если в листинге уже загруженный файл: то же имя, mtime и размер.
+
+    mtime и размер должны быть известны с обеих сторон; иначе вызывающий код
+    скачивает файл и сравнивает хэши содержимого.
+    """
+    if existing is None or existing.content_hash is None:
+        return False
+    return (
+        existing.filename == info.filename
+        and info.size is not None
+        and existing.size == info.size
+        and _same_instant(existing.mtime, info.mtime)
+    )
+
+
+def mark_file_seen(existing: CompetitorFtpFile, info: FtpFileInfo) -> None:
+    """Обновляет метаданные листинга у файла с неизменным содержимым."""
+    existing.filename = info.filename
+    existing.file_path = info.path
+    existing.mtime = info.mtime
+    existing.size = info.size
+
+
+def _ensure_file_record(
+    session: Session,
+    info: FtpFileInfo,
+    content_hash: Optional[str] = None,
+) -> CompetitorFtpFile:
+    existing = find_ingested_file(session, info)
     if existing:
         session.execute(
             delete(CompetitorFtpRecord).where(CompetitorFtpRecord.file_id == existing.id)
@@ -304,9 +526,8 @@ def _ensure_file_record(
         session.execute(
             delete(CompetitorFtpRawRow).where(CompetitorFtpRawRow.file_id == existing.id)
         )
-        existing.filename = info.filename
-        existing.file_path = info.path
-        existing.mtime = info.mtime
+        mark_file_seen(existing, info)
+        existing.content_hash = content_hash
         return existing
     file_row = CompetitorFtpFile(
         source=info.source,
@@ -314,68 +535,513 @@ def _ensure_file_record(
         file_path=info.path,
         file_date=info.file_date,
         mtime=info.mtime,
+        size=info.size,
+        content_hash=content_hash,
     )
     session.add(file_row)
     session.flush()
     return file_row
 
 
+# колонки пакетной загрузки в порядке COPY
+RAW_ROW_COPY_COLUMNS = (
+    "id",
+    "file_id",
+    "row_index",
+    "source",
+    "file_date",
+    "group_name",
+    "sku",
+    "name",
+    "price_opt",
+    "price_roz",
+    "link",
+    "stock",
+    "amount",
+    "observed_at",
+    "error",
+    "is_valid",
+)
+RECORD_COPY_COLUMNS = (
+    "raw_row_id",
+    "file_id",
+    "row_index",
+    "source",
+    "file_date",
+    "group_name",
+    "sku",
+    "sku_norm",
+    "name",
+    "price_opt",
+    "price_roz",
+    "link",
+    "in_stock",
+    "amount",
+    "observed_at",
+)
+
+
+def _use_copy(session: Session) -> bool:
+    dialect = session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def _copy_value(value: object) -> str:
+    # текстовый формат COPY PostgreSQL
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows(session: Session, table, columns: Sequence[str], rows: Sequence[dict]) -> None:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def _reserve_ids(session: Session, table, count: int) -> List[int]:
+    return list(
+        session.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id'))"
+                " FROM generate_series(1, :count)"
+            ),
+            {"table": table.name, "count": count},
+        ).scalars()
+    )
+
+
+def _insert_raw_rows(session: Session, rows: List[dict]) -> List[int]:
+    """Вставляет сырые строки и возвращает их id в порядке входа."""
+    table = CompetitorFtpRawRow.__table__
+    if _use_copy(session):
+        ids = _reserve_ids(session, table, len(rows))
+        for row, row_id in zip(rows, ids, strict=True):
+            row["id"] = row_id
+        _copy_rows(session, table, RAW_ROW_COPY_COLUMNS, rows)
+        return ids
+    stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    return list(session.execute(stmt, rows).scalars())
+
+
+def _insert_records(session: Session, rows: List[dict]) -> None:
+    if not rows:
+        return
+    table = CompetitorFtpRecord.__table__
+    if _use_copy(session):
+        _copy_rows(session, table, RECORD_COPY_COLUMNS, rows)
+    else:
+        session.execute(insert(table), rows)
+
+
+# колонки сырых строк, которые сравнивает дельта-импорт
+RAW_DIFF_FIELDS = (
+    "group_name",
+    "sku",
+    "name",
+    "price_opt",
+    "price_roz",
+    "link",
+    "stock",
+    "amount",
+    "observed_at",
+    "error",
+    "is_valid",
+)
+DELTA_DELETE_CHUNK = 500
+_CENT = Decimal("0.01")
+
+
+def _diff_value(field: str, value: object) -> object:
+    # приводим к тому, что хранят колонки: Numeric(12, 2) и timezone-aware время,
+    # которое SQLite возвращает naive в московском времени записи
+    if value is None:
+        return None
+    if field in ("price_opt", "price_roz"):
+        # Infinity/NaN и числа вне диапазона quantize не округлить — сравниваем как строку
+        try:
+            price = Decimal(str(value))
+            if price.is_finite():
+                return price.quantize(_CENT)
+        except InvalidOperation:
+            pass
+        return str(value)
+    if field == "observed_at":
+        if value.tzinfo is None:  # type: ignore[union-attr]
+            value = value.replace(tzinfo=MSK_TZ)  # type: ignore[union-attr]
+        return value.astimezone(timezone.utc)  # type: ignore[union-attr]
+    return value
+
+
+def _diff_signature(values: dict) -> tuple:
+    return tuple(_diff_value(field, values[field]) for field in RAW_DIFF_FIELDS)
+
+
+RAW_ARCHIVE_FIELDS = ("row_index", *RAW_DIFF_FIELDS)
+RAW_ARCHIVE_COMPRESSLEVEL = 6
+
+
+def _archive_default(value: object) -> str:
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"unsupported archive value: {value!r}")
+
+
+class _RawArchiveWriter:
+    """Копит сырые строки как JSON lines, сжатые gzip."""
+
+    def __init__(self) -> None:
+        self._buffer = io.BytesIO()
+        self._gzip = gzip.GzipFile(
+            fileobj=self._buffer, mode="wb", compresslevel=RAW_ARCHIVE_COMPRESSLEVEL, mtime=0
+        )
+
+    def write(self, values: dict) -> None:
+        line = json.dumps(
+            {field: values[field] for field in RAW_ARCHIVE_FIELDS},
+            default=_archive_default,
+            ensure_ascii=False,
+        )
+        self._gzip.write(line.encode("utf-8") + b"\n")
+
+    def close(self) -> bytes:
+        self._gzip.close()
+        return self._buffer.getvalue()
+
+
+def iter_raw_archive(archive: bytes) -> Iterator[dict]:
+    """
+    Строки сырого архива файла (CompetitorFtpFile.raw_archive) с ключами как
+    у колонок competitor_ftp_raw_row; цены — Decimal, observed_at — datetime.
+    """
+    with gzip.GzipFile(fileobj=io.BytesIO(archive), mode="rb") as handle:
+        for line in handle:
+            values = json.loads(line)
+            for field in ("price_opt", "price_roz"):
+                if values[field] is not None:
+                    values[field] = Decimal(values[field])
+            if values["observed_at"] is not None:
+                values["observed_at"] = datetime.fromisoformat(values["observed_at"])
+            yield values
+
+
+@dataclass
+class _StoredRow:
+    raw_id: Optional[int]
+    record_id: Optional[int]
+    row_index: int
+    signature: tuple
+
+
+def _load_stored_rows(session: Session, file_id: int) -> dict[tuple, deque[_StoredRow]]:
+    """Уже загруженные строки файла по (sku, link) в порядке листа."""
+    raw = CompetitorFtpRawRow.__table__
+    record = CompetitorFtpRecord.__table__
+    result = session.execute(
+        select(
+            raw.c.id,
+            raw.c.row_index,
+            record.c.id.label("record_id"),
+            *(raw.c[f] for f in RAW_DIFF_FIELDS),
+        )
+        .select_from(raw.outerjoin(record, record.c.raw_row_id == raw.c.id))
+        .where(raw.c.file_id == file_id)
+        .order_by(raw.c.row_index)
+    )
+    stored: dict[tuple, deque[_StoredRow]] = defaultdict(deque)
+    for row in result.mappings():
+        stored[(row["sku"], row["link"])].append(
+            _StoredRow(
+                raw_id=row["id"],
+                record_id=row["record_id"],
+                row_index=row["row_index"],
+                signature=_diff_signature(row),
+            )
+        )
+    return stored
+
+
+def _load_archived_rows(
+    session: Session, file_row: CompetitorFtpFile
+) -> dict[tuple, deque[_StoredRow]]:
+    """Строки архивированного файла по (sku, link) с id невалидных сырых строк и записей."""
+    raw = CompetitorFtpRawRow.__table__
+    record = CompetitorFtpRecord.__table__
+    raw_ids = dict(
+        session.execute(select(raw.c.row_index, raw.c.id).where(raw.c.file_id == file_row.id)).all()
+    )
+    record_ids = dict(
+        session.execute(
+            select(record.c.row_index, record.c.id).where(record.c.file_id == file_row.id)
+        ).all()
+    )
+    stored: dict[tuple, deque[_StoredRow]] = defaultdict(deque)
+    for values in iter_raw_archive(file_row.raw_archive or b""):
+        row_index = values["row_index"]
+        stored[(values["sku"], values["link"])].append(
+            _StoredRow(
+                raw_id=raw_ids.get(row_index),
+                record_id=record_ids.get(row_index),
+                row_index=row_index,
+                signature=_diff_signature(values),
+            )
+        )
+    return stored
+
+
+def _take_stored(candidates: Optional[deque[_StoredRow]], signature: tuple) -> Optional[_StoredRow]:
+    """Забирает сохранённую строку с тем же ключом: сначала полностью совпадающую."""
+    if not candidates:
+        return None
+    for stored in candidates:
+        if stored.signature == signature:
+            candidates.remove(stored)
+            return stored
+    return candidates.popleft()
+
+
+def _delete_by_ids(session: Session, table, ids: List[int]) -> None:
+    for start in range(0, len(ids), DELTA_DELETE_CHUNK):
+        session.execute(
+            delete(table).where(table.c.id.in_(ids[start : start + DELTA_DELETE_CHUNK]))
+        )
+
+
+def _raw_row_values(
+    file_row: CompetitorFtpFile, info: FtpFileInfo, idx: int, row: ParsedRow
+) -> dict:
+    return {
+        "file_id": file_row.id,
+        "row_index": idx,
+        "source": info.source,
+        "file_date": info.file_date,
+        "group_name": row.group_name,
+        "sku": row.sku,
+        "name": row.name,
+        "price_opt": row.price_opt,
+        "price_roz": row.price_roz,
+        "link": row.link,
+        "stock": row.stock,
+        "amount": row.amount,
+        "observed_at": row.observed_at,
+        "error": row.error,
+        "is_valid": row.is_valid,
+    }
+
+
+def _record_values(
+    file_row: CompetitorFtpFile, info: FtpFileInfo, raw_id: Optional[int], idx: int, row: ParsedRow
+) -> dict:
+    in_stock = (row.amount or 0) > 0 if row.amount is not None else bool(row.stock)
+    sku = row.sku or ""
+    return {
+        "raw_row_id": raw_id,
+        "file_id": file_row.id,
+        "row_index": idx,
+        "source": info.source,
+        "file_date": info.file_date,
+        "group_name": row.group_name,
+        "sku": sku,
+        "sku_norm": sku_norm_or_none(sku),
+        "name": row.name,
+        "price_opt": row.price_opt,
+        "price_roz": row.price_roz,
+        "link": row.link,
+        "in_stock": in_stock,
+        "amount": row.amount,
+        "observed_at": row.observed_at or datetime.now(tz=MSK_TZ),
+    }
+
+
 def ingest_ftp_file(
     session: Session,
     info: FtpFileInfo,
-    content: bytes,
+    content: XlsxSource,
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    reader: str = DEFAULT_XLSX_READER,
+    content_hash: Optional[str] = None,
+    delta: bool = False,
+    raw_archive: bool = False,
 ) -> dict:
-    rows, date_mismatch = parse_ftp_xlsx(content, file_date=info.file_date, source=info.source)
-    file_row = _ensure_file_record(session, info)
-    file_row.rows_total = len(rows)
+    """
+    Заменяет строки файла (source, file_date) строками переданной книги.
+
+    Запись файла хранит размер, mtime и sha256 содержимого, чтобы следующие
+    прогоны пропускали неизменный файл (см. is_listing_unchanged).
+    Строки пишутся чанками через Core, а не ORM: на PostgreSQL (psycopg2) сырые
+    строки получают id из своей последовательности и обе таблицы грузятся
+    через COPY; в остальных БД сырые строки идут multi-row INSERT с
+    RETURNING, записи — через executemany.
+
+    С raw_archive=True все строки вместо этого пишутся gzip-архивом JSON lines
+    в запись файла (см. iter_raw_archive): сырыми строками остаются только
+    невалидные, чтобы их ошибки можно было запросить, а записи пишутся без
+    raw_row_id.
+
+    С delta=True повторная выгрузка уже загруженного файла не перезаписывается,
+    а сравнивается с сохранёнными строками по (sku, link): совпадающие строки
+    остаются (у переехавшей меняется только row_index), изменённые обновляются
+    на месте и получают новую запись, чтобы watermark матчинга по id увидел
+    новую цену (матчер обновляет price/in_stock уже записанной цены с тем же
+    observed_at), новые строки вставляются, пропавшие удаляются.
+    Файл, сохранённый в другом режиме raw_archive, перезаписывается целиком.
+    """
+    rows = iter_ftp_xlsx(content, source=info.source, reader=reader)
+    content_hash = content_hash or content_digest(content)
+    existing = find_ingested_file(session, info) if delta else None
+    if existing is not None and (existing.raw_archive is not None) != raw_archive:
+        existing = None
+    if existing is not None:
+        mark_file_seen(existing, info)
+        existing.content_hash = content_hash
+        file_row = existing
+        if raw_archive:
+            stored = _load_archived_rows(session, file_row)
+        else:
+            stored = _load_stored_rows(session, file_row.id)
+    else:
+        file_row = _ensure_file_record(session, info, content_hash=content_hash)
+        stored = {}
+    file_row.rows_total = 0
     file_row.rows_valid = 0
     file_row.rows_invalid = 0
-    file_row.date_mismatch = date_mismatch
-
-    for idx, row in enumerate(rows, start=2):  # start=2 to reflect Excel row numbers
-        raw = CompetitorFtpRawRow(
-            file_id=file_row.id,
-            row_index=idx,
-            source=info.source,
-            file_date=info.file_date,
-            group_name=row.group_name,
-            sku=row.sku,
-            name=row.name,
-            price_opt=row.price_opt,
-            price_roz=row.price_roz,
-            link=row.link,
-            stock=row.stock,
-            amount=row.amount,
-            observed_at=row.observed_at,
-            error=row.error,
-            is_valid=row.is_valid,
+    file_row.date_mismatch = False
+    session.flush()
+
+    raw_table = CompetitorFtpRawRow.__table__
+    record_table = CompetitorFtpRecord.__table__
+    raw_update = (
+        raw_table.update()
+        .where(raw_table.c.id == bindparam("raw_id"))
+        .values({column: bindparam(column) for column in ("row_index", *RAW_DIFF_FIELDS)})
+    )
+    record_move = (
+        record_table.update()
+        .where(record_table.c.id == bindparam("record_id"))
+        .values(row_index=bindparam("row_index"))
+    )
+    archive = _RawArchiveWriter() if raw_archive else None
+    delta_stats = {"rows_inserted": 0, "rows_updated": 0, "rows_unchanged": 0, "rows_deleted": 0}
+
+    # start=2 — номера строк как в Excel
+    numbered = enumerate(rows, start=2)
+    while True:
+        chunk = list(islice(numbered, max(1, chunk_size)))
+        if not chunk:
+            break
+        # строки, получающие новую сырую строку; их записи ссылаются на вернувшиеся id
+        new_raw: List[tuple[dict, ParsedRow]] = []
+        # (id сырой строки или None, row_index, row) прочих строк с новой записью
+        new_records: List[tuple[Optional[int], int, ParsedRow]] = []
+        raw_updates: List[dict] = []
+        record_moves: List[dict] = []
+        stale_raw: List[int] = []
+        stale_records: List[int] = []
+        for idx, row in chunk:
+            values = _raw_row_values(file_row, info, idx, row)
+            file_row.rows_total += 1
+            if _is_date_mismatch(row, info.file_date):
+                file_row.date_mismatch = True
+            if not row.is_valid:
+                file_row.rows_invalid += 1
+            else:
+                file_row.rows_valid += 1
+            if archive is not None:
+                archive.write(values)
+            keep_raw = archive is None or not row.is_valid
+
+            match = None
+            if stored:
+                signature = _diff_signature(values)
+                match = _take_stored(stored.get((row.sku, row.link)), signature)
+            if match is None:
+                delta_stats["rows_inserted"] += 1
+                if keep_raw:
+                    new_raw.append((values, row))
+                else:
+                    new_records.append((None, idx, row))
+                continue
+            unchanged = match.signature == signature
+            if unchanged and match.row_index == idx:
+                delta_stats["rows_unchanged"] += 1
+                continue
+            raw_values = {
+                "raw_id": match.raw_id,
+                "row_index": idx,
+                **{f: values[f] for f in RAW_DIFF_FIELDS},
+            }
+            if unchanged:
+                delta_stats["rows_unchanged"] += 1
+                if match.raw_id is not None:
+                    raw_updates.append(raw_values)
+                if match.record_id is not None:
+                    record_moves.append({"record_id": match.record_id, "row_index": idx})
+                continue
+            delta_stats["rows_updated"] += 1
+            if match.record_id is not None:
+                stale_records.append(match.record_id)
+            raw_id = None
+            if match.raw_id is not None and keep_raw:
+                raw_updates.append(raw_values)
+                raw_id = match.raw_id
+            elif match.raw_id is not None:
+                stale_raw.append(match.raw_id)
+            elif keep_raw:
+                new_raw.append((values, row))
+                continue
+            if row.is_valid:
+                new_records.append((raw_id, idx, row))
+
+        _delete_by_ids(session, record_table, stale_records)
+        _delete_by_ids(session, raw_table, stale_raw)
+        if raw_updates:
+            session.execute(raw_update, raw_updates)
+        if record_moves:
+            session.execute(record_move, record_moves)
+        raw_ids = _insert_raw_rows(session, [values for values, _ in new_raw]) if new_raw else []
+        records = [
+            _record_values(file_row, info, raw_id, values["row_index"], row)
+            for raw_id, (values, row) in zip(raw_ids, new_raw, strict=True)
+            if row.is_valid
+        ]
+        records.extend(
+            _record_values(file_row, info, raw_id, idx, row) for raw_id, idx, row in new_records
         )
-        session.add(raw)
-        if not row.is_valid:
-            file_row.rows_invalid += 1
-            continue
+        _insert_records(session, records)
 
-        in_stock = (row.amount or 0) > 0 if row.amount is not None else bool(row.stock)
-        record = CompetitorFtpRecord(
-            raw_row=raw,
-            file=file_row,
-            source=info.source,
-            file_date=info.file_date,
-            group_name=row.group_name,
-            sku=row.sku or "",
-            name=row.name,
-            price_opt=row.price_opt,
-            price_roz=row.price_roz,
-            link=row.link,
-            in_stock=in_stock,
-            amount=row.amount,
-            observed_at=row.observed_at or datetime.now(tz=MSK_TZ),
+    if stored:
+        leftovers = [item for candidates in stored.values() for item in candidates]
+        _delete_by_ids(
+            session,
+            record_table,
+            [item.record_id for item in leftovers if item.record_id is not None],
+        )
+        _delete_by_ids(
+            session, raw_table, [item.raw_id for item in leftovers if item.raw_id is not None]
         )
-        session.add(record)
-        file_row.rows_valid += 1
+        delta_stats["rows_deleted"] = len(leftovers)
+    file_row.raw_archive = archive.close() if archive is not None else None
 
-    session.flush()
-    return {
+    stats = {
         "source": info.source,
         "file": info.filename,
         "file_date": info.file_date.isoformat(),
@@ -384,4 +1050,8 @@ def ingest_ftp_file(
         "rows_invalid": file_row.rows_invalid,
         "date_mismatch": file_row.date_mismatch,
     }
-
+    if archive is not None:
+        stats["raw_archive_bytes"] = len(file_row.raw_archive)
+    if existing is not None:
+        stats.update(delta_stats)
+    return stats
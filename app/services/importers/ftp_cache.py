@@ -0,0 +1,180 @@
+"""
+Локальный дисковый кэш скачанных FTP-прайсов конкурентов.
+
+Ключ записи — (source, filename, mtime, size) из FTP-листинга; файл лежит как
+``<root>/<source>/<filename>.<mtime>.<size>.xlsx`` рядом с JSON-файлом, где
+хранятся метаданные листинга и хэш содержимого, так что файл из кэша можно
+загрузить повторно без FTP-сервера. Вытеснение по последнему использованию:
+сначала записи, не использованные ``max_age_days``, затем самые давно
+использованные, пока кэш не уложится в ``max_bytes``.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence
+
+from app.services.importers.competitor_ftp import FtpFileInfo, XlsxSource
+
+logger = logging.getLogger("app.import.competitor_ftp.cache")
+
+_DATA_SUFFIX = ".xlsx"
+_META_SUFFIX = ".json"
+
+
+@dataclass
+class CachedFile:
+    info: FtpFileInfo
+    path: Path
+    content_hash: Optional[str]
+
+
+def _entry_stem(info: FtpFileInfo) -> Optional[str]:
+    if info.mtime is None or info.size is None:
+        return None
+    return f"{info.filename}.{info.mtime.strftime('%Y%m%d%H%M%S')}.{info.size}"
+
+
+def _safe_name(value: str) -> str:
+    return value.replace("/", "_").replace(os.sep, "_")
+
+
+class FtpFileCache:
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        max_bytes: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+
+    def _data_path(self, info: FtpFileInfo) -> Optional[Path]:
+        stem = _entry_stem(info)
+        if stem is None:
+            return None
+        return self.root / _safe_name(info.source) / _safe_name(stem + _DATA_SUFFIX)
+
+    def get(self, info: FtpFileInfo) -> Optional[Path]:
+        """Путь к копии файла из листинга в кэше или None при промахе."""
+        path = self._data_path(info)
+        if path is None or not path.exists() or not path.with_suffix(_META_SUFFIX).exists():
+            return None
+        os.utime(path)  # время использования для вытеснения
+        return path
+
+    def put(
+        self, info: FtpFileInfo, content: XlsxSource, content_hash: Optional[str] = None
+    ) -> Optional[Path]:
+        """
+        Сохраняет скачанный файл. Файлы без mtime или размера в листинге
+        нельзя адресовать ключом, они не кэшируются.
+        """
+        path = self._data_path(info)
+        if path is None:
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # пишем во временный файл и переименовываем: недописанный файл никто не увидит
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                if isinstance(content, bytes):
+                    handle.write(content)
+                else:
+                    with open(content, "rb") as source:
+                        shutil.copyfileobj(source, handle)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        meta = {
+            "source": info.source,
+            "directory": info.directory,
+            "filename": info.filename,
+            "path": info.path,
+            "file_date": info.file_date.isoformat(),
+            "mtime": info.mtime.isoformat() if info.mtime else None,
+            "size": info.size,
+            "content_hash": content_hash,
+        }
+        path.with_suffix(_META_SUFFIX).write_text(
+            json.dumps(meta, ensure_ascii=False), encoding="utf-8"
+        )
+        return path
+
+    def entries(self, sources: Optional[Sequence[str]] = None) -> List[CachedFile]:
+        """Файлы в кэше, новые первыми по (file_date, mtime), при необходимости по источникам."""
+        cached: List[CachedFile] = []
+        for meta_path in self._meta_paths():
+            data_path = meta_path.with_suffix(_DATA_SUFFIX)
+            if not data_path.exists():
+                continue
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                logger.warning("ftp cache entry is unreadable", extra={"path": str(meta_path)})
+                continue
+            if sources is not None and meta["source"] not in sources:
+                continue
+            info = FtpFileInfo(
+                source=meta["source"],
+                directory=meta["directory"],
+                filename=meta["filename"],
+                path=meta["path"],
+                file_date=date.fromisoformat(meta["file_date"]),
+                mtime=datetime.fromisoformat(meta["mtime"]) if meta.get("mtime") else None,
+                size=meta.get("size"),
+            )
+            cached.append(
+                CachedFile(info=info, path=data_path, content_hash=meta.get("content_hash"))
+            )
+        # записи без mtime не сохраняются, см. put()
+        cached.sort(key=lambda item: (item.info.file_date, item.info.mtime), reverse=True)
+        return cached
+
+    def _meta_paths(self) -> Iterator[Path]:
+        if not self.root.exists():
+            return iter(())
+        return self.root.glob(f"*/*{_META_SUFFIX}")
+
+    def evict(self) -> int:
+        """Удаляет устаревшие и давно не использованные записи; возвращает число удалённых."""
+        now = time.time()
+        entries = []
+        for meta_path in self._meta_paths():
+            data_path = meta_path.with_suffix(_DATA_SUFFIX)
+            try:
+                stat = data_path.stat()
+            except FileNotFoundError:
+                meta_path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, data_path, meta_path))
+        entries.sort()  # давно не использованные первыми
+
+        removed = 0
+        total = sum(size for _, size, _, _ in entries)
+        max_age = self.max_age_days * 86400 if self.max_age_days is not None else None
+        for used_at, size, data_path, meta_path in entries:
+            too_old = max_age is not None and now - used_at > max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_old and not too_big:
+                continue
+            data_path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            logger.info("ftp cache evicted %s files", removed, extra={"cache_bytes": total})
+        return removed
+
+
+__all__ = ["CachedFile", "FtpFileCache"]
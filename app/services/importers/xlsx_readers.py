@@ -0,0 +1,427 @@
+"""
+Чтение строк активного листа XLSX-книги.
+
+Каждый ридер отдаёт лист кортежами значений ячеек с той же семантикой, что и
+openpyxl ``iter_rows(values_only=True)`` в режиме read-only/data-only:
+пропущенные строки внутри листа отдаются пустыми, строки и колонки за
+пределами объявленного dimension отбрасываются, числа без дробной части —
+int, числа с форматом даты — datetime.
+
+* ``openpyxl`` — эталонный ридер.
+* ``xml`` — потоково разбирает XML листа прямо из zip через target-колбэки
+  expat, без объектов ячеек и дерева элементов.
+* ``calamine`` — ридер на Rust из опционального пакета ``python-calamine``;
+  читает фактически заполненные ячейки и не смотрит на dimension.
+"""
+from __future__ import annotations
+
+import io
+import os
+import posixpath
+import zipfile
+from datetime import date, datetime, time
+from typing import IO, BinaryIO, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from xml.etree.ElementTree import XMLParser, fromstring
+
+from openpyxl import load_workbook
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel, from_ISO8601
+
+try:
+    import python_calamine
+except ImportError:  # pragma: no cover - optional dependency
+    python_calamine = None  # type: ignore[assignment]
+
+XLSX_READERS = ("openpyxl", "xml", "calamine")
+# сколько байт XML листа отдаётся парсеру между yield
+XML_FEED_SIZE = 64 * 1024
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+_ROW = f"{_MAIN_NS}row"
+_CELL = f"{_MAIN_NS}c"
+_VALUE = f"{_MAIN_NS}v"
+_TEXT = f"{_MAIN_NS}t"
+_INLINE = f"{_MAIN_NS}is"
+_SHARED_ITEM = f"{_MAIN_NS}si"
+_PHONETIC = f"{_MAIN_NS}rPh"
+_DIMENSION = f"{_MAIN_NS}dimension"
+
+# целые float меньше этого Excel пишет без экспоненты,
+# и openpyxl читает их как int
+_CALAMINE_INT_LIMIT = 1e15
+
+
+def calamine_available() -> bool:
+    return python_calamine is not None
+
+
+def _workbook_file(content: Union[bytes, str, os.PathLike]) -> Union[BinaryIO, str]:
+    """Ридеры принимают байты книги или путь к файлу на диске."""
+    if isinstance(content, bytes):
+        return io.BytesIO(content)
+    return os.fspath(content)
+
+
+def iter_openpyxl_rows(content: Union[bytes, str, os.PathLike]) -> Iterator[Tuple[object, ...]]:
+    workbook = load_workbook(_workbook_file(content), data_only=True, read_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# --- ридер xml ---------------------------------------------------------------
+
+
+class _WorkbookInfo:
+    def __init__(self, archive: zipfile.ZipFile) -> None:
+        workbook_path = _office_document_path(archive)
+        base = posixpath.dirname(workbook_path)
+        workbook = fromstring(archive.read(workbook_path))
+        rels = _read_rels(archive, workbook_path)
+
+        props = workbook.find(f"{_MAIN_NS}workbookPr")
+        date1904 = props is not None and props.get("date1904") in ("1", "true")
+        self.epoch = MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+        self.active_index = 0
+        for view in workbook.iter(f"{_MAIN_NS}workbookView"):
+            if view.get("activeTab") is not None:
+                self.active_index = int(view.get("activeTab"))
+                break
+
+        sheets = workbook.findall(f"{_MAIN_NS}sheets/{_MAIN_NS}sheet")
+        self.sheet_path: Optional[str] = None
+        if 0 <= self.active_index < len(sheets):
+            rel = rels.get(sheets[self.active_index].get(f"{_REL_NS}id"))
+            if rel is not None:
+                self.sheet_path = _resolve(base, rel[1])
+
+        self.shared_strings_path: Optional[str] = None
+        self.styles_path: Optional[str] = None
+        for rel_type, target in rels.values():
+            if rel_type.endswith("/sharedStrings"):
+                self.shared_strings_path = _resolve(base, target)
+            elif rel_type.endswith("/styles"):
+                self.styles_path = _resolve(base, target)
+
+
+def _resolve(base: str, target: str) -> str:
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base, target))
+
+
+def _read_rels(archive: zipfile.ZipFile, part: str) -> dict[str, Tuple[str, str]]:
+    rels_path = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+    try:
+        root = fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+    return {
+        rel.get("Id"): (rel.get("Type", ""), rel.get("Target", ""))
+        for rel in root.iter(f"{_PKG_REL_NS}Relationship")
+    }
+
+
+def _office_document_path(archive: zipfile.ZipFile) -> str:
+    for rel_type, target in _read_rels(archive, "").values():
+        if rel_type.endswith("/officeDocument"):
+            return _resolve("", target)
+    return "xl/workbook.xml"
+
+
+def _date_styles(archive: zipfile.ZipFile, path: Optional[str]) -> Tuple[Set[int], Set[int]]:
+    """Индексы стилей cellXfs, форматирующих числа как даты и как интервалы."""
+    if path is None:
+        return set(), set()
+    root = fromstring(archive.read(path))
+    custom = {
+        int(fmt.get("numFmtId")): fmt.get("formatCode")
+        for fmt in root.iter(f"{_MAIN_NS}numFmt")
+    }
+    dates: Set[int] = set()
+    timedeltas: Set[int] = set()
+    cell_xfs = root.find(f"{_MAIN_NS}cellXfs")
+    for idx, xf in enumerate(cell_xfs if cell_xfs is not None else ()):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+        if is_date_format(fmt):
+            dates.add(idx)
+        if is_timedelta_format(fmt):
+            timedeltas.add(idx)
+    return dates, timedeltas
+
+
+class _SharedStringsTarget:
+    """Собирает тексты <si>: обычные и rich-text фрагменты, без фонетических подсказок."""
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self._parts: List[str] = []
+        self._in_text = False
+        self._in_phonetic = False
+
+    def start(self, tag: str, attrib: dict) -> None:
+        if tag == _TEXT and not self._in_phonetic:
+            self._in_text = True
+        elif tag == _PHONETIC:
+            self._in_phonetic = True
+
+    def end(self, tag: str) -> None:
+        if tag == _TEXT:
+            self._in_text = False
+        elif tag == _PHONETIC:
+            self._in_phonetic = False
+        elif tag == _SHARED_ITEM:
+            self.strings.append("".join(self._parts).replace("x005F_", ""))
+            self._parts = []
+
+    def data(self, text: str) -> None:
+        if self._in_text:
+            self._parts.append(text)
+
+    def close(self) -> None:
+        return None
+
+
+def _read_shared_strings(archive: zipfile.ZipFile, path: Optional[str]) -> List[str]:
+    if path is None:
+        return []
+    target = _SharedStringsTarget()
+    parser = XMLParser(target=target)
+    with archive.open(path) as source:
+        for _ in _feed(parser, source):
+            pass
+    parser.close()
+    return target.strings
+
+
+def _feed(parser: XMLParser, source: IO[bytes]) -> Iterator[None]:
+    while True:
+        chunk = source.read(XML_FEED_SIZE)
+        if not chunk:
+            return
+        parser.feed(chunk)
+        yield None
+
+
+def _column_index(coordinate: str) -> int:
+    column = 0
+    for char in coordinate:
+        if "A" <= char <= "Z":
+            column = column * 26 + ord(char) - 64
+        elif "a" <= char <= "z":
+            column = column * 26 + ord(char) - 96
+        else:
+            break
+    return column
+
+
+def _cast_number(value: str) -> object:
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+class _SheetTarget:
+    """
+    Target expat для части листа.
+
+    Повторяет обработку типов ячеек, координат и dimension листа из
+    WorkSheetParser/ReadOnlyWorksheet openpyxl; готовые строки копятся в
+    ``rows``, пока вызывающий код их не заберёт.
+    """
+
+    def __init__(
+        self,
+        shared_strings: Sequence[str],
+        date_styles: Set[int],
+        timedelta_styles: Set[int],
+        epoch: datetime,
+    ) -> None:
+        self.rows: List[Tuple[object, ...]] = []
+        self.done = False
+        self._shared = shared_strings
+        self._date_styles = date_styles
+        self._timedelta_styles = timedelta_styles
+        self._epoch = epoch
+        self._max_col: Optional[int] = None
+        self._max_row: Optional[int] = None
+        self._empty_row: Tuple[object, ...] = ()
+        self._next_row = 1
+        self._row_idx = 0
+        self._col_idx = 0
+        self._cells: List[Tuple[int, object]] = []
+        self._cell_type = "n"
+        self._cell_style = 0
+        self._cell_col = 0
+        self._value_parts: List[str] = []
+        self._inline_parts: Optional[List[str]] = None
+        self._in_value = False
+        self._in_text = False
+        self._in_phonetic = False
+
+    def start(self, tag: str, attrib: dict) -> None:
+        if tag == _CELL:
+            self._cell_type = attrib.get("t", "n")
+            style = attrib.get("s")
+            self._cell_style = int(style) if style else 0
+            coordinate = attrib.get("r")
+            self._col_idx = _column_index(coordinate) if coordinate else self._col_idx + 1
+            self._cell_col = self._col_idx
+            self._value_parts = []
+            self._inline_parts = None
+        elif tag == _VALUE:
+            self._in_value = True
+        elif tag == _INLINE:
+            self._inline_parts = []
+        elif tag == _TEXT and self._inline_parts is not None and not self._in_phonetic:
+            self._in_text = True
+        elif tag == _PHONETIC:
+            self._in_phonetic = True
+        elif tag == _ROW:
+            ref = attrib.get("r")
+            self._row_idx = int(float(ref)) if ref else self._row_idx + 1
+            self._col_idx = 0
+            self._cells = []
+        elif tag == _DIMENSION:
+            ref = attrib.get("ref")
+            if ref:
+                _, _, self._max_col, self._max_row = range_boundaries(ref)
+                if self._max_col is not None:
+                    self._empty_row = (None,) * self._max_col
+
+    def end(self, tag: str) -> None:
+        if tag == _CELL:
+            self._cells.append((self._cell_col, self._cell_value()))
+        elif tag == _VALUE:
+            self._in_value = False
+        elif tag == _TEXT:
+            self._in_text = False
+        elif tag == _PHONETIC:
+            self._in_phonetic = False
+        elif tag == _ROW:
+            self._end_row()
+
+    def data(self, text: str) -> None:
+        if self._in_value:
+            self._value_parts.append(text)
+        elif self._in_text:
+            self._inline_parts.append(text)  # type: ignore[union-attr]
+
+    def close(self) -> None:
+        return None
+
+    def _cell_value(self) -> object:
+        data_type = self._cell_type
+        if data_type == "inlineStr":
+            return "".join(self._inline_parts) if self._inline_parts is not None else None
+        value = "".join(self._value_parts)
+        if not value:
+            return None
+        if data_type == "n":
+            number = _cast_number(value)
+            if self._cell_style in self._date_styles:
+                try:
+                    return from_excel(
+                        number, self._epoch, timedelta=self._cell_style in self._timedelta_styles
+                    )
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return number
+        if data_type == "s":
+            return self._shared[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        return value
+
+    def _end_row(self) -> None:
+        idx = self._row_idx
+        if self.done or (self._max_row is not None and idx > self._max_row):
+            self.done = True
+            return
+        while self._next_row < idx:
+            self._next_row += 1
+            self.rows.append(self._empty_row)
+        if self._next_row > idx:
+            return
+        self._next_row += 1
+        cells = self._cells
+        if not cells and not self._max_col:
+            self.rows.append(())
+            return
+        width = self._max_col or cells[-1][0]
+        row: List[object] = [None] * width
+        for column, value in cells:
+            if 1 <= column <= width:
+                row[column - 1] = value
+        self.rows.append(tuple(row))
+
+
+def iter_xml_rows(content: Union[bytes, str, os.PathLike]) -> Iterator[Tuple[object, ...]]:
+    with zipfile.ZipFile(_workbook_file(content)) as archive:
+        info = _WorkbookInfo(archive)
+        if info.sheet_path is None:
+            return
+        shared_strings = _read_shared_strings(archive, info.shared_strings_path)
+        date_styles, timedelta_styles = _date_styles(archive, info.styles_path)
+        target = _SheetTarget(shared_strings, date_styles, timedelta_styles, info.epoch)
+        parser = XMLParser(target=target)
+        with archive.open(info.sheet_path) as source:
+            for _ in _feed(parser, source):
+                yield from target.rows
+                target.rows.clear()
+                if target.done:
+                    return
+        parser.close()
+        yield from target.rows
+
+
+# --- ридер calamine ----------------------------------------------------------
+
+
+def _calamine_value(value: object) -> object:
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer() and abs(value) < _CALAMINE_INT_LIMIT:
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, time())
+    return value
+
+
+def iter_calamine_rows(content: Union[bytes, str, os.PathLike]) -> Iterator[Tuple[object, ...]]:
+    if python_calamine is None:
+        raise RuntimeError("python-calamine is not installed")
+    with zipfile.ZipFile(_workbook_file(content)) as archive:
+        active_index = _WorkbookInfo(archive).active_index
+    if isinstance(content, bytes):
+        workbook = python_calamine.CalamineWorkbook.from_filelike(io.BytesIO(content))
+    else:
+        workbook = python_calamine.CalamineWorkbook.from_path(os.fspath(content))
+    try:
+        sheet = workbook.get_sheet_by_index(active_index)
+        first_row, first_col = sheet.start or (0, 0)
+        for _ in range(first_row):
+            yield ()
+        prefix = (None,) * first_col
+        for values in sheet.iter_rows():
+            yield prefix + tuple(_calamine_value(value) for value in values)
+    finally:
+        workbook.close()
+
+
+__all__ = [
+    "XLSX_READERS",
+    "calamine_available",
+    "iter_calamine_rows",
+    "iter_openpyxl_rows",
+    "iter_xml_rows",
+]
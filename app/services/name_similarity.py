@@ -0,0 +1,154 @@
+"""Векторная оценка похожести названий: TF-IDF по символьным триграммам."""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9а-яё]+")
+# строк запросов на одно матричное умножение: ограничивает плотные матрицы пачки
+SCORE_BATCH = 256
+
+_EMPTY_IDX = np.zeros(0, dtype=np.int64)
+_EMPTY_WEIGHTS = np.zeros(0, dtype=np.float32)
+
+
+def name_trigrams(name: Optional[str]) -> Counter:
+    """Символьные триграммы нормализованного названия; слова обрамлены пробелами."""
+    if not name:
+        return Counter()
+    text = " " + " ".join(TOKEN_RE.findall(name.lower())) + " "
+    return Counter(text[pos : pos + 3] for pos in range(len(text) - 2))
+
+
+class TrigramSimilarity:
+    """
+    Косинусная близость названий по TF-IDF символьных триграмм.
+
+    fit() строит словарь и IDF по названиям товаров и сохраняет их нормированные
+    векторы. score() оценивает пачку запросов сразу против всех их кандидатов:
+    векторы пачки раскладываются в плотные матрицы по общему подсловарю, и
+    близости считаются одним умножением матриц на SCORE_BATCH запросов.
+    """
+
+    def __init__(self) -> None:
+        self._vocab: Dict[str, int] = {}
+        self._idf: Optional[np.ndarray] = None
+        self._unknown_idf = 1.0
+        self._vectors: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def fit(self, documents: Iterable[Tuple[int, Optional[str]]]) -> "TrigramSimilarity":
+        grams_by_id: Dict[int, Counter] = {}
+        doc_freq: Counter = Counter()
+        for doc_id, name in documents:
+            grams = name_trigrams(name)
+            grams_by_id[doc_id] = grams
+            doc_freq.update(grams.keys())
+        total = len(grams_by_id)
+        self._vocab = {gram: idx for idx, gram in enumerate(doc_freq)}
+        self._idf = np.array(
+            [math.log((1 + total) / (1 + doc_freq[gram])) + 1.0 for gram in self._vocab],
+            dtype=np.float32,
+        )
+        # триграмма, которой нет в каталоге, встречается реже любой известной
+        self._unknown_idf = math.log(1 + total) + 1.0
+        self._vectors = {doc_id: self._vectorize(grams) for doc_id, grams in grams_by_id.items()}
+        return self
+
+    def _vectorize(self, grams: Counter) -> Tuple[np.ndarray, np.ndarray]:
+        if not grams or self._idf is None:
+            return _EMPTY_IDX, _EMPTY_WEIGHTS
+        indices: List[int] = []
+        weights: List[float] = []
+        norm = 0.0
+        for gram, count in grams.items():
+            idx = self._vocab.get(gram)
+            weight = (1.0 + math.log(count)) * (
+                self._unknown_idf if idx is None else float(self._idf[idx])
+            )
+            norm += weight * weight
+            if idx is not None:
+                indices.append(idx)
+                weights.append(weight)
+        if not indices:
+            return _EMPTY_IDX, _EMPTY_WEIGHTS
+        return (
+            np.array(indices, dtype=np.int64),
+            np.array(weights, dtype=np.float32) / np.float32(math.sqrt(norm)),
+        )
+
+    def score(
+        self, queries: Sequence[Optional[str]], candidates: Sequence[Sequence[int]]
+    ) -> List[np.ndarray]:
+        """Для каждого запроса — массив близостей к его кандидатам в исходном порядке."""
+        results: List[np.ndarray] = []
+        for start in range(0, len(queries), SCORE_BATCH):
+            results.extend(
+                self._score_batch(
+                    queries[start : start + SCORE_BATCH], candidates[start : start + SCORE_BATCH]
+                )
+            )
+        return results
+
+    def _score_batch(
+        self, queries: Sequence[Optional[str]], candidates: Sequence[Sequence[int]]
+    ) -> List[np.ndarray]:
+        query_vectors = [self._vectorize(name_trigrams(name)) for name in queries]
+        candidate_ids = list(dict.fromkeys(doc_id for ids in candidates for doc_id in ids))
+        candidate_pos = {doc_id: pos for pos, doc_id in enumerate(candidate_ids)}
+        candidate_vectors = [
+            self._vectors.get(doc_id, (_EMPTY_IDX, _EMPTY_WEIGHTS)) for doc_id in candidate_ids
+        ]
+
+        # общий подсловарь пачки: глобальные индексы триграмм -> столбцы плотных матриц
+        columns = np.unique(np.concatenate([_EMPTY_IDX, *(idx for idx, _ in query_vectors)]))
+        queries_matrix = _dense(query_vectors, columns)
+        candidates_matrix = _dense(candidate_vectors, columns)
+        similarity = queries_matrix @ candidates_matrix.T
+
+        return [
+            similarity[row, [candidate_pos[doc_id] for doc_id in ids]]
+            if ids
+            else np.zeros(0, dtype=np.float32)
+            for row, ids in enumerate(candidates)
+        ]
+
+
+def _dense(vectors: Sequence[Tuple[np.ndarray, np.ndarray]], columns: np.ndarray) -> np.ndarray:
+    matrix = np.zeros((len(vectors), len(columns)), dtype=np.float32)
+    if not len(vectors) or not len(columns):
+        return matrix
+    rows = np.concatenate(
+        [np.full(len(idx), row, dtype=np.int64) for row, (idx, _) in enumerate(vectors)]
+    )
+    indices = np.concatenate([idx for idx, _ in vectors])
+    weights = np.concatenate([weights for _, weights in vectors])
+    # триграммы кандидата, которых нет ни в одном запросе пачки, на косинус не влияют
+    positions = np.searchsorted(columns, indices)
+    known = positions < len(columns)
+    known[known] = columns[positions[known]] == indices[known]
+    matrix[rows[known], positions[known]] = weights[known]
+    return matrix
+
+
+def pick_best(
+    scores: np.ndarray, threshold: float, min_margin: float
+) -> Optional[Tuple[int, float]]:
+    """Индекс и оценка победителя, если он выше порога и заметно опережает второго."""
+    if not len(scores):
+        return None
+    best = int(np.argmax(scores))
+    best_score = float(scores[best])
+    if best_score < threshold:
+        return None
+    if len(scores) > 1:
+        runner_up = float(np.partition(scores, -2)[-2])
+        if best_score - runner_up < min_margin:
+            return None
+    return best, best_score
+
+
+__all__ = ["TrigramSimilarity", "name_trigrams", "pick_best"]
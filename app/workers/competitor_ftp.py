@@ -1,23 +1,38 @@
 from __future__ import annotations
 
+import io
 import logging
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import List, Optional
+from datetime import date
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
 
-from ftplib import FTP, FTP_TLS
+from ftplib import FTP, FTP_TLS, all_errors
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 
 from app.core.config import get_settings
+from app.models import CompetitorFtpFile
 from app.services.importers.competitor_ftp import (
     CompetitorFtpImportError,
     FtpFileInfo,
     FtpSourceConfig,
-    download_file,
+    XlsxSource,
+    content_digest,
+    download_into,
+    find_ingested_file,
     ingest_ftp_file,
+    is_listing_unchanged,
     list_matching_files,
+    mark_file_seen,
     parse_sources,
 )
+from app.services.importers.ftp_cache import CachedFile, FtpFileCache
 
 logger = logging.getLogger("app.workers.competitor_ftp")
 
@@ -25,6 +40,7 @@ logger = logging.getLogger("app.workers.competitor_ftp")
 @dataclass
 class ImportResult:
     processed_files: int = 0
+    skipped_files: int = 0
     rows_total: int = 0
     rows_valid: int = 0
     rows_invalid: int = 0
@@ -57,7 +73,169 @@ def _select_files(
     return files[:limit]
 
 
-def run_competitor_ftp_import(session: Optional[Session] = None) -> dict:
+class _FtpPool:
+    """
+    До `size` FTP-соединений, общих для потоков загрузки.
+
+    Сначала переиспользуется соединение, открытое вызывающим кодом, остальные
+    открываются по требованию. Соединение, упавшее посреди команды,
+    закрывается и больше не используется.
+    """
+
+    def __init__(self, settings, size: int, first: FTP) -> None:
+        self._settings = settings
+        self._idle: "queue.SimpleQueue[FTP]" = queue.SimpleQueue()
+        self._idle.put(first)
+        self._open: List[FTP] = [first]
+        self._lock = threading.Lock()
+        self.size = max(1, size)
+
+    @contextmanager
+    def connection(self) -> Iterator[FTP]:
+        try:
+            ftp = self._idle.get_nowait()
+        except queue.Empty:
+            ftp = _connect_ftp(self._settings)
+            with self._lock:
+                self._open.append(ftp)
+        try:
+            yield ftp
+        except Exception:
+            with self._lock:
+                self._open.remove(ftp)
+            _close_ftp(ftp)
+            raise
+        self._idle.put(ftp)
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._open = self._open, []
+        for ftp in connections:
+            _close_ftp(ftp)
+
+
+def _close_ftp(ftp: FTP) -> None:
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+
+def _list_source(pool: _FtpPool, source: FtpSourceConfig, limit: int) -> List[FtpFileInfo]:
+    with pool.connection() as ftp:
+        return list_matching_files(ftp, source, limit=max(0, limit))
+
+
+def _download(pool: _FtpPool, file_info: FtpFileInfo, settings) -> XlsxSource:
+    """
+    Скачивает файл в память или, с COMPETITOR_FTP_SPOOL_DOWNLOADS, во временный
+    файл и возвращает его путь (удаляет его вызывающий код).
+
+    Оборванная загрузка повторяется на другом соединении пула до
+    COMPETITOR_FTP_DOWNLOAD_RETRIES раз и докачивается через REST с уже
+    полученного байта. Повторяются и сбои переподключения (ошибки ftplib,
+    OSError, EOFError).
+    """
+    spool = settings.competitor_ftp_spool_downloads
+    sink: BinaryIO
+    if spool:
+        sink = tempfile.NamedTemporaryFile(
+            prefix=f"{file_info.source}-",
+            suffix=".xlsx",
+            dir=settings.competitor_ftp_spool_dir,
+            delete=False,
+        )
+    else:
+        sink = io.BytesIO()
+    retries = max(0, settings.competitor_ftp_download_retries)
+    try:
+        for attempt in range(retries + 1):
+            try:
+                with pool.connection() as ftp:
+                    received = download_into(ftp, file_info.path, sink)
+                if file_info.size is not None and received < file_info.size:
+                    raise CompetitorFtpImportError(
+                        f"incomplete download of {file_info.path}: "
+                        f"{received} of {file_info.size} bytes"
+                    )
+                break
+            except (CompetitorFtpImportError, *all_errors) as exc:
+                if attempt == retries:
+                    raise
+                logger.warning(
+                    "ftp download interrupted, resuming",
+                    extra={"file": file_info.path, "offset": sink.tell(), "error": str(exc)},
+                )
+        if spool:
+            sink.close()
+            return sink.name
+        return sink.getvalue()  # type: ignore[attr-defined]
+    except BaseException:
+        sink.close()
+        if spool:
+            os.unlink(sink.name)
+        raise
+
+
+def _open_cache(settings) -> Optional[FtpFileCache]:
+    if not settings.competitor_ftp_cache_dir:
+        return None
+    max_mb = settings.competitor_ftp_cache_max_mb
+    return FtpFileCache(
+        settings.competitor_ftp_cache_dir,
+        max_bytes=max_mb * 1024 * 1024 if max_mb and max_mb > 0 else None,
+        max_age_days=settings.competitor_ftp_cache_max_age_days or None,
+    )
+
+
+def _discard_downloads(
+    downloads: Dict[Future, Tuple[FtpFileInfo, int, Optional[CompetitorFtpFile], bool]],
+) -> None:
+    """
+    Отменяет загрузки, не дошедшие до записи, и удаляет их временные файлы.
+
+    Уже начатые загрузки дожидаются завершения, иначе их файл в спуле
+    останется после выхода; файлы из кэша не трогаются.
+    """
+    for future, (_, _, _, from_cache) in list(downloads.items()):
+        del downloads[future]
+        if future.cancel() or from_cache:
+            continue
+        try:
+            payload = future.result()
+        except Exception:
+            continue
+        if not isinstance(payload, bytes):
+            os.unlink(payload)
+
+
+def _completed(result: XlsxSource) -> Future:
+    future: Future = Future()
+    future.set_result(result)
+    return future
+
+
+def run_competitor_ftp_import(
+    session: Optional[Session] = None,
+    force: bool = False,
+    offline: bool = False,
+) -> dict:
+    """
+    Импортирует самые новые файлы каждого настроенного источника.
+
+    Уже загруженный для своего (source, file_date) файл пропускается без
+    скачивания, если не изменились имя, mtime и размер, и после скачивания,
+    если не изменился хэш содержимого. force=True загружает всё заново.
+
+    Листинг и загрузки идут в пуле из COMPETITOR_FTP_DOWNLOAD_WORKERS потоков,
+    у каждого своё FTP-соединение; текущий поток разбирает и записывает файл,
+    как только он скачан, так что запись одного файла идёт параллельно с
+    загрузкой остальных. Сессия используется только в текущем потоке.
+
+    С COMPETITOR_FTP_CACHE_DIR скачанные файлы хранятся в локальном кэше, и
+    найденный там файл из листинга повторно не скачивается. offline=True
+    загружает самые новые файлы из кэша по каждому источнику без FTP.
+    """
     settings = get_settings()
     if not settings.competitor_ftp_import_enabled:
         logger.info("ftp import skipped: feature disabled")
@@ -68,80 +246,227 @@ def run_competitor_ftp_import(session: Optional[Session] = None) -> dict:
         logger.warning("ftp import skipped: no sources configured")
         return {"skipped": True, "reason": "missing_sources"}
 
+    cache = _open_cache(settings)
+    if offline and cache is None:
+        raise CompetitorFtpImportError(
+            "COMPETITOR_FTP_CACHE_DIR is not set, nothing to re-ingest offline"
+        )
+
     owns_session = session is None
     if owns_session:
         engine = _get_engine()
         session = Session(engine)
 
     totals = ImportResult()
-    details: List[dict] = []
-    ftp: Optional[FTP] = None
+    entries: Dict[str, dict] = {
+        source.name: {"name": source.name, "directory": source.directory, "pattern": source.pattern}
+        for source in sources
+    }
+    pool: Optional[_FtpPool] = None
+
+    def record_error(entry: dict, slot: int, file_info: FtpFileInfo, exc: Exception) -> None:
+        if session:
+            session.rollback()
+        totals.errors += 1
+        if isinstance(exc, CompetitorFtpImportError):
+            entry["files"][slot] = {"file": file_info.filename, "error": str(exc)}
+            logger.warning(
+                "ftp import failed for file",
+                extra={"source": file_info.source, "file": file_info.filename, "error": str(exc)},
+            )
+        else:
+            entry["files"][slot] = {"file": file_info.filename, "error": "unexpected_error"}
+            logger.error(
+                "ftp import failed for file %s (%s)",
+                file_info.filename,
+                file_info.source,
+                exc_info=exc,
+            )
+
+    def process(
+        file_info: FtpFileInfo,
+        slot: int,
+        existing: Optional[CompetitorFtpFile],
+        payload: XlsxSource,
+        from_cache: bool,
+    ) -> None:
+        entry = entries[file_info.source]
+        payload_hash = content_digest(payload)
+        if not from_cache and cache is not None:
+            cache.put(file_info, payload, content_hash=payload_hash)
+        if existing is not None and existing.content_hash == payload_hash:
+            mark_file_seen(existing, file_info)
+            session.commit()
+            totals.skipped_files += 1
+            entry["files"][slot] = {"file": file_info.filename, "skipped": "same_content"}
+            return
+        stats = ingest_ftp_file(
+            session,
+            file_info,
+            payload,
+            reader=settings.competitor_ftp_xlsx_reader,
+            content_hash=payload_hash,
+            delta=settings.competitor_ftp_delta_ingest,
+            raw_archive=settings.competitor_ftp_raw_archive,
+        )
+        session.commit()
+        if from_cache:
+            stats["from_cache"] = True
+        entry["files"][slot] = stats
+        totals.processed_files += 1
+        totals.rows_total += stats["rows_total"]
+        totals.rows_valid += stats["rows_valid"]
+        totals.rows_invalid += stats["rows_invalid"]
 
     try:
-        ftp = _connect_ftp(settings)
-        for source in sources:
-            entry: dict = {"name": source.name, "directory": source.directory, "pattern": source.pattern}
-            try:
-                candidates = list_matching_files(ftp, source)
-            except CompetitorFtpImportError as exc:
-                entry["error"] = str(exc)
-                totals.errors += 1
-                details.append(entry)
-                logger.warning("ftp import failed to list files", extra={"source": source.name, "error": str(exc)})
-                continue
-
-            if not candidates:
-                entry["skipped"] = "no_files"
-                details.append(entry)
-                continue
-
-            selected = _select_files(candidates, settings.competitor_ftp_max_files_per_source)
-            entry["files"] = []
-            for file_info in selected:
-                try:
-                    payload = download_file(ftp, file_info.path)
-                    stats = ingest_ftp_file(session, file_info, payload)
-                    session.commit()
-                    entry["files"].append(stats)
-                    totals.processed_files += 1
-                    totals.rows_total += stats["rows_total"]
-                    totals.rows_valid += stats["rows_valid"]
-                    totals.rows_invalid += stats["rows_invalid"]
-                except CompetitorFtpImportError as exc:
-                    if session:
-                        session.rollback()
-                    totals.errors += 1
-                    entry["files"].append({"file": file_info.filename, "error": str(exc)})
-                    logger.warning(
-                        "ftp import failed for file",
-                        extra={"source": source.name, "file": file_info.filename, "error": str(exc)},
-                    )
-                except Exception:
-                    if session:
-                        session.rollback()
-                    totals.errors += 1
-                    entry["files"].append({"file": file_info.filename, "error": "unexpected_error"})
-                    logger.exception(
-                        "ftp import failed for file %s (%s)", file_info.filename, source.name
+        if offline:
+            _reingest_cached(cache, sources, settings, entries, process, record_error)
+        else:
+            pool = _FtpPool(
+                settings, settings.competitor_ftp_download_workers, _connect_ftp(settings)
+            )
+            with ThreadPoolExecutor(
+                max_workers=pool.size, thread_name_prefix="ftp-download"
+            ) as executor:
+                limit = settings.competitor_ftp_max_files_per_source
+                listings = {
+                    executor.submit(_list_source, pool, source, limit): source for source in sources
+                }
+                # future загрузки -> (file_info, позиция в entry["files"],
+                # уже загруженный файл, попадание в кэш)
+                downloads: Dict[
+                    Future, Tuple[FtpFileInfo, int, Optional[CompetitorFtpFile], bool]
+                ] = {}
+
+                def handle_listing(source: FtpSourceConfig, future: Future) -> None:
+                    entry = entries[source.name]
+                    try:
+                        candidates = future.result()
+                    except Exception as exc:
+                        entry["error"] = (
+                            str(exc)
+                            if isinstance(exc, CompetitorFtpImportError)
+                            else "unexpected_error"
+                        )
+                        totals.errors += 1
+                        logger.warning(
+                            "ftp import failed to list files",
+                            extra={"source": source.name, "error": str(exc)},
+                        )
+                        return
+
+                    if not candidates:
+                        entry["skipped"] = "no_files"
+                        return
+
+                    selected = _select_files(
+                        candidates, settings.competitor_ftp_max_files_per_source
                     )
+                    entry["files"] = [None] * len(selected)
+                    for slot, file_info in enumerate(selected):
+                        try:
+                            existing = None if force else find_ingested_file(session, file_info)
+                        except Exception as exc:
+                            record_error(entry, slot, file_info, exc)
+                            continue
+                        if is_listing_unchanged(existing, file_info):
+                            totals.skipped_files += 1
+                            entry["files"][slot] = {
+                                "file": file_info.filename,
+                                "skipped": "unchanged",
+                            }
+                            continue
+                        try:
+                            cached = cache.get(file_info) if cache is not None else None
+                        except Exception as exc:
+                            record_error(entry, slot, file_info, exc)
+                            continue
+                        if cached is not None:
+                            downloads[_completed(cached)] = (file_info, slot, existing, True)
+                            continue
+                        downloads[executor.submit(_download, pool, file_info, settings)] = (
+                            file_info,
+                            slot,
+                            existing,
+                            False,
+                        )
 
-            details.append(entry)
+                def handle_download(future: Future) -> None:
+                    file_info, slot, existing, from_cache = downloads.pop(future)
+                    payload: Optional[XlsxSource] = None
+                    try:
+                        payload = future.result()
+                        process(file_info, slot, existing, payload, from_cache)
+                    except Exception as exc:
+                        record_error(entries[file_info.source], slot, file_info, exc)
+                    finally:
+                        if (
+                            payload is not None
+                            and not from_cache
+                            and not isinstance(payload, bytes)
+                        ):
+                            os.unlink(payload)
+
+                # листинги и загрузки ждём вместе: файл записывается, как только
+                # скачан, не дожидаясь листинга остальных источников; порядок файлов
+                # источника в ответе задаёт их позиция в entry["files"]
+                try:
+                    while listings or downloads:
+                        done, _ = wait([*listings, *downloads], return_when=FIRST_COMPLETED)
+                        for future in done:
+                            if future in listings:
+                                handle_listing(listings.pop(future), future)
+                            else:
+                                handle_download(future)
+                finally:
+                    for future in listings:
+                        future.cancel()
+                    _discard_downloads(downloads)
+        if cache is not None:
+            cache.evict()
     finally:
-        if ftp is not None:
-            try:
-                ftp.quit()
-            except Exception:
-                ftp.close()
+        if pool is not None:
+            pool.close()
         if owns_session and session is not None:
             session.close()
 
     return {
         "skipped": False,
+        "offline": offline,
         "processed_files": totals.processed_files,
+        "skipped_files": totals.skipped_files,
         "rows_total": totals.rows_total,
         "rows_valid": totals.rows_valid,
         "rows_invalid": totals.rows_invalid,
         "errors": totals.errors,
-        "sources": details,
+        "sources": list(entries.values()),
     }
 
+
+def _reingest_cached(
+    cache: FtpFileCache,
+    sources: List[FtpSourceConfig],
+    settings,
+    entries: Dict[str, dict],
+    process: Callable[..., None],
+    record_error: Callable[..., None],
+) -> None:
+    """Офлайн-режим: новейшая версия из кэша для самых новых дат, загружается всегда."""
+    cached_files = cache.entries([source.name for source in sources])
+    for source in sources:
+        entry = entries[source.name]
+        newest_by_date: Dict[date, CachedFile] = {}
+        for cached in cached_files:
+            if cached.info.source == source.name:
+                newest_by_date.setdefault(cached.info.file_date, cached)
+        if not newest_by_date:
+            entry["skipped"] = "no_cached_files"
+            continue
+        limit = max(0, settings.competitor_ftp_max_files_per_source)
+        selected = list(newest_by_date.values())[:limit]
+        entry["files"] = [None] * len(selected)
+        for slot, cached in enumerate(selected):
+            try:
+                process(cached.info, slot, None, cached.path, True)
+            except Exception as exc:
+                record_error(entry, slot, cached.info, exc)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.models import CompetitorFtpRecord
+from app.services.competitor_matching import match_competitor_ftp_records, merge_match_results
+
+logger = logging.getLogger("app.workers.competitor_matching")
+
+
+def _sources_in_window(session: Session, days_back: int) -> List[str]:
+    since_date = date.today() - timedelta(days=days_back)
+    stmt = (
+        select(CompetitorFtpRecord.source)
+        .where(CompetitorFtpRecord.file_date >= since_date)
+        .distinct()
+    )
+    return sorted(session.execute(stmt).scalars())
+
+
+def _match_shard(database_url: str, source: str, options: dict) -> dict:
+    """Выполняется в дочернем процессе: свой engine, свои lookup-структуры, один источник."""
+    engine = create_engine(database_url)
+    try:
+        with Session(engine) as session:
+            return match_competitor_ftp_records(session, sources=[source], **options)
+    finally:
+        engine.dispose()
+
+
+def run_parallel_competitor_matching(
+    database_url: str,
+    workers: int,
+    sources: Optional[Sequence[str]] = None,
+    days_back: int = 3,
+    max_samples: int = 20,
+    **options,
+) -> dict:
+    """
+    Матчинг FTP-записей, шардированный по source между процессами ProcessPoolExecutor.
+
+    Каждый процесс строит индексы товаров/оверрайдов один раз и пишет только строки
+    «своего» конкурента, поэтому шарды не пересекаются по ключам competitor_price/productmatch
+    и водяным знакам. Параллелизм ограничен числом источников.
+    """
+    if sources is None:
+        engine = create_engine(database_url)
+        try:
+            with Session(engine) as session:
+                sources = _sources_in_window(session, days_back)
+        finally:
+            engine.dispose()
+    if not sources:
+        return {"skipped": True, "reason": "no_records"}
+
+    shard_options = {"days_back": days_back, "max_samples": max_samples, **options}
+    results: List[dict] = []
+    errors: List[dict] = []
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(sources)))) as pool:
+        futures = {
+            pool.submit(_match_shard, database_url, source, shard_options): source
+            for source in sources
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                logger.exception("competitor matching shard failed (%s)", source)
+                errors.append({"source": source, "error": str(exc)})
+                continue
+            logger.info(
+                "competitor matching shard done",
+                extra={"source": source, "processed": result.get("processed", 0)},
+            )
+            results.append(result)
+
+    merged = merge_match_results(results, max_samples=max_samples)
+    merged["workers"] = workers
+    merged["shards"] = len(sources)
+    if errors:
+        merged["errors"] = errors
+    return merged
@@ -0,0 +1,301 @@
+"""
+Бенчмарк матчинга FTP-цен на синтетических каталогах (SQLite).
+
+Для каждого размера прайса генерирует каталог товаров и FTP-записи нескольких
+источников (попадания по SKU, записи только с названием, мусор) и прогоняет
+match_competitor_ftp_records. Каждый размер считается в отдельном процессе,
+чтобы пиковый RSS не накапливался между прогонами.
+
+    python -m scripts.benchmark_competitor_matching --sizes 10000,100000,1000000
+    python -m scripts.benchmark_competitor_matching --sizes 100000 --min-throughput 20000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from datetime import time as dt_time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models import Base, CompetitorFtpFile, CompetitorFtpRecord, Product
+from app.services.competitor_matching import match_competitor_ftp_records
+
+INSERT_CHUNK = 10_000
+
+PARTS = ["Дисплей", "Аккумулятор", "Шлейф", "Задняя крышка", "Камера основная", "Динамик"]
+COLORS = ["черный", "белый", "синий", "красный", "золото"]
+QUALITIES = [("orig", "ORIG"), ("copy", "COPY"), ("oled", "OLED"), ("incell", "INCELL")]
+
+
+def _model_catalog() -> List[Tuple[str, str]]:
+    models: List[Tuple[str, str]] = []
+    for number in range(6, 16):
+        for suffix in ("", " Plus", " Pro", " Pro Max"):
+            models.append(("Apple", f"iPhone {number}{suffix}"))
+    for number in range(10, 74):
+        models.append(("Samsung", f"Galaxy A{number}"))
+    for number in range(20, 25):
+        for suffix in ("", "+", " Ultra"):
+            models.append(("Samsung", f"Galaxy S{number}{suffix}"))
+    for number in range(7, 14):
+        for suffix in ("", " Pro", " Pro+"):
+            models.append(("Xiaomi", f"Redmi Note {number}{suffix}"))
+    for number in (20, 30, 40, 50, 60):
+        for suffix in ("", " Pro", " Lite"):
+            models.append(("Huawei", f"P{number}{suffix}"))
+    return models
+
+
+MODELS = _model_catalog()
+
+
+def _product_rows(count: int, rng: random.Random) -> Iterator[dict]:
+    for idx in range(count):
+        brand, model = rng.choice(MODELS)
+        part = rng.choice(PARTS)
+        color = rng.choice(COLORS)
+        quality, _ = rng.choice(QUALITIES)
+        yield {
+            "sku": f"LCD-{idx:07d}",
+            "name": f"{part} для {brand} {model} ({color})",
+            "brand": brand,
+            "subject": part,
+            "quality": quality,
+            "is_active": True,
+        }
+
+
+def _record_rows(
+    count: int,
+    products: int,
+    sources: List[str],
+    file_ids: dict[str, int],
+    observed_at: datetime,
+    rng: random.Random,
+) -> Iterator[dict]:
+    for idx in range(count):
+        source = sources[idx % len(sources)]
+        brand, model = rng.choice(MODELS)
+        part = rng.choice(PARTS)
+        color = rng.choice(COLORS)
+        _, quality_tag = rng.choice(QUALITIES)
+        kind = rng.random()
+        if kind < 0.6:
+            # артикул каталога в другом регистре и с пробелами — нормализуется в SKU
+            sku = f" lcd-{rng.randrange(products):07d} "
+        elif kind < 0.9:
+            sku = f"{source.upper()}-{idx}"
+        else:
+            sku = ""
+            part, brand, model = "Чехол силиконовый", "", "универсальный"
+        name = f"{part} для {brand} {model} в сборе {color.capitalize()} - {quality_tag}"
+        name = name.replace("  ", " ")
+        price = round(rng.uniform(100, 15000), 2)
+        yield {
+            "raw_row_id": idx + 1,
+            "file_id": file_ids[source],
+            "source": source,
+            "file_date": observed_at.date(),
+            "group_name": part,
+            "sku": sku,
+            "name": name,
+            "price_opt": price,
+            "price_roz": round(price * 1.2, 2),
+            "link": f"https://{source}.example/item/{idx}",
+            "in_stock": rng.random() > 0.1,
+            "amount": rng.randint(0, 50),
+            "observed_at": observed_at,
+        }
+
+
+def _insert_chunked(session: Session, table, rows: Iterator[dict]) -> None:
+    chunk: List[dict] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            session.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        session.execute(insert(table), chunk)
+
+
+def _populate(engine, records: int, products: int, sources: List[str], seed: int) -> None:
+    rng = random.Random(seed)
+    observed_at = datetime.combine(date.today(), dt_time(9, 0), tzinfo=timezone.utc)
+    with Session(engine) as session:
+        _insert_chunked(session, Product.__table__, _product_rows(products, rng))
+        file_ids: dict[str, int] = {}
+        for source in sources:
+            ftp_file = CompetitorFtpFile(
+                source=source,
+                filename=f"{source}.xlsx",
+                file_path=f"/{source}/{source}.xlsx",
+                file_date=observed_at.date(),
+                rows_total=records // len(sources),
+                rows_valid=records // len(sources),
+            )
+            session.add(ftp_file)
+            session.flush()
+            file_ids[source] = ftp_file.id
+        # сырые строки не генерируются: SQLite без PRAGMA foreign_keys не проверяет raw_row_id
+        _insert_chunked(
+            session,
+            CompetitorFtpRecord.__table__,
+            _record_rows(records, products, sources, file_ids, observed_at, rng),
+        )
+        session.commit()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def run(
+    records: int,
+    products_ratio: float = 0.2,
+    sources: int = 3,
+    seed: int = 42,
+    db_dir: Optional[str] = None,
+    trace_memory: bool = False,
+    profile: bool = False,
+    **options,
+) -> dict:
+    products = max(100, int(records * products_ratio))
+    source_names = [f"source{idx}" for idx in range(sources)]
+    with tempfile.TemporaryDirectory(dir=db_dir) as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(engine)
+
+        started = time.perf_counter()
+        _populate(engine, records, products, source_names, seed)
+        populate_sec = time.perf_counter() - started
+        rss_before = _peak_rss_mb()
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with Session(engine) as session:
+            result = match_competitor_ftp_records(
+                session, days_back=1, full=True, profile=profile, **options
+            )
+        match_sec = time.perf_counter() - started
+        traced_peak = None
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            traced_peak = round(peak / (1024 * 1024), 1)
+        engine.dispose()
+
+    report = {
+        "records": records,
+        "products": products,
+        "sources": sources,
+        "populate_sec": round(populate_sec, 2),
+        "match_sec": round(match_sec, 2),
+        "records_per_sec": round(records / match_sec) if match_sec else None,
+        "peak_rss_mb_before_match": rss_before,
+        "peak_rss_mb": _peak_rss_mb(),
+        "traced_peak_mb": traced_peak,
+        **{
+            key: result.get(key)
+            for key in (
+                "matched",
+                "prices_created",
+                "prices_updated",
+                "matches_created",
+                "unmatched",
+                "ambiguous",
+                "fuzzy_matched",
+                "sql_matched",
+            )
+        },
+    }
+    if profile:
+        report["profile"] = result.get("profile")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000",
+        help="размеры прайса через запятую, например 10000,100000,1000000",
+    )
+    parser.add_argument(
+        "--products-ratio", type=float, default=0.2, help="товаров каталога на одну FTP-запись"
+    )
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-dir", default=None, help="каталог для временных SQLite-баз")
+    parser.add_argument("--read-chunk-size", type=int, default=5000)
+    parser.add_argument("--write-chunk-size", type=int, default=1000)
+    parser.add_argument(
+        "--fuzzy", action="store_true", help="включить ранжирование неоднозначных строк"
+    )
+    parser.add_argument(
+        "--no-feature-cache", action="store_true", help="кэш признаков названий только в памяти"
+    )
+    parser.add_argument(
+        "--no-sql-sku-stage", action="store_true", help="матчить SKU в Python, без SQL-стадии"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="пик аллокаций Python через tracemalloc (медленнее)",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="добавить разбивку по стадиям матчинга"
+    )
+    parser.add_argument(
+        "--min-throughput",
+        type=float,
+        default=None,
+        help="завершиться с кодом 1, если records_per_sec любого размера ниже порога",
+    )
+    args = parser.parse_args()
+
+    options = {
+        "products_ratio": args.products_ratio,
+        "sources": args.sources,
+        "seed": args.seed,
+        "db_dir": args.db_dir,
+        "trace_memory": args.trace_memory,
+        "profile": args.profile,
+        "read_chunk_size": args.read_chunk_size,
+        "write_chunk_size": args.write_chunk_size,
+        "fuzzy_threshold": 0.4 if args.fuzzy else None,
+        "persistent_feature_cache": not args.no_feature_cache,
+        "sql_sku_stage": not args.no_sql_sku_stage,
+    }
+    failed = False
+    for size in (int(item) for item in args.sizes.split(",") if item.strip()):
+        # отдельный процесс на размер: ru_maxrss монотонен в пределах процесса
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            report = pool.submit(run, size, **options).result()
+        print(json.dumps(report, ensure_ascii=False))
+        if (
+            args.min_throughput is not None
+            and (report["records_per_sec"] or 0) < args.min_throughput
+        ):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Бенчмарк fallback-матчинга по бренду/модели: индекс BrandModelIndex против линейного прохода."""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+from app.services.competitor_matching import BrandModelIndex
+
+SERIES = ["", "galaxy", "note", "redmi", "mi", "pad"]
+SUFFIXES = ["", "pro", "plus", "max", "promax", "ultra", "lite", "mini", "fe", "5g"]
+
+
+@dataclass
+class _Product:
+    id: int
+
+
+def _random_model(rng: random.Random) -> str:
+    series = rng.choice(SERIES)
+    letter = rng.choice(["", "a", "s", "m", "x", "y", "c"])
+    number = str(rng.randint(1, 99))
+    return f"{series}{letter}{number}{rng.choice(SUFFIXES)}"
+
+
+def _build_catalog(size: int, brands: int, seed: int) -> List[Tuple[str, str, _Product]]:
+    rng = random.Random(seed)
+    return [
+        (f"brand{rng.randrange(brands)}", _random_model(rng), _Product(id=idx))
+        for idx in range(size)
+    ]
+
+
+def _linear_candidates(
+    entries: Sequence[Tuple[str, _Product]], models: Sequence[str]
+) -> List[_Product]:
+    matched: List[_Product] = []
+    seen_ids = set()
+    for cand_model, cand_product in entries:
+        if any(
+            cand_model == model or cand_model in model or model in cand_model for model in models
+        ):
+            if cand_product.id not in seen_ids:
+                matched.append(cand_product)
+                seen_ids.add(cand_product.id)
+    return matched
+
+
+def run(products: int, records: int, brands: int, seed: int) -> dict:
+    catalog = _build_catalog(products, brands, seed)
+    by_brand: dict[str, List[Tuple[str, _Product]]] = {}
+    index = BrandModelIndex()
+    started = time.perf_counter()
+    for brand, model, product in catalog:
+        index.add(brand, model, product)
+        by_brand.setdefault(brand, []).append((model, product))
+    build_sec = time.perf_counter() - started
+
+    rng = random.Random(seed + 1)
+    queries = [(f"brand{rng.randrange(brands)}", [_random_model(rng)]) for _ in range(records)]
+
+    started = time.perf_counter()
+    linear = [_linear_candidates(by_brand.get(brand, []), models) for brand, models in queries]
+    linear_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [index.candidates(brand, models) for brand, models in queries]
+    index_sec = time.perf_counter() - started
+
+    return {
+        "products": products,
+        "records": records,
+        "brands": brands,
+        "index_build_sec": round(build_sec, 4),
+        "linear_sec": round(linear_sec, 4),
+        "index_sec": round(index_sec, 4),
+        "speedup": round(linear_sec / index_sec, 1) if index_sec else None,
+        "results_equal": linear == indexed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--brands", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    result = run(args.products, args.records, args.brands, args.seed)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Микробенчмарк разбора названий: _extract_name_features с общим lower() и одной
+токенизацией против реализации до рефакторинга (её копия — _legacy_* ниже), где
+каждый признак заново приводит регистр. Ключевые слова качества, типа дисплея и
+рамки в обоих вариантах ищутся отдельными проверками подстрок, поэтому выигрыш
+небольшой; основное ускорение матчинга даёт NameFeatureCache. Ускорение
+печатается в поле speedup.
+
+Запуск из корня репозитория: PYTHONPATH=. python scripts/benchmark_name_features.py
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.services.competitor_matching import (
+    APPLE_A_CODE_RE,
+    APPLE_MODEL_SKIP_TOKENS,
+    BRAND_SYNONYMS,
+    QUALITY_MAP,
+    STOP_TOKENS,
+    NameFeatures,
+    _extract_name_features,
+    _extract_variant,
+    _normalize_model,
+)
+
+DEFAULT_SAMPLE = Path(__file__).resolve().parent.parent / "samples" / "moba_catalog.html"
+NAME_RE = re.compile(r"Дисплей[^<\"]{5,200}")
+
+
+# реализация до общего lower() и одной токенизации, скопирована без изменений
+
+
+def _legacy_brand_model(name: Optional[str]) -> Tuple[Optional[str], List[str]]:
+    if not name:
+        return None, []
+    lower = name.lower()
+    if "дисплей" not in lower:
+        return None, []
+    tokens = re.findall(r"[A-Za-z0-9а-яё]+", lower)
+    # попытка найти бренд после "для"
+    brand = None
+    start_idx = None
+    for idx, tok in enumerate(tokens):
+        if tok == "для" and idx + 1 < len(tokens):
+            brand_token = tokens[idx + 1]
+            brand = BRAND_SYNONYMS.get(brand_token, brand_token)
+            start_idx = idx + 2
+            break
+    # fallback: взять первый встретившийся бренд/синоним, даже без "для"
+    if brand is None:
+        for idx, tok in enumerate(tokens):
+            candidate = BRAND_SYNONYMS.get(tok)
+            if candidate:
+                brand = candidate
+                start_idx = idx + 1
+                break
+    if brand is None or start_idx is None:
+        return None, []
+
+    models: List[str] = []
+    current: List[str] = []
+
+    def flush_current() -> None:
+        nonlocal current
+        if current:
+            norm = _normalize_model(" ".join(current))
+            if norm:
+                models.append(norm)
+            current = []
+
+    for tok in tokens[start_idx:]:
+        # новый кандидат модели при повторном упоминании бренда
+        if BRAND_SYNONYMS.get(tok) == brand:
+            flush_current()
+            continue
+        if brand == "apple":
+            if tok in APPLE_MODEL_SKIP_TOKENS:
+                continue
+            if APPLE_A_CODE_RE.fullmatch(tok):
+                continue
+        if not tok or tok in STOP_TOKENS:
+            break
+        current.append(tok)
+    flush_current()
+    return brand, models
+
+
+def _legacy_quality(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    lower = name.lower()
+    for token, quality in QUALITY_MAP.items():
+        if token in lower:
+            return quality
+    return None
+
+
+def _legacy_display_type(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    lower = name.lower()
+    if "hard oled" in lower or "hard oled" in lower.replace("-", " "):
+        return "hard oled"
+    if "soft oled" in lower or "soft oled" in lower.replace("-", " "):
+        return "soft oled"
+    if "oled" in lower:
+        return "oled"
+    if "in-cell" in lower or "incell" in lower:
+        return "in-cell"
+    if "tft" in lower or "lcd" in lower:
+        return "lcd"
+    return None
+
+
+def _legacy_in_frame(name: Optional[str]) -> Optional[bool]:
+    if not name:
+        return None
+    lower = name.lower()
+    if "в рамке" in lower:
+        return True
+    if "без рамки" in lower or "no frame" in lower:
+        return False
+    return None
+
+
+def _legacy_features(name: Optional[str]) -> NameFeatures:
+    if not name:
+        return NameFeatures()
+    brand, models = _legacy_brand_model(name)
+    variant = None
+    if brand and models:
+        _, variant = _extract_variant(re.findall(r"[A-Za-z0-9]+", name.lower()))
+    return NameFeatures(
+        brand=brand,
+        models=tuple(models),
+        quality=_legacy_quality(name),
+        display_type=_legacy_display_type(name),
+        in_frame=_legacy_in_frame(name),
+        variant=variant,
+    )
+
+
+def load_names(path: Path) -> List[str]:
+    text = path.read_text(encoding="utf-8")
+    return sorted(set(match.strip() for match in NAME_RE.findall(text)))
+
+
+def run(names: List[str], repeat: int) -> dict:
+    workload = names * repeat
+
+    started = time.perf_counter()
+    legacy = [_legacy_features(name) for name in workload]
+    legacy_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    shared = [_extract_name_features(name) for name in workload]
+    shared_sec = time.perf_counter() - started
+
+    return {
+        "unique_names": len(names),
+        "calls": len(workload),
+        "legacy_sec": round(legacy_sec, 4),
+        "shared_sec": round(shared_sec, 4),
+        "speedup": round(legacy_sec / shared_sec, 2) if shared_sec else None,
+        "results_equal": legacy == shared,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sample", type=Path, default=DEFAULT_SAMPLE, help="HTML/текст с названиями"
+    )
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    names = load_names(args.sample)
+    if not names:
+        raise SystemExit(f"no names found in {args.sample}")
+    for key, value in run(names, args.repeat).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 """CLI для импорта датированных прайсов конкурентов по FTP."""
 
+import argparse
 import json
 import logging
 import sys
@@ -8,8 +9,24 @@ from app.workers.competitor_ftp import run_competitor_ftp_import
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--from-cache",
+        action="store_true",
+        help=(
+            "переимпортировать свежие файлы из локального кэша "
+            "(COMPETITOR_FTP_CACHE_DIR), без FTP"
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="переимпортировать файлы, даже если они не изменились с прошлого запуска",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-    result = run_competitor_ftp_import()
+    result = run_competitor_ftp_import(force=args.force, offline=args.from_cache)
     print(json.dumps(result, ensure_ascii=False))
     exit_code = 0 if (result.get("errors") or 0) == 0 else 1
     sys.exit(exit_code)
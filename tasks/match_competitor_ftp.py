@@ -1,5 +1,6 @@
 """CLI для матчинга FTP-цен конкурентов с товарами TopControl."""
 
+import argparse
 import json
 import logging
 import sys
@@ -9,17 +10,57 @@ from sqlalchemy.orm import Session
 
 from app.core.config import get_settings
 from app.services.competitor_matching import match_competitor_ftp_records
+from app.workers.competitor_matching import run_parallel_competitor_matching
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="пересмотреть все записи за окно, игнорируя водяной знак инкрементального матчинга",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="число процессов (шард = источник); по умолчанию COMPETITOR_MATCH_WORKERS",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="добавить в ответ время и число вызовов по стадиям матчинга",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     settings = get_settings()
-    engine = create_engine(settings.database_url)
     subject_whitelist = None
     if settings.match_subject_whitelist:
-        subject_whitelist = [s.strip() for s in settings.match_subject_whitelist.split(",") if s.strip()]
-    with Session(engine) as session:
-        result = match_competitor_ftp_records(session, subject_whitelist=subject_whitelist)
+        subject_whitelist = [
+            s.strip() for s in settings.match_subject_whitelist.split(",") if s.strip()
+        ]
+    options = {
+        "subject_whitelist": subject_whitelist,
+        "write_chunk_size": settings.competitor_match_write_chunk_size,
+        "full": args.full,
+        "profile": args.profile,
+        "sql_sku_stage": settings.competitor_match_sql_sku_stage,
+        "persistent_feature_cache": settings.competitor_match_feature_cache_enabled,
+        "read_chunk_size": settings.competitor_match_read_chunk_size,
+        "fuzzy_threshold": (
+            settings.competitor_match_fuzzy_threshold
+            if settings.competitor_match_fuzzy_enabled
+            else None
+        ),
+    }
+    workers = args.workers if args.workers is not None else settings.competitor_match_workers
+    if workers > 1:
+        result = run_parallel_competitor_matching(settings.database_url, workers, **options)
+    else:
+        engine = create_engine(settings.database_url)
+        with Session(engine) as session:
+            result = match_competitor_ftp_records(session, **options)
     print(json.dumps(result, ensure_ascii=False, indent=2))
     exit_code = 0 if not result.get("errors") else 1
     sys.exit(exit_code)
@@ -0,0 +1,48 @@
+import os
+import time
+from datetime import date, datetime, timezone
+
+from app.services.importers.competitor_ftp import FtpFileInfo
+from app.services.importers.ftp_cache import FtpFileCache
+
+
+def _info(day: int, size: int = 10, mtime: datetime | None = None) -> FtpFileInfo:
+    return FtpFileInfo(
+        source="moba",
+        directory="/moba",
+        filename=f"moba-2025.11.{day:02d}.xlsx",
+        path=f"/moba/moba-2025.11.{day:02d}.xlsx",
+        file_date=date(2025, 11, day),
+        mtime=mtime or datetime(2025, 11, day, 0, 15, tzinfo=timezone.utc),
+        size=size,
+    )
+
+
+def test_cache_is_keyed_by_listing_metadata(tmp_path):
+    cache = FtpFileCache(tmp_path)
+    assert cache.put(_info(30), b"x" * 10, content_hash="abc") is not None
+    assert cache.get(_info(30)).read_bytes() == b"x" * 10
+    assert cache.get(_info(30, size=11)) is None
+    assert cache.get(_info(30, mtime=datetime(2025, 11, 30, 1, tzinfo=timezone.utc))) is None
+
+    unkeyed = _info(29)
+    unkeyed.size = None
+    assert cache.put(unkeyed, b"y") is None
+
+    [entry] = cache.entries()
+    assert entry.info == _info(30)
+    assert entry.content_hash == "abc"
+
+
+def test_eviction_by_age_then_size(tmp_path):
+    cache = FtpFileCache(tmp_path, max_bytes=25, max_age_days=1)
+    old = cache.put(_info(1), b"a" * 10)
+    lru = cache.put(_info(2), b"b" * 10)
+    cache.put(_info(3), b"c" * 10)
+    cache.put(_info(4), b"d" * 10)
+    now = time.time()
+    os.utime(old, (now - 3 * 86400, now - 3 * 86400))
+    os.utime(lru, (now - 3600, now - 3600))
+
+    assert cache.evict() == 2
+    assert [entry.info.file_date.day for entry in cache.entries()] == [4, 3]
@@ -1,9 +1,41 @@
-from datetime import date
+import types
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from ftplib import error_perm, error_temp
 from io import BytesIO
 
+import pytest
 from openpyxl import Workbook
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+from openpyxl.styles import Font
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
 
-from app.services.importers.competitor_ftp import parse_ftp_xlsx
+from app.models import (
+    Base,
+    CompetitorFtpFile,
+    CompetitorFtpRawRow,
+    CompetitorFtpRecord,
+    CompetitorPrice,
+    Product,
+)
+from app.services.competitor_matching import match_competitor_ftp_records
+from app.services.importers.competitor_ftp import (
+    CompetitorFtpImportError,
+    FtpFileInfo,
+    _copy_value,
+    _diff_value,
+    ingest_ftp_file,
+    iter_ftp_xlsx,
+    iter_raw_archive,
+    list_matching_files,
+    parse_ftp_xlsx,
+    parse_sources,
+)
+from app.services.importers.xlsx_readers import calamine_available
+
+HEADER = ["group", "sku", "name", "price_opt", "price_roz", "link", "stock", "amount", "time"]
 
 
 def _build_workbook(rows):
@@ -16,6 +48,27 @@ def _build_workbook(rows):
     return buffer.getvalue()
 
 
+def _file_info() -> FtpFileInfo:
+    return FtpFileInfo(
+        source="moba",
+        directory="/",
+        filename="moba_2025.11.30.xlsx",
+        path="/moba_2025.11.30.xlsx",
+        file_date=date(2025, 11, 30),
+        mtime=None,
+    )
+
+
+def _ingest_session() -> Session:
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    return Session(engine)
+
+
+def _price_row(sku, price, link="https://x"):
+    return ["A", sku, f"Name {sku}", price, price + 2, link, True, 5, "2025.11.30 00:10:11"]
+
+
 def test_parse_valid_rows_with_amount_and_stock():
     content = _build_workbook(
         [
@@ -46,3 +99,406 @@ def test_date_mismatch_flag():
     assert rows[0].is_valid is True
     assert mismatch is True
 
+
+def test_iter_rows_is_lazy_and_validates_header_eagerly():
+    content = _build_workbook(
+        [HEADER, ["A", "SKU1", "Name1", 10, 12, "https://x", True, 5, "2025.11.30 00:10:11"]]
+    )
+    rows = iter_ftp_xlsx(content, source="moba")
+    assert isinstance(rows, types.GeneratorType)
+    assert [row.sku for row in rows] == ["SKU1"]
+
+    broken = _build_workbook([["group", "sku"], ["A", "SKU1"]])
+    with pytest.raises(CompetitorFtpImportError):
+        iter_ftp_xlsx(broken, source="moba")
+
+
+def test_ingest_consumes_rows_in_chunks():
+    data = [
+        ["A", f"SKU{idx}", f"Name{idx}", 10, 12, "https://x", True, idx, "2025.11.30 00:10:11"]
+        for idx in range(5)
+    ]
+    data[2][1] = None
+    content = _build_workbook([HEADER, *data])
+    info = _file_info()
+    with _ingest_session() as session:
+        stats = ingest_ftp_file(session, info, content, chunk_size=2)
+        session.commit()
+
+        assert stats["rows_total"] == 5
+        assert stats["rows_valid"] == 4
+        assert stats["rows_invalid"] == 1
+        assert stats["date_mismatch"] is False
+        raws = session.query(CompetitorFtpRawRow).order_by(CompetitorFtpRawRow.row_index).all()
+        assert [raw.row_index for raw in raws] == [2, 3, 4, 5, 6]
+        records = session.query(CompetitorFtpRecord).order_by(CompetitorFtpRecord.id).all()
+        assert [record.raw_row.row_index for record in records] == [2, 3, 5, 6]
+        assert [record.in_stock for record in records] == [False, True, True, True]
+
+
+def test_bulk_ingest_replaces_rows_and_fills_sku_norm():
+    info = _file_info()
+    first = _build_workbook(
+        [HEADER, ["A", " lcd–01 ", "Name", 10, 12, "https://x", True, 5, "2025.11.30 00:10:11"]]
+    )
+    second = _build_workbook(
+        [
+            HEADER,
+            ["A", "SKU-2", "Name2", 10, 12, "https://y", True, 1, "2025.11.30 00:10:11"],
+            ["A", None, "Broken", 10, 12, "https://z", True, 1, "2025.11.30 00:10:11"],
+        ]
+    )
+    with _ingest_session() as session:
+        ingest_ftp_file(session, info, first)
+        session.commit()
+        assert session.query(CompetitorFtpRecord.sku_norm).scalar() == "lcd-01"
+
+        stats = ingest_ftp_file(session, info, second)
+        session.commit()
+        assert (stats["rows_total"], stats["rows_valid"], stats["rows_invalid"]) == (2, 1, 1)
+        records = session.query(CompetitorFtpRecord).all()
+        assert [(record.sku_norm, record.raw_row.row_index) for record in records] == [("sku-2", 2)]
+        assert session.query(CompetitorFtpRawRow).count() == 2
+
+
+def test_delta_ingest_touches_only_changed_rows():
+    info = _file_info()
+    first = _build_workbook(
+        [
+            HEADER,
+            _price_row("KEEP", 10),
+            _price_row("MOVE", 11),
+            _price_row("PRICE", 12),
+            _price_row("GONE", 13),
+            _price_row(None, 1),
+        ]
+    )
+    second = _build_workbook(
+        [
+            HEADER,
+            _price_row("KEEP", 10),
+            _price_row("PRICE", 15),
+            _price_row("NEW", 14),
+            _price_row("MOVE", 11),
+            _price_row(None, 1),
+        ]
+    )
+    with _ingest_session() as session:
+        ingest_ftp_file(session, info, first, delta=True)
+        session.commit()
+        before = {r.sku: (r.id, r.raw_row_id) for r in session.query(CompetitorFtpRecord)}
+
+        stats = ingest_ftp_file(session, info, second, delta=True, chunk_size=2)
+        session.commit()
+
+        assert (stats["rows_total"], stats["rows_valid"], stats["rows_invalid"]) == (5, 4, 1)
+        assert stats["rows_inserted"] == 1
+        assert stats["rows_updated"] == 1
+        assert stats["rows_unchanged"] == 3
+        assert stats["rows_deleted"] == 1
+        after = {r.sku: r for r in session.query(CompetitorFtpRecord)}
+        assert sorted(after) == ["KEEP", "MOVE", "NEW", "PRICE"]
+        assert (after["KEEP"].id, after["KEEP"].raw_row_id) == before["KEEP"]
+        assert (after["MOVE"].id, after["MOVE"].raw_row_id) == before["MOVE"]
+        assert after["MOVE"].raw_row.row_index == 5
+        # изменённая цена — новая запись на той же сырой строке
+        assert after["PRICE"].raw_row_id == before["PRICE"][1]
+        assert after["PRICE"].id > max(record_id for record_id, _ in before.values())
+        assert float(after["PRICE"].price_opt) == 15
+        assert session.query(CompetitorFtpRawRow).count() == 5
+
+
+@pytest.mark.parametrize("sql_sku_stage", [True, False])
+def test_delta_ingest_price_change_reaches_competitor_price(sql_sku_stage):
+    info = _file_info()
+    days_back = (date.today() - info.file_date).days
+    with _ingest_session() as session:
+        session.add(Product(sku="PRICE", name="Дисплей"))
+        ingest_ftp_file(session, info, _build_workbook([HEADER, _price_row("PRICE", 10)]))
+        session.commit()
+        first = match_competitor_ftp_records(
+            session, days_back=days_back, sql_sku_stage=sql_sku_stage
+        )
+        assert first["prices_created"] == 1
+
+        # та же строка с тем же time, поменялась только цена
+        second = _build_workbook([HEADER, _price_row("PRICE", 97)])
+        assert ingest_ftp_file(session, info, second, delta=True)["rows_updated"] == 1
+        session.commit()
+        rerun = match_competitor_ftp_records(
+            session, days_back=days_back, sql_sku_stage=sql_sku_stage
+        )
+
+        assert rerun["processed"] == 1
+        assert (rerun["prices_created"], rerun["prices_updated"]) == (0, 1)
+        assert float(session.query(CompetitorPrice.price).scalar()) == 99
+
+
+def test_diff_value_tolerates_non_finite_prices():
+    assert _diff_value("price_opt", 12.5) == Decimal("12.50")
+    assert _diff_value("price_opt", Decimal("Infinity")) == "Infinity"
+    assert _diff_value("price_roz", float("nan")) == "nan"
+    # quantize вышел бы за точность контекста
+    assert _diff_value("price_roz", Decimal("1E+30")) == "1E+30"
+
+
+def test_raw_archive_keeps_only_invalid_raw_rows():
+    info = _file_info()
+    first = _build_workbook(
+        [
+            HEADER,
+            _price_row("KEEP", 10),
+            _price_row("PRICE", 12),
+            _price_row(None, 1),
+            _price_row("GONE", 13),
+        ]
+    )
+    second = _build_workbook(
+        [
+            HEADER,
+            _price_row(None, 1),
+            _price_row("KEEP", 10),
+            _price_row("PRICE", 15),
+        ]
+    )
+    with _ingest_session() as session:
+        stats = ingest_ftp_file(session, info, first, raw_archive=True)
+        session.commit()
+        assert stats["raw_archive_bytes"] > 0
+        raw = session.query(CompetitorFtpRawRow).one()
+        assert (raw.row_index, raw.error) == (4, "missing sku or link")
+        records = session.query(CompetitorFtpRecord).order_by(CompetitorFtpRecord.id).all()
+        assert [(r.sku, r.row_index, r.raw_row_id) for r in records] == [
+            ("KEEP", 2, None),
+            ("PRICE", 3, None),
+            ("GONE", 5, None),
+        ]
+        file_row = session.query(CompetitorFtpFile).one()
+        archived = list(iter_raw_archive(file_row.raw_archive))
+        assert [(r["row_index"], r["sku"], r["is_valid"]) for r in archived] == [
+            (2, "KEEP", True),
+            (3, "PRICE", True),
+            (4, None, False),
+            (5, "GONE", True),
+        ]
+        assert archived[1]["price_opt"] == Decimal("12")
+        keep_id = records[0].id
+
+        stats = ingest_ftp_file(session, info, second, raw_archive=True, delta=True)
+        session.commit()
+        delta_keys = ("rows_inserted", "rows_updated", "rows_unchanged", "rows_deleted")
+        assert [stats[key] for key in delta_keys] == [0, 1, 2, 1]
+        records = {r.sku: r for r in session.query(CompetitorFtpRecord)}
+        assert sorted(records) == ["KEEP", "PRICE"]
+        assert (records["KEEP"].id, records["KEEP"].row_index) == (keep_id, 3)
+        assert float(records["PRICE"].price_opt) == 15
+        assert session.query(CompetitorFtpRawRow.row_index).scalar() == 2
+        assert len(list(iter_raw_archive(session.query(CompetitorFtpFile).one().raw_archive))) == 3
+
+        # возврат к построчному хранению перезаписывает файл
+        stats = ingest_ftp_file(session, info, second, delta=True)
+        session.commit()
+        assert "rows_updated" not in stats
+        assert session.query(CompetitorFtpRawRow).count() == 3
+        assert session.query(CompetitorFtpFile.raw_archive).scalar() is None
+
+
+def test_copy_value_escapes_text_format():
+    assert _copy_value(None) == "\\N"
+    assert _copy_value(True) == "t"
+    assert _copy_value(date(2025, 11, 30)) == "2025-11-30"
+    assert _copy_value("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+
+
+def _mixed_workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    ws.append(["A", "SKU1", "Name1", 10, 12.5, "https://x", True, 5, "2025.11.30 00:10:11"])
+    ws.append(["B", 12345, 987, 9.99, "11,5", "https://y", "да", 3.0, datetime(2025, 11, 30, 8, 0)])
+    ws.append([None, "SKU3", None, None, None, "https://z", False, None, "2025.11.29 23:59:59"])
+    ws.append(
+        [
+            "C",
+            "SKU4",
+            CellRichText(["Дис", TextBlock(InlineFont(b=True), "плей")]),
+            1,
+            2,
+            "https://w",
+            None,
+            7,
+            "bad",
+        ]
+    )
+    ws["B8"] = "SKU5"  # gap rows and a sparse row
+    ws["F8"] = "https://v"
+    ws["I8"] = "2025.11.30 10:00:00"
+    ws["H8"] = 0
+    wb.create_sheet("other").append(["ignored"])
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "reader",
+    [
+        "xml",
+        pytest.param(
+            "calamine",
+            marks=pytest.mark.skipif(
+                not calamine_available(), reason="python-calamine is not installed"
+            ),
+        ),
+    ],
+)
+def test_xlsx_readers_match_openpyxl(reader):
+    content = _mixed_workbook()
+    expected, expected_mismatch = parse_ftp_xlsx(
+        content, file_date=date(2025, 11, 30), source="moba"
+    )
+    rows, mismatch = parse_ftp_xlsx(
+        content, file_date=date(2025, 11, 30), source="moba", reader=reader
+    )
+    assert len(expected) == 7
+    assert rows == expected
+    assert mismatch is expected_mismatch is True
+
+
+@pytest.mark.parametrize(
+    "reader",
+    [
+        "openpyxl",
+        "xml",
+        pytest.param(
+            "calamine",
+            marks=pytest.mark.skipif(
+                not calamine_available(), reason="python-calamine is not installed"
+            ),
+        ),
+    ],
+)
+def test_trailing_blank_rows_are_dropped_by_every_reader(reader):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    ws.append(["A", "SKU1", "Name1", 10, 12, "https://x", True, 5, "2025.11.30 00:10:11"])
+    ws.append([None] * len(HEADER))
+    ws.append(["B", "SKU2", "Name2", 10, 12, "https://y", True, 5, "2025.11.30 00:10:11"])
+    # оформленные пустые ячейки растягивают размер листа до 10 строк
+    for row in range(5, 11):
+        ws.cell(row=row, column=2).font = Font(bold=True)
+    buffer = BytesIO()
+    wb.save(buffer)
+
+    rows, _ = parse_ftp_xlsx(
+        buffer.getvalue(), file_date=date(2025, 11, 30), source="moba", reader=reader
+    )
+    assert [row.sku for row in rows] == ["SKU1", None, "SKU2"]
+    assert rows[1].error == "missing sku or link"
+
+
+
+@pytest.mark.parametrize(
+    "reader",
+    [
+        "openpyxl",
+        "xml",
+        pytest.param(
+            "calamine",
+            marks=pytest.mark.skipif(
+                not calamine_available(), reason="python-calamine is not installed"
+            ),
+        ),
+    ],
+)
+def test_parser_reads_spooled_file_path(tmp_path, reader):
+    content = _mixed_workbook()
+    path = tmp_path / "moba.xlsx"
+    path.write_bytes(content)
+    expected, _ = parse_ftp_xlsx(content, file_date=date(2025, 11, 30), source="moba")
+    rows, _ = parse_ftp_xlsx(path, file_date=date(2025, 11, 30), source="moba", reader=reader)
+    assert rows == expected
+
+
+def test_unknown_xlsx_reader_is_rejected():
+    content = _build_workbook([HEADER])
+    with pytest.raises(CompetitorFtpImportError):
+        iter_ftp_xlsx(content, source="moba", reader="xlrd")
+
+
+class _NlstFtp:
+    def __init__(self, names):
+        self.names = names
+        self.commands = []
+
+    def nlst(self, directory):
+        return [f"{directory}/{name}" for name in self.names]
+
+    def sendcmd(self, command):
+        self.commands.append(command)
+        return "213 20251130001510"
+
+    def size(self, path):
+        self.commands.append(f"SIZE {path}")
+        return 100
+
+
+class _MlsdFtp(_NlstFtp):
+    def mlsd(self, path, facts=()):
+        yield ".", {"type": "cdir"}
+        for name in self.names:
+            day = name[-7:-5]
+            yield name, {"type": "file", "size": "42", "modify": f"202511{day}001510.250"}
+
+
+def test_listing_falls_back_to_nlst_and_fetches_metadata_for_top_files_only():
+    source = parse_sources("moba:/moba:moba-{date}.xlsx")[0]
+    names = [f"moba-2025.11.{day:02d}.xlsx" for day in range(1, 31)] + ["readme.txt"]
+    ftp = _NlstFtp(names)
+    files = list_matching_files(ftp, source, limit=2)
+    assert [f.filename for f in files] == ["moba-2025.11.30.xlsx", "moba-2025.11.29.xlsx"]
+    assert files[0].size == 100
+    assert files[0].mtime == datetime(2025, 11, 30, 0, 15, 10, tzinfo=timezone.utc)
+    assert len(ftp.commands) == 4
+
+
+def test_listing_uses_mlsd_without_per_file_commands():
+    source = parse_sources("moba:/moba:moba-{date}.xlsx")[0]
+    ftp = _MlsdFtp([f"moba-2025.11.{day:02d}.xlsx" for day in range(1, 31)])
+    files = list_matching_files(ftp, source, limit=3)
+    assert [f.filename for f in files] == [
+        "moba-2025.11.30.xlsx",
+        "moba-2025.11.29.xlsx",
+        "moba-2025.11.28.xlsx",
+    ]
+    assert files[0].path == "/moba/moba-2025.11.30.xlsx"
+    assert files[0].size == 42
+    assert files[0].mtime == datetime(2025, 11, 30, 0, 15, 10, tzinfo=timezone.utc)
+    assert ftp.commands == []
+
+
+class _FailingMlsdFtp(_NlstFtp):
+    def __init__(self, names, error):
+        super().__init__(names)
+        self.error = error
+        self.listed = False
+
+    def mlsd(self, path, facts=()):
+        raise self.error
+
+    def nlst(self, directory):
+        self.listed = True
+        return super().nlst(directory)
+
+
+def test_listing_falls_back_to_nlst_only_when_mlsd_is_refused():
+    source = parse_sources("moba:/moba:moba-{date}.xlsx")[0]
+    refused = _FailingMlsdFtp(["moba-2025.11.30.xlsx"], error_perm("500 Unknown command"))
+    assert [f.filename for f in list_matching_files(refused, source)] == ["moba-2025.11.30.xlsx"]
+
+    for error in (error_temp("421 Timeout"), EOFError()):
+        ftp = _FailingMlsdFtp(["moba-2025.11.30.xlsx"], error)
+        with pytest.raises(CompetitorFtpImportError):
+            list_matching_files(ftp, source)
+        assert not ftp.listed
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import threading
+from ftplib import error_temp
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models import Base, CompetitorFtpFile, CompetitorFtpRecord
+from app.services.importers.competitor_ftp import ingest_ftp_file
+from app.workers.competitor_ftp import run_competitor_ftp_import
+
+HEADER = ["group", "sku", "name", "price_opt", "price_roz", "link", "stock", "amount", "time"]
+
+
+def _workbook(sku: str) -> bytes:
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    ws.append(["A", sku, "Name", 10, 12, "https://x", True, 5, "2025.11.30 00:10:11"])
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+class DummySettings:
+    competitor_ftp_import_enabled = True
+    competitor_ftp_sources = "moba:/moba:moba-{date}.xlsx"
+    competitor_ftp_max_files_per_source = 2
+    competitor_ftp_xlsx_reader = "openpyxl"
+    competitor_ftp_download_workers = 1
+    competitor_ftp_spool_downloads = True
+    competitor_ftp_spool_dir = None
+    competitor_ftp_download_retries = 3
+    competitor_ftp_cache_dir = None
+    competitor_ftp_cache_max_mb = 2048
+    competitor_ftp_cache_max_age_days = 30
+    competitor_ftp_delta_ingest = False
+    competitor_ftp_raw_archive = False
+
+
+class FakeFtp:
+    def __init__(self, files: dict[str, tuple[bytes, str]]) -> None:
+        # путь -> (содержимое, время MDTM)
+        self.files = files
+        self.downloads: list[str] = []
+        self.offsets: list[int] = []
+        self.drop_after: int | None = None
+
+    def nlst(self, directory: str) -> list[str]:
+        return [path for path in self.files if path.startswith(directory)]
+
+    def sendcmd(self, command: str) -> str:
+        _, path = command.split(" ", 1)
+        return f"213 {self.files[path][1]}"
+
+    def size(self, path: str) -> int:
+        return len(self.files[path][0])
+
+    def retrbinary(self, command: str, callback, blocksize: int = 8192, rest=None) -> None:
+        path = command.split(" ", 1)[1]
+        self.downloads.append(path)
+        self.offsets.append(rest or 0)
+        data = self.files[path][0][rest or 0 :]
+        if self.drop_after is not None:
+            callback(data[: self.drop_after])
+            self.drop_after = None
+            raise EOFError("connection dropped")
+        callback(data)
+
+    def quit(self) -> None:
+        return None
+
+
+def _run(monkeypatch, session: Session, ftp: FakeFtp, **kwargs) -> dict:
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: DummySettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    return run_competitor_ftp_import(session, **kwargs)
+
+
+def test_unchanged_files_are_not_downloaded_again(monkeypatch):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    path = "/moba/moba-2025.11.30.xlsx"
+    ftp = FakeFtp({path: (_workbook("SKU1"), "20251130001510")})
+
+    with Session(engine) as session:
+        first = _run(monkeypatch, session, ftp)
+        assert (first["processed_files"], first["skipped_files"]) == (1, 0)
+        stored = session.query(CompetitorFtpFile).one()
+        assert stored.size == len(ftp.files[path][0])
+        assert stored.content_hash is not None
+
+        second = _run(monkeypatch, session, ftp)
+        assert (second["processed_files"], second["skipped_files"]) == (0, 1)
+        assert second["sources"][0]["files"] == [
+            {"file": "moba-2025.11.30.xlsx", "skipped": "unchanged"}
+        ]
+        assert ftp.downloads == [path]
+
+        # файл тронут на сервере, байты те же: скачивается, но не загружается заново
+        ftp.files[path] = (ftp.files[path][0], "20251130101510")
+        third = _run(monkeypatch, session, ftp)
+        assert third["skipped_files"] == 1
+        assert third["sources"][0]["files"][0]["skipped"] == "same_content"
+        assert len(ftp.downloads) == 2
+
+        ftp.files[path] = (_workbook("SKU2"), "20251130111510")
+        fourth = _run(monkeypatch, session, ftp)
+        assert fourth["processed_files"] == 1
+        record = session.query(CompetitorFtpRecord).one()
+        assert record.sku == "SKU2"
+
+        forced = _run(monkeypatch, session, ftp, force=True)
+        assert (forced["processed_files"], forced["skipped_files"]) == (1, 0)
+
+
+def test_concurrent_downloads_ingest_every_source(monkeypatch):
+    class ConcurrentSettings(DummySettings):
+        competitor_ftp_sources = "moba:/moba:moba-{date}.xlsx,liberti:/liberti:liberti-{date}.xlsx"
+        competitor_ftp_download_workers = 3
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    ftp = FakeFtp(
+        {
+            "/moba/moba-2025.11.30.xlsx": (_workbook("M1"), "20251130001510"),
+            "/moba/moba-2025.11.29.xlsx": (_workbook("M0"), "20251129001510"),
+            "/moba/broken-2025.11.30.xlsx": (b"", "20251130001510"),
+            "/liberti/liberti-2025.11.30.xlsx": (b"not a workbook", "20251130001510"),
+        }
+    )
+    connections = []
+
+    def connect(settings):
+        connections.append(ftp)
+        return ftp
+
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: ConcurrentSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", connect)
+    with Session(engine) as session:
+        result = run_competitor_ftp_import(session)
+
+        assert result["processed_files"] == 2
+        assert result["errors"] == 1
+        moba, liberti = result["sources"]
+        assert [item["file"] for item in moba["files"]] == [
+            "moba-2025.11.30.xlsx",
+            "moba-2025.11.29.xlsx",
+        ]
+        assert liberti["files"] == [
+            {"file": "liberti-2025.11.30.xlsx", "error": "unexpected_error"}
+        ]
+        assert sorted(sku for (sku,) in session.query(CompetitorFtpRecord.sku)) == ["M0", "M1"]
+    assert 1 <= len(connections) <= 3
+
+
+def test_files_are_ingested_before_slow_listings_finish(monkeypatch):
+    class TwoSourceSettings(DummySettings):
+        competitor_ftp_sources = "moba:/moba:moba-{date}.xlsx,liberti:/liberti:liberti-{date}.xlsx"
+        competitor_ftp_download_workers = 2
+
+    ingested = threading.Event()
+    listed_after_ingest = []
+
+    class SlowListingFtp(FakeFtp):
+        def nlst(self, directory: str) -> list[str]:
+            # листинг liberti ждёт, пока файл moba будет записан в БД
+            if directory == "/liberti":
+                listed_after_ingest.append(ingested.wait(timeout=5))
+            return super().nlst(directory)
+
+    def ingest(*args, **kwargs):
+        stats = ingest_ftp_file(*args, **kwargs)
+        ingested.set()
+        return stats
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    ftp = SlowListingFtp(
+        {
+            "/moba/moba-2025.11.30.xlsx": (_workbook("M1"), "20251130001510"),
+            "/liberti/liberti-2025.11.30.xlsx": (_workbook("L1"), "20251130001510"),
+        }
+    )
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: TwoSourceSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    monkeypatch.setattr("app.workers.competitor_ftp.ingest_ftp_file", ingest)
+    with Session(engine) as session:
+        result = run_competitor_ftp_import(session)
+
+        assert listed_after_ingest == [True]
+        assert result["processed_files"] == 2
+        assert [source["files"][0]["file"] for source in result["sources"]] == [
+            "moba-2025.11.30.xlsx",
+            "liberti-2025.11.30.xlsx",
+        ]
+
+
+@pytest.mark.parametrize("spool", [True, False])
+def test_dropped_download_resumes_from_received_bytes(monkeypatch, tmp_path, spool):
+    class ResumeSettings(DummySettings):
+        competitor_ftp_spool_downloads = spool
+        competitor_ftp_spool_dir = str(tmp_path)
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    path = "/moba/moba-2025.11.30.xlsx"
+    ftp = FakeFtp({path: (_workbook("SKU1"), "20251130001510")})
+    ftp.drop_after = 1000
+
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: ResumeSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    with Session(engine) as session:
+        result = run_competitor_ftp_import(session)
+
+        assert result["processed_files"] == 1
+        assert ftp.offsets == [0, 1000]
+        assert session.query(CompetitorFtpRecord.sku).scalar() == "SKU1"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_reconnect_is_retried_and_resumes(monkeypatch):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    path = "/moba/moba-2025.11.30.xlsx"
+    ftp = FakeFtp({path: (_workbook("SKU1"), "20251130001510")})
+    ftp.drop_after = 1000
+    connects: list[object] = []
+
+    # первое переподключение после обрыва отвечает 421
+    def connect(settings):
+        connects.append(settings)
+        if len(connects) == 2:
+            raise error_temp("421 Too many connections")
+        return ftp
+
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: DummySettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", connect)
+    with Session(engine) as session:
+        result = run_competitor_ftp_import(session)
+
+        assert result["processed_files"] == 1
+        assert len(connects) == 3
+        assert ftp.offsets == [0, 1000]
+        assert session.query(CompetitorFtpRecord.sku).scalar() == "SKU1"
+
+
+def test_cache_serves_reingest_and_offline_mode(monkeypatch, tmp_path):
+    class CacheSettings(DummySettings):
+        competitor_ftp_cache_dir = str(tmp_path / "cache")
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    ftp = FakeFtp(
+        {
+            "/moba/moba-2025.11.30.xlsx": (_workbook("M1"), "20251130001510"),
+            "/moba/moba-2025.11.29.xlsx": (_workbook("M0"), "20251129001510"),
+        }
+    )
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: CacheSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    with Session(engine) as session:
+        assert run_competitor_ftp_import(session)["processed_files"] == 2
+        assert len(ftp.downloads) == 2
+
+        forced = run_competitor_ftp_import(session, force=True)
+        assert forced["processed_files"] == 2
+        assert all(item["from_cache"] for item in forced["sources"][0]["files"])
+        assert len(ftp.downloads) == 2
+
+    def no_network(settings):
+        raise AssertionError("offline mode must not connect")
+
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", no_network)
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        offline = run_competitor_ftp_import(session, offline=True)
+        assert offline["processed_files"] == 2
+        assert [item["file_date"] for item in offline["sources"][0]["files"]] == [
+            "2025-11-30",
+            "2025-11-29",
+        ]
+        assert sorted(sku for (sku,) in session.query(CompetitorFtpRecord.sku)) == ["M0", "M1"]
+
+
+def test_cache_read_error_is_recorded_per_file(monkeypatch, tmp_path):
+    class CacheSettings(DummySettings):
+        competitor_ftp_sources = "moba:/moba:moba-{date}.xlsx,liberti:/liberti:liberti-{date}.xlsx"
+        competitor_ftp_cache_dir = str(tmp_path / "cache")
+
+    def broken_get(self, info):
+        if info.source == "moba":
+            raise OSError("corrupt cache entry")
+        return None
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    ftp = FakeFtp(
+        {
+            "/moba/moba-2025.11.30.xlsx": (_workbook("M1"), "20251130001510"),
+            "/liberti/liberti-2025.11.30.xlsx": (_workbook("L1"), "20251130001510"),
+        }
+    )
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: CacheSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    monkeypatch.setattr("app.workers.competitor_ftp.FtpFileCache.get", broken_get)
+    with Session(engine) as session:
+        result = run_competitor_ftp_import(session)
+
+        assert (result["processed_files"], result["errors"]) == (1, 1)
+        moba, liberti = result["sources"]
+        assert moba["files"] == [{"file": "moba-2025.11.30.xlsx", "error": "unexpected_error"}]
+        assert liberti["files"][0]["rows_valid"] == 1
+
+
+def test_aborted_import_removes_spooled_downloads(monkeypatch, tmp_path):
+    class SpoolSettings(DummySettings):
+        competitor_ftp_spool_dir = str(tmp_path)
+        competitor_ftp_download_workers = 2
+
+    class Aborted(BaseException):
+        pass
+
+    def ingest(*args, **kwargs):
+        raise Aborted()
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    ftp = FakeFtp(
+        {
+            "/moba/moba-2025.11.30.xlsx": (_workbook("M1"), "20251130001510"),
+            "/moba/moba-2025.11.29.xlsx": (_workbook("M0"), "20251129001510"),
+        }
+    )
+    monkeypatch.setattr("app.workers.competitor_ftp.get_settings", lambda: SpoolSettings())
+    monkeypatch.setattr("app.workers.competitor_ftp._connect_ftp", lambda settings: ftp)
+    monkeypatch.setattr("app.workers.competitor_ftp.ingest_ftp_file", ingest)
+    with Session(engine) as session, pytest.raises(Aborted):
+        run_competitor_ftp_import(session)
+    assert list(tmp_path.iterdir()) == []
@@ -1,17 +1,41 @@
+import importlib.util
+import re
+import sys
 from datetime import date, datetime, timezone
 
+import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 
 from app.models import (
     Base,
     Competitor,
+    CompetitorFtpMatchState,
     CompetitorFtpRecord,
+    CompetitorNameFeature,
     CompetitorPrice,
+    PhoneModel,
     Product,
     ProductMatch,
+    ProductMatchOverride,
+)
+from app.services.competitor_matching import (
+    BrandModelIndex,
+    MatchWriter,
+    PhoneModelCache,
+    _extract_brand_model,
+    _extract_display_type,
+    _extract_in_frame,
+    _extract_name_features,
+    _extract_quality,
+    _extract_variant,
+    _load_existing_prices,
+    match_competitor_ftp_records,
+)
+
+requires_numpy = pytest.mark.skipif(
+    importlib.util.find_spec("numpy") is None, reason="numpy is not installed"
 )
-from app.services.competitor_matching import match_competitor_ftp_records
 
 
 def setup_db():
@@ -271,3 +295,577 @@ def test_disambiguate_by_quality():
         assert result["matched"] == 1
         pm = session.query(ProductMatch).one()
         assert pm.product_id == product1.id
+
+
+def _ambiguous_color_setup(session):
+    black = Product(sku="IP11-BLK", name="Дисплей для Apple iPhone 11 + тачскрин (черный)")
+    white = Product(sku="IP11-WHT", name="Дисплей для Apple iPhone 11 + тачскрин (белый)")
+    session.add_all([black, white])
+    record = _sku_record(1, "", 200, datetime.now(timezone.utc))
+    record.name = "Дисплей для iPhone 11 в сборе с тачскрином Белый"
+    session.add(record)
+    session.commit()
+    return black, white
+
+
+@requires_numpy
+def test_ambiguous_candidates_ranked_by_name_similarity():
+    engine = setup_db()
+    with Session(engine) as session:
+        _, white = _ambiguous_color_setup(session)
+
+        result = match_competitor_ftp_records(session, days_back=10, fuzzy_threshold=0.4)
+        assert result["matched"] == 1
+        assert result["fuzzy_matched"] == 1
+        assert result["ambiguous"] == 0
+        pm = session.query(ProductMatch).one()
+        assert pm.product_id == white.id
+        assert 0.4 <= pm.confidence < 1.0
+
+
+@requires_numpy
+def test_fuzzy_match_keeps_override_manual_flag():
+    engine = setup_db()
+    with Session(engine) as session:
+        _, white = _ambiguous_color_setup(session)
+        session.add(
+            ProductMatchOverride(competitor_source="moba", competitor_sku=None, quality="premium")
+        )
+        session.commit()
+
+        result = match_competitor_ftp_records(session, days_back=10, fuzzy_threshold=0.4)
+        assert result["fuzzy_matched"] == 1
+        pm = session.query(ProductMatch).one()
+        assert pm.product_id == white.id
+        assert pm.is_manual is True
+        assert pm.quality == "premium"
+        assert pm.phone_model_id is not None
+
+
+def test_fuzzy_ranking_without_numpy_fails_clearly(monkeypatch):
+    monkeypatch.setitem(sys.modules, "app.services.name_similarity", None)
+    engine = setup_db()
+    with Session(engine) as session:
+        _ambiguous_color_setup(session)
+
+        with pytest.raises(RuntimeError, match="numpy"):
+            match_competitor_ftp_records(session, days_back=10, fuzzy_threshold=0.4)
+
+
+def test_fuzzy_scoring_is_off_by_default():
+    engine = setup_db()
+    with Session(engine) as session:
+        _ambiguous_color_setup(session)
+
+        result = match_competitor_ftp_records(session, days_back=10)
+        assert result["matched"] == 0
+        assert result["ambiguous"] == 1
+        assert session.query(ProductMatch).count() == 0
+
+
+def test_ambiguous_sku_stays_unmatched_by_default():
+    engine = setup_db()
+    with Session(engine) as session:
+        session.add_all([Product(sku="lcd 3", name="Дисплей"), Product(sku="LCD3", name="Дисп")])
+        record = _sku_record(1, "LCD3", 300, datetime.now(timezone.utc))
+        record.name = "Дисплей"
+        session.add(record)
+        session.commit()
+
+        result = match_competitor_ftp_records(session, days_back=10)
+        assert result["ambiguous"] == 1
+        assert result["fuzzy_matched"] == 0
+        assert session.query(ProductMatch).count() == 0
+        assert session.query(CompetitorPrice).count() == 0
+
+
+def test_brand_model_index_matches_linear_scan():
+    class _Product:
+        def __init__(self, id_):
+            self.id = id_
+
+    catalog = [
+        "6s", "6splus", "11", "11pro", "11promax", "12", "12pro", "x", "xr", "xsmax", "se2020"
+    ]
+    index = BrandModelIndex()
+    entries = []
+    for idx, model in enumerate(catalog):
+        product = _Product(idx)
+        index.add("apple", model, product)
+        entries.append((model, product))
+
+    queries = [["11"], ["11pro"], ["6s"], ["x"], ["12", "12pro"], ["se"], ["14"], ["xsmaxa"]]
+    for models in queries:
+        expected = []
+        for cand_model, cand_product in entries:
+            if any(cand_model == m or cand_model in m or m in cand_model for m in models):
+                if cand_product not in expected:
+                    expected.append(cand_product)
+        assert index.candidates("apple", models) == expected
+    assert index.candidates("samsung", ["11"]) == []
+
+
+def _sku_record(
+    raw_row_id: int, sku: str, price: int, observed_at: datetime
+) -> CompetitorFtpRecord:
+    return CompetitorFtpRecord(
+        raw_row_id=raw_row_id,
+        file_id=1,
+        source="moba",
+        file_date=date.today(),
+        group_name="grp",
+        sku=sku,
+        name="Name",
+        price_opt=None,
+        price_roz=price,
+        link="http://x",
+        in_stock=True,
+        amount=1,
+        observed_at=observed_at,
+    )
+
+
+def test_rerun_does_not_duplicate_prices_or_matches():
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    with Session(engine) as session:
+        session.add(Product(sku="LCD-1", name="Test"))
+        session.add_all(
+            [_sku_record(1, "lcd-1", 100, observed_at), _sku_record(2, "LCD-1", 110, observed_at)]
+        )
+        session.commit()
+
+        first = match_competitor_ftp_records(session, days_back=10)
+        assert first["matched"] == 2
+        assert first["prices_created"] == 1
+        assert first["matches_created"] == 1
+
+        second = match_competitor_ftp_records(session, days_back=10, full=True)
+        assert second["matched"] == 2
+        assert second["prices_created"] == 0
+        assert second["matches_created"] == 0
+        assert session.query(CompetitorPrice).count() == 1
+        assert session.query(ProductMatch).count() == 1
+
+
+def test_bulk_writer_fills_existing_match_in_chunks():
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    with Session(engine) as session:
+        products = [Product(sku=f"LCD-{idx}", name="Test") for idx in range(3)]
+        competitor = Competitor(name="moba")
+        session.add_all([*products, competitor])
+        session.flush()
+        session.add(
+            ProductMatch(product_id=products[0].id, competitor_id=competitor.id, quality=None)
+        )
+        records = [_sku_record(idx, f"lcd-{idx}", 100 + idx, observed_at) for idx in range(3)]
+        records[0].name = "Дисплей ORIG"
+        session.add_all(records)
+        session.commit()
+
+        result = match_competitor_ftp_records(session, days_back=10, write_chunk_size=1)
+        assert result["matched"] == 3
+        assert result["prices_created"] == 3
+        assert result["matches_created"] == 2
+
+        assert session.query(CompetitorPrice).count() == 3
+        assert session.query(ProductMatch).count() == 3
+        existing = session.query(ProductMatch).filter_by(product_id=products[0].id).one()
+        assert existing.quality == "orig"
+
+
+@pytest.mark.parametrize("upsert", [True, False])
+def test_match_writer_keeps_existing_values(monkeypatch, upsert):
+    if not upsert:
+        monkeypatch.setattr(
+            "app.services.competitor_matching._dialect_insert", lambda session: None
+        )
+    engine = setup_db()
+    with Session(engine) as session:
+        products = [Product(sku=f"LCD-{idx}", name="Test") for idx in range(3)]
+        phone_models = [PhoneModel(brand="apple", model_name=name) for name in ("11", "12")]
+        competitor = Competitor(name="moba")
+        session.add_all([*products, *phone_models, competitor])
+        session.flush()
+        session.add_all(
+            [
+                ProductMatch(
+                    product_id=products[0].id,
+                    competitor_id=competitor.id,
+                    phone_model_id=phone_models[0].id,
+                    quality="orig",
+                    is_manual=True,
+                ),
+                ProductMatch(product_id=products[1].id, competitor_id=competitor.id),
+            ]
+        )
+        session.flush()
+
+        writer = MatchWriter(session)
+        for product in products:
+            writer.add_match(
+                {
+                    "product_id": product.id,
+                    "competitor_id": competitor.id,
+                    "competitor_sku": "X",
+                    "confidence": 1.0,
+                    "is_manual": False,
+                    "phone_model_id": phone_models[1].id,
+                    "quality": "copy",
+                }
+            )
+        writer.flush()
+        session.expire_all()
+
+        rows = {
+            pm.product_id: (pm.phone_model_id, pm.quality, pm.is_manual)
+            for pm in session.query(ProductMatch)
+        }
+        assert rows == {
+            products[0].id: (phone_models[0].id, "orig", True),
+            products[1].id: (phone_models[1].id, "copy", False),
+            products[2].id: (phone_models[1].id, "copy", False),
+        }
+
+
+def test_incremental_run_processes_only_new_records():
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    with Session(engine) as session:
+        session.add_all([Product(sku="LCD-1", name="Test"), Product(sku="LCD-2", name="Test")])
+        session.add(_sku_record(1, "lcd-1", 100, observed_at))
+        session.commit()
+
+        first = match_competitor_ftp_records(session, days_back=10)
+        assert first["mode"] == "incremental"
+        assert first["processed"] == 1
+
+        assert match_competitor_ftp_records(session, days_back=10) == {
+            "skipped": True,
+            "reason": "no_records",
+        }
+
+        session.add(_sku_record(2, "lcd-2", 120, observed_at))
+        session.commit()
+        third = match_competitor_ftp_records(session, days_back=10)
+        assert third["processed"] == 1
+        assert third["prices_created"] == 1
+
+        full = match_competitor_ftp_records(session, days_back=10, full=True)
+        assert full["mode"] == "full"
+        assert full["processed"] == 2
+        assert full["prices_created"] == 0
+
+
+def test_streaming_run_commits_per_chunk():
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    with Session(engine) as session:
+        session.add_all([Product(sku=f"LCD-{idx}", name="Test") for idx in range(3)])
+        session.add_all(
+            [
+                _sku_record(idx, f"lcd-{idx % 3}", 100 + idx, observed_at.replace(hour=idx))
+                for idx in range(5)
+            ]
+        )
+        session.commit()
+
+        result = match_competitor_ftp_records(
+            session, days_back=10, read_chunk_size=2, sql_sku_stage=False
+        )
+        assert result["chunks"] == 3
+        assert result["processed"] == 5
+        assert result["prices_created"] == 5
+        # повтор товара в следующем чанке не создаёт вторую связь
+        assert result["matches_created"] == 3
+        assert session.query(ProductMatch).count() == 3
+        last_record = (
+            session.query(CompetitorFtpRecord).order_by(CompetitorFtpRecord.id.desc()).first()
+        )
+        state = session.query(CompetitorFtpMatchState).filter_by(source="moba").one()
+        assert state.last_record_id == last_record.id
+
+
+def test_existing_prices_are_looked_up_per_chunk(monkeypatch):
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    lookups = []
+
+    def spy(session, competitor_id, product_ids, since, until):
+        lookups.append((list(product_ids), since.hour, until.hour))
+        return _load_existing_prices(session, competitor_id, product_ids, since, until)
+
+    monkeypatch.setattr("app.services.competitor_matching._load_existing_prices", spy)
+    with Session(engine) as session:
+        session.add_all([Product(sku="LCD-1", name="Test"), Product(sku="LCD-2", name="Test")])
+        session.add_all(
+            [
+                _sku_record(1, "lcd-1", 100, observed_at),
+                _sku_record(2, "lcd-2", 200, observed_at.replace(hour=3)),
+                _sku_record(3, "lcd-1", 110, observed_at),
+            ]
+        )
+        session.commit()
+
+        result = match_competitor_ftp_records(
+            session, days_back=10, read_chunk_size=1, sql_sku_stage=False
+        )
+        # цена первого чанка уже записана, третий чанк её не дублирует
+        assert result["prices_created"] == 2
+        assert session.query(CompetitorPrice).count() == 2
+        assert lookups == [([1], 0, 0), ([2], 3, 3), ([1], 0, 0)]
+
+
+def test_profile_reports_stage_timings():
+    engine = setup_db()
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    with Session(engine) as session:
+        session.add(Product(sku="LCD-1", name="Test"))
+        session.add_all(
+            [_sku_record(1, "lcd-1", 100, observed_at), _sku_record(2, "nope", 100, observed_at)]
+        )
+        session.commit()
+
+        assert "profile" not in match_competitor_ftp_records(session, days_back=10, full=True)
+        result = match_competitor_ftp_records(
+            session, days_back=10, full=True, profile=True, sql_sku_stage=False
+        )
+        profile = result["profile"]
+        assert profile["total_seconds"] >= 0
+        for stage in (
+            "load_products",
+            "load_overrides",
+            "read_records",
+            "sku_match",
+            "existence_checks",
+            "commit",
+        ):
+            assert profile[stage]["seconds"] >= 0
+        assert profile["sku_match"]["count"] == 2
+        assert profile["brand_model_fallback"]["count"] == 1
+        # запись с товаром и проверка цен чанка
+        assert profile["existence_checks"]["count"] == 2
+
+
+def _sku_stage_fixture(session):
+    observed_at = datetime(2025, 11, 30, 0, 0, 0, tzinfo=timezone.utc)
+    session.add_all(
+        [
+            Product(sku="LCD-1", name="Test"),
+            Product(sku="LCD-2", name="Test"),
+            Product(sku="lcd 3", name="Dup"),
+            Product(sku="LCD3", name="Dup"),
+            Product(sku="LCD-4", name="Test"),
+        ]
+    )
+    competitor = Competitor(name="moba")
+    session.add(competitor)
+    session.flush()
+    session.add(ProductMatch(product_id=2, competitor_id=competitor.id, quality=None))
+    session.add(
+        ProductMatchOverride(competitor_source="moba", competitor_sku="LCD-4", quality="premium")
+    )
+    records = [
+        _sku_record(1, "lcd-1", 100, observed_at),
+        _sku_record(2, "LCD-1", 110, observed_at),
+        _sku_record(3, "lcd-1", 120, observed_at.replace(hour=5)),
+        _sku_record(4, "LCD-2", 200, observed_at),
+        _sku_record(5, "LCD-2", 210, observed_at.replace(hour=5)),
+        _sku_record(6, "LCD3", 300, observed_at),
+        _sku_record(7, "LCD-4", 400, observed_at),
+        _sku_record(8, "LCD-1", None, observed_at),
+    ]
+    records[1].name = "Дисплей copy"
+    # кириллица: lower() в SQLite её не переводит в нижний регистр
+    records[3].name = "Дисплей Копия"
+    records[4].name = "Дисплей orig"
+    session.add_all(records)
+    session.commit()
+
+
+def _match_snapshot(session):
+    prices = sorted(
+        (p.product_id, p.competitor_id, float(p.price), p.collected_at.replace(tzinfo=None))
+        for p in session.query(CompetitorPrice)
+    )
+    matches = sorted(
+        (m.product_id, m.competitor_id, m.competitor_sku, m.quality, m.is_manual)
+        for m in session.query(ProductMatch)
+    )
+    return prices, matches
+
+
+def test_sql_sku_stage_matches_python_path():
+    results = {}
+    for sql_stage in (False, True):
+        engine = setup_db()
+        with Session(engine) as session:
+            _sku_stage_fixture(session)
+            result = match_competitor_ftp_records(session, days_back=10, sql_sku_stage=sql_stage)
+            results[sql_stage] = (result, _match_snapshot(session))
+
+    python_result, python_rows = results[False]
+    sql_result, sql_rows = results[True]
+    assert sql_rows == python_rows
+    assert [m[3] for m in sql_rows[1] if m[0] in (1, 2)] == ["copy", "copy"]
+    for key in (
+        "processed",
+        "matched",
+        "prices_created",
+        "prices_updated",
+        "matches_created",
+        "ambiguous",
+        "skipped_no_price",
+    ):
+        assert sql_result[key] == python_result[key], key
+    # lcd-1 x3 и LCD-2 x2; дубль SKU, оверрайд и запись без цены ушли в Python
+    assert sql_result["sql_matched"] == 5
+    assert python_result["sql_matched"] == 0
+
+
+def test_sql_sku_stage_advances_watermark():
+    engine = setup_db()
+    with Session(engine) as session:
+        _sku_stage_fixture(session)
+        match_competitor_ftp_records(session, days_back=10)
+        state = session.query(CompetitorFtpMatchState).filter_by(source="moba").one()
+        assert state.last_record_id == 8
+
+        assert match_competitor_ftp_records(session, days_back=10) == {
+            "skipped": True,
+            "reason": "no_records",
+        }
+
+
+def test_name_features_are_cached_between_runs():
+    engine = setup_db()
+    with Session(engine) as session:
+        session.add(Product(sku="123", name="Дисплей для Apple iPhone 6S в сборе (чёрный)"))
+        record = _sku_record(1, "", 150, datetime.now(timezone.utc))
+        record.name = "Дисплей для iPhone 6S в сборе с тачскрином Черный - Оптима"
+        session.add(record)
+        session.commit()
+
+        first = match_competitor_ftp_records(session, days_back=10)
+        assert first["matched"] == 1
+        assert first["feature_cache_hits"] == 0
+        assert first["feature_cache_misses"] == 2
+        assert session.query(CompetitorNameFeature).count() == 2
+
+        second = match_competitor_ftp_records(session, days_back=10, full=True)
+        assert second["matched"] == 1
+        assert second["feature_cache_hits"] == 2
+        assert second["feature_cache_misses"] == 0
+
+
+def test_shared_lower_name_features_match_helpers():
+    names = [
+        "Дисплей для iPhone 11 (A2221) Hard-OLED без рамки в рамке ORIG100",
+        "Дисплей для Samsung s23ultraпро Ultra (Soft OLED) no frame",
+        "Дисплей для Apple iPhone 12 / iPhone 12 Pro + тачскрин (черный) (GX ORIG) (Hard Oled)",
+        "Дисплей для Xiaomi Redmi Note 10/10S/Poco M5s (M2101K7AG) в сборе Черный - (OLED)",
+        "Дисплей iPhone 4 в сборе с тачскрином (Black 1-я категория IC) incell",
+        "AMOLED optimaaa",
+        None,
+    ]
+    for name in names:
+        features = _extract_name_features(name)
+        brand, models = _extract_brand_model(name)
+        assert (features.brand, list(features.models)) == (brand, models)
+        assert features.quality == _extract_quality(name)
+        assert features.display_type == _extract_display_type(name)
+        assert features.in_frame == _extract_in_frame(name)
+        if brand and models:
+            _, variant = _extract_variant(re.findall(r"[A-Za-z0-9]+", name.lower()))
+            assert features.variant == variant
+
+
+def test_phone_models_are_created_once_per_identity():
+    engine = setup_db()
+    with Session(engine) as session:
+        session.add_all(
+            [
+                Product(
+                    sku="S23U-1", name="Дисплей для Samsung Galaxy S23 Ultra + тачскрин (черный)"
+                ),
+                Product(sku="IP11-1", name="Дисплей для Apple iPhone 11 + тачскрин (черный)"),
+                PhoneModel(brand="apple", model_name="11", variant=None),
+            ]
+        )
+        names = [
+            "Дисплей для Galaxy S23 Ultra (OLED) Black",
+            "Дисплей для Galaxy S23 Ultra в сборе Black",
+            "Дисплей для iPhone 11 (A2221) в сборе с тачскрином Черный - OR",
+        ]
+        for idx, name in enumerate(names):
+            record = _sku_record(idx, "", 100, datetime(2025, 11, 30, idx, tzinfo=timezone.utc))
+            record.name = name
+            session.add(record)
+        session.commit()
+
+        result = match_competitor_ftp_records(session, days_back=10, write_chunk_size=1)
+        assert result["matched"] == 3
+        assert result["phone_models_created"] == 1
+        assert session.query(PhoneModel).count() == 2
+
+        samsung = session.query(PhoneModel).filter_by(brand="samsung").one()
+        assert samsung.model_name == "s23ultra"
+        assert samsung.variant == "ultra"
+        match_models = {pm.phone_model_id for pm in session.query(ProductMatch)}
+        assert samsung.id in match_models
+        assert None not in match_models
+
+
+def test_phone_model_cache_counts_only_inserted_rows():
+    engine = setup_db()
+    with Session(engine) as session:
+        cache = PhoneModelCache(session)
+        assert cache.get(("apple", "11", "pro")) is None
+        assert cache.get(("apple", "12", "pro")) is None
+        # модель успел создать параллельный шард
+        session.add(PhoneModel(brand="apple", model_name="11", variant="pro"))
+        session.flush()
+
+        cache.flush()
+        assert cache.created == 1
+        assert session.query(PhoneModel).count() == 2
+        assert cache.get(("apple", "11", "pro")) is not None
+        assert cache.get(("apple", "12", "pro")) is not None
+
+
+def test_overrides_are_resolved_in_batch():
+    engine = setup_db()
+    with Session(engine) as session:
+        target = Product(sku="TARGET", name="Target")
+        phone_model = PhoneModel(brand="apple", model_name="11", variant="pro")
+        session.add_all([target, phone_model])
+        session.flush()
+        session.add_all(
+            [
+                ProductMatchOverride(
+                    competitor_source="moba",
+                    competitor_sku="ABC-1",
+                    product_id=target.id,
+                    brand="apple",
+                    model="11",
+                    quality="orig",
+                ),
+                ProductMatchOverride(
+                    competitor_source="moba",
+                    competitor_sku="ABC-2",
+                    product_id=target.id,
+                    phone_model_id=999,
+                ),
+            ]
+        )
+        session.add(_sku_record(1, "abc-1", 100, datetime(2025, 11, 30, tzinfo=timezone.utc)))
+        session.commit()
+
+        result = match_competitor_ftp_records(session, days_back=10)
+        assert result["matched"] == 1
+        pm = session.query(ProductMatch).one()
+        assert pm.product_id == target.id
+        assert pm.phone_model_id == phone_model.id
+        assert pm.quality == "orig"
+        assert pm.is_manual is True
@@ -0,0 +1,92 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models import Base, CompetitorFtpRecord, CompetitorPrice, Product
+from app.services.competitor_matching import match_competitor_ftp_records, merge_match_results
+from app.workers.competitor_matching import run_parallel_competitor_matching
+
+
+def _record(raw_row_id: int, source: str, sku: str) -> CompetitorFtpRecord:
+    return CompetitorFtpRecord(
+        raw_row_id=raw_row_id,
+        file_id=1,
+        source=source,
+        file_date=date.today(),
+        group_name="grp",
+        sku=sku,
+        name="Name",
+        price_opt=None,
+        price_roz=100,
+        link="http://x",
+        in_stock=True,
+        amount=1,
+        observed_at=datetime(2025, 11, 30, tzinfo=timezone.utc),
+    )
+
+
+def test_parallel_matching_merges_shards(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    try:
+        with Session(sqlite_engine) as session:
+            session.add_all([Product(sku="LCD-1", name="Test"), Product(sku="LCD-2", name="Test")])
+            session.add_all(
+                [
+                    _record(1, "moba", "lcd-1"),
+                    _record(2, "moba", "missing"),
+                    _record(3, "liberti", "lcd-2"),
+                ]
+            )
+            session.commit()
+
+        result = run_parallel_competitor_matching(
+            str(sqlite_engine.url), workers=2, days_back=10
+        )
+        assert result["shards"] == 2
+        assert "errors" not in result
+        assert result["processed"] == 3
+        assert result["matched"] == 2
+        assert result["unmatched"] == 1
+        assert len(result["unmatched_samples"]) == 1
+
+        with Session(sqlite_engine) as session:
+            assert session.query(CompetitorPrice).count() == 2
+    finally:
+        Base.metadata.drop_all(sqlite_engine)
+
+
+def test_merge_match_results_skips_empty_shards():
+    merged = merge_match_results(
+        [
+            {"skipped": True, "reason": "no_records"},
+            {"skipped": False, "mode": "incremental", "processed": 2, "matched": 1},
+        ]
+    )
+    assert merged["skipped"] is False
+    assert merged["processed"] == 2
+    assert merged["matched"] == 1
+    assert merge_match_results([{"skipped": True}]) == {"skipped": True, "reason": "no_records"}
+
+
+def test_merge_match_results_merges_profiles():
+    results = []
+    for source in ("moba", "liberti"):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add(Product(sku="LCD-1", name="Test"))
+            session.add_all([_record(1, source, "lcd-1"), _record(2, source, "missing")])
+            session.commit()
+            results.append(
+                match_competitor_ftp_records(
+                    session, days_back=10, profile=True, sql_sku_stage=False
+                )
+            )
+
+    merged = merge_match_results(results)
+    profile = merged["profile"]
+    assert profile["total_seconds"] == max(result["profile"]["total_seconds"] for result in results)
+    assert profile["sku_match"]["count"] == 4
+    assert profile["sku_match"]["seconds"] >= 0
+    assert merged["processed"] == 4
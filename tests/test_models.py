@@ -1,9 +1,9 @@
 from datetime import datetime
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert
 from sqlalchemy.orm import Session
 
-from app.models import Base, Competitor, CompetitorPrice, Product
+from app.models import Base, Competitor, CompetitorPrice, Product, ProductMatchOverride
 
 
 def test_models_relationships_and_constraints() -> None:
@@ -28,3 +28,27 @@ def test_models_relationships_and_constraints() -> None:
         assert stored_price is not None
         assert stored_price.product.sku == "SKU123"
         assert stored_price.competitor.name == "Test Competitor"
+
+
+def test_sku_norm_is_filled_for_orm_and_core_writes() -> None:
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        product = Product(sku=" LCD – 1 ", name="Test")
+        override = ProductMatchOverride(competitor_source="moba", competitor_sku="Q 1")
+        wildcard = ProductMatchOverride(competitor_source="liberti", competitor_sku=None)
+        session.add_all([product, override, wildcard])
+        session.execute(
+            insert(Product.__table__), [{"sku": "Core 2", "name": "Bulk", "is_active": True}]
+        )
+        session.commit()
+
+        assert product.sku_norm == "lcd-1"
+        assert override.competitor_sku_norm == "q1"
+        assert wildcard.competitor_sku_norm is None
+        assert session.query(Product).filter_by(sku="Core 2").one().sku_norm == "core2"
+
+        product.sku = "LCD-9"
+        session.commit()
+        assert session.query(Product).filter_by(sku_norm="lcd-9").one() is product
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services.name_similarity import (  # noqa: E402
+    SCORE_BATCH,
+    TrigramSimilarity,
+    name_trigrams,
+    pick_best,
+)
+
+CATALOG = [
+    (1, "Дисплей для Apple iPhone 11 + тачскрин (черный)"),
+    (2, "Дисплей для Apple iPhone 11 + тачскрин (белый)"),
+    (3, "Аккумулятор для Samsung Galaxy A50"),
+    (4, "Шлейф для Xiaomi Redmi Note 8 Pro"),
+]
+
+
+def _naive_cosine(similarity: TrigramSimilarity, query: str, doc_id: int) -> float:
+    query_idx, query_weights = similarity._vectorize(name_trigrams(query))
+    doc_idx, doc_weights = similarity._vectors[doc_id]
+    doc = dict(zip(doc_idx.tolist(), doc_weights.tolist(), strict=True))
+    pairs = zip(query_idx.tolist(), query_weights.tolist(), strict=True)
+    return sum(weight * doc.get(idx, 0.0) for idx, weight in pairs)
+
+
+def test_batch_scores_match_pairwise_cosine():
+    similarity = TrigramSimilarity().fit(CATALOG)
+    queries = ["Дисплей iPhone 11 белый", "АКБ Samsung A50", "шлейф redmi note 8 pro", ""]
+    candidates = [[1, 2], [3, 1], [4, 3, 2], [1]]
+    # больше SCORE_BATCH строк — проверяем и разбиение на пачки
+    repeat = SCORE_BATCH // len(queries) + 1
+    scores = similarity.score(queries * repeat, candidates * repeat)
+
+    assert len(scores) == len(queries) * repeat
+    for row, (query, ids) in enumerate(zip(queries * repeat, candidates * repeat, strict=True)):
+        expected = [_naive_cosine(similarity, query, doc_id) for doc_id in ids]
+        assert np.allclose(scores[row], expected, atol=1e-5)
+    assert scores[0][1] > scores[0][0]
+    assert scores[3][0] == 0.0
+
+
+def test_identical_name_scores_one():
+    similarity = TrigramSimilarity().fit(CATALOG)
+    (scores,) = similarity.score([CATALOG[2][1]], [[3]])
+    assert math.isclose(float(scores[0]), 1.0, rel_tol=1e-5)
+
+
+def test_pick_best_requires_threshold_and_margin():
+    assert pick_best(np.array([0.3, 0.9]), 0.5, 0.05) == (1, 0.9)
+    assert pick_best(np.array([0.3, 0.45]), 0.5, 0.05) is None
+    assert pick_best(np.array([0.88, 0.9]), 0.5, 0.05) is None
+    assert pick_best(np.array([]), 0.5, 0.05) is None